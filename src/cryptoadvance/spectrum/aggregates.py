@@ -0,0 +1,122 @@
+"""Per-wallet aggregates (balance, tx-count and version)
+
+getbalances and getwalletinfo used to sum up all the scripts and count all the txs of
+a wallet on every call. Instead, sync_script adds the deltas of a script to the
+WalletAggregate of its wallet within the same transaction. check_aggregates()
+recomputes everything and fixes the aggregates if they drifted.
+
+The version gets incremented with every change, so everything derived from the
+wallet's scripts and txs can be cached per version.
+"""
+
+import logging
+
+from sqlalchemy import func
+
+from .db import Script, Tx, Wallet, WalletAggregate, db
+
+logger = logging.getLogger(__name__)
+
+
+def compute_aggregate(wallet_id: int) -> dict:
+    """Calculates the aggregate of a wallet from scratch"""
+    confirmed, unconfirmed = (
+        db.session.query(func.sum(Script.confirmed), func.sum(Script.unconfirmed))
+        .filter(Script.wallet_id == wallet_id)
+        .first()
+    )
+    txcount = (
+        db.session.query(Tx.txid).filter(Tx.wallet_id == wallet_id).distinct().count()
+    )
+    return {
+        "confirmed": confirmed or 0,
+        "unconfirmed": unconfirmed or 0,
+        "txcount": txcount,
+    }
+
+
+def recompute_aggregate(wallet_id: int) -> WalletAggregate:
+    """Recalculates the aggregate and stores it in the session"""
+    existing = WalletAggregate.query.get(wallet_id)
+    return db.session.merge(
+        WalletAggregate(
+            wallet_id=wallet_id,
+            version=existing.version + 1 if existing else 0,
+            **compute_aggregate(wallet_id),
+        )
+    )
+
+
+def get_aggregate(wallet_id: int) -> WalletAggregate:
+    """The aggregate of a wallet. Read-only: if the row is missing, a computed one
+    is returned without storing it (only the writer-thread writes).
+    """
+    aggregate = WalletAggregate.query.get(wallet_id)
+    if aggregate is None:
+        aggregate = WalletAggregate(
+            wallet_id=wallet_id, version=0, **compute_aggregate(wallet_id)
+        )
+    return aggregate
+
+
+def add_to_aggregate(wallet_id: int, confirmed=0, unconfirmed=0, txcount=0) -> None:
+    """Adds deltas to the aggregate of a wallet and increments its version,
+    in the current transaction. Call it without deltas for other changes.
+    """
+    table = WalletAggregate.__table__
+    result = db.session.execute(
+        table.update()
+        .where(table.c.wallet_id == wallet_id)
+        .values(
+            confirmed=table.c.confirmed + confirmed,
+            unconfirmed=table.c.unconfirmed + unconfirmed,
+            txcount=table.c.txcount + txcount,
+            version=table.c.version + 1,
+        )
+    )
+    if result.rowcount == 0:
+        # the changes of the caller are already in the session
+        recompute_aggregate(wallet_id)
+
+
+def existing_txids(wallet_id: int, txids) -> set:
+    """Returns the subset of txids which the wallet has (on any script)"""
+    if not txids:
+        return set()
+    return {
+        txid
+        for (txid,) in db.session.query(Tx.txid)
+        .filter(Tx.wallet_id == wallet_id, Tx.txid.in_(list(txids)))
+        .distinct()
+    }
+
+
+def check_aggregates(fix=True) -> list:
+    """Compares the aggregates of all wallets with freshly computed ones and returns
+    a list of the wallets which differ. Fixes them if fix is True.
+    """
+    mismatches = []
+    for wallet in Wallet.query.all():
+        expected = compute_aggregate(wallet.id)
+        aggregate = WalletAggregate.query.get(wallet.id)
+        actual = (
+            {
+                "confirmed": aggregate.confirmed,
+                "unconfirmed": aggregate.unconfirmed,
+                "txcount": aggregate.txcount,
+            }
+            if aggregate
+            else None
+        )
+        if actual != expected:
+            logger.warning(
+                f"Aggregate of wallet {wallet.name} is {actual} but should be {expected}"
+            )
+            mismatches.append(
+                {"wallet": wallet.name, "actual": actual, "expected": expected}
+            )
+            if fix:
+                recompute_aggregate(wallet.id)
+    if fix:
+        db.session.commit()
+    return mismatches
@@ -0,0 +1,100 @@
+"""Concurrent execution of JSON-RPC batches
+
+Specter sends arrays of requests which mix cheap database reads with calls that wait
+for the electrum-server (e.g. getrawtransaction). Executed one after the other, a batch
+takes the sum of its items. The BatchExecutor runs the items of a batch on a shared,
+bounded thread-pool so that it takes about as long as its slowest item.
+
+Items which change state (e.g. createwallet, setlabel) act as barriers: they run on
+their own, after everything before them and before everything after them, so that a
+batch behaves as if it was executed sequentially.
+
+Each batch uses at most `concurrency` threads (one of them is the calling thread), so
+a single huge batch can't occupy the whole pool. The results keep the order of the
+requests. The pool-threads run in the app_context of the caller and therefore get
+their own db.session.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class BatchExecutor:
+    def __init__(self, workers=8, concurrency=4):
+        """
+        - workers: size of the pool shared by all batches (<= 1: no pool, sequential)
+        - concurrency: default of how many items of one batch run at the same time
+        """
+        self.concurrency = concurrency
+        self._pool = None
+        if workers > 1:
+            self._pool = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="spectrum-rpc"
+            )
+
+    def map(self, fn, items: list, concurrency: int = None, barrier=None) -> list:
+        """Returns [fn(item) for item in items], computed concurrently.
+        Items for which barrier(item) is True run on their own.
+        If calls raise, the exception of the first failing item is re-raised.
+        """
+        if barrier is None:
+            return self._map(fn, items, concurrency)
+        results = []
+        segment = []
+        for item in items:
+            if barrier(item):
+                results += self._map(fn, segment, concurrency)
+                results.append(fn(item))
+                segment = []
+            else:
+                segment.append(item)
+        return results + self._map(fn, segment, concurrency)
+
+    def _map(self, fn, items: list, concurrency: int = None) -> list:
+        concurrency = min(concurrency or self.concurrency, len(items))
+        if self._pool is None or concurrency <= 1:
+            return [fn(item) for item in items]
+        app = current_app._get_current_object() if has_app_context() else None
+        parent_span = tracer.current()
+        results = [None] * len(items)
+        errors = [None] * len(items)
+        indexes = iter(range(len(items)))
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                with lock:
+                    i = next(indexes, None)
+                if i is None:
+                    return
+                try:
+                    results[i] = fn(items[i])
+                except Exception as e:
+                    errors[i] = e
+
+        def work_in_context():
+            with tracer.attach(parent_span):
+                if app is None:
+                    return work()
+                with app.app_context():
+                    work()
+
+        futures = [self._pool.submit(work_in_context) for _ in range(concurrency - 1)]
+        work()
+        for future in futures:
+            future.result()
+        for e in errors:
+            if e is not None:
+                raise e
+        return results
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
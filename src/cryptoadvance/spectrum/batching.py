@@ -0,0 +1,104 @@
+"""Group commits of the sync-process
+
+Committing after every synced script means one (fsync-backed) transaction per script.
+The CommitBatcher collects the mutations of several scripts in the session of the
+writing thread (see writer.py) and commits every n scripts or every t milliseconds.
+As sessions are thread-local, every thread batches its own mutations.
+
+Other threads (e.g. RPC-calls which want to read what has been synced) can ask the
+writing threads to flush and wait for it.
+"""
+
+import logging
+import threading
+import time
+
+from .db import db
+
+logger = logging.getLogger(__name__)
+
+
+class CommitBatcher:
+    def __init__(self, every=50, interval_ms=500, durability="full"):
+        """
+        - every: commit at the latest after that many scripts
+        - interval_ms: commit at the latest after that time since the first uncommitted script
+        - durability: "full" uses the database defaults, "relaxed" doesn't wait for the
+          data to be on disk (synchronous_commit off on postgres, synchronous=NORMAL
+          on sqlite). A crash might then lose the last batches which simply get resynced.
+        """
+        if durability not in ["full", "relaxed"]:
+            raise ValueError(f"Unknown durability {durability}")
+        self.every = every
+        self.interval = interval_ms / 1000
+        self.durability = durability
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all_flushed = threading.Condition(self._lock)
+        self._dirty_threads = 0
+        self._flush_requested = False
+
+    @property
+    def pending(self) -> int:
+        """Uncommitted scripts of the current thread"""
+        return getattr(self._local, "count", 0)
+
+    def begin(self):
+        """Call before mutating the session for a script"""
+        if self.pending == 0 and self.durability == "relaxed":
+            dialect = db.session.get_bind().dialect.name
+            if dialect == "postgresql":
+                db.session.execute("SET LOCAL synchronous_commit TO OFF")
+            elif dialect == "sqlite":
+                db.session.execute("PRAGMA synchronous = NORMAL")
+
+    def done(self):
+        """Call after the mutations of a script are in the session.
+        Commits if the batch is full, old enough or a flush was requested.
+        """
+        if self.pending == 0:
+            self._local.started = time.time()
+            with self._lock:
+                self._dirty_threads += 1
+        self._local.count = self.pending + 1
+        if (
+            self._local.count >= self.every
+            or time.time() - self._local.started >= self.interval
+            or self._flush_requested
+        ):
+            self.flush()
+
+    def flush(self):
+        """Commits the session of the current thread"""
+        db.session.commit()
+        self._reset()
+
+    def rollback(self):
+        """Throws away the batch of the current thread. As the script's state is part
+        of the batch as well, those scripts will simply be synced again later.
+        """
+        db.session.rollback()
+        self._reset()
+
+    def _reset(self):
+        if self.pending == 0:
+            return
+        self._local.count = 0
+        with self._lock:
+            self._dirty_threads -= 1
+            if self._dirty_threads == 0:
+                self._flush_requested = False
+                self._all_flushed.notify_all()
+
+    def wait_for_flush(self, timeout=None) -> bool:
+        """Asks all threads with uncommitted scripts to commit and waits for it (at most
+        timeout seconds, defaults to the interval). Returns False if that didn't happen.
+        """
+        if self._dirty_threads == 0:
+            return True
+        with self._lock:
+            self._flush_requested = True
+            return self._all_flushed.wait_for(
+                lambda: self._dirty_threads == 0,
+                timeout=self.interval if timeout is None else timeout,
+            )
@@ -0,0 +1,100 @@
+"""Bulk persistence of Script, Tx and UTXO rows
+
+Adding ORM objects one by one to the session means a lot of unit-of-work overhead per
+row. The functions here insert plain dicts via SQLAlchemy Core (executemany) or via
+COPY on Postgres, within the transaction of the current db.session. The resulting
+rows are the same as if the ORM objects had been added.
+"""
+
+import io
+import logging
+from enum import Enum
+
+from .db import HexBytes, db
+
+logger = logging.getLogger(__name__)
+
+# below that, executemany is faster than setting up a COPY
+COPY_MIN_ROWS = 100
+
+
+def bulk_insert(model, rows: list) -> None:
+    """Inserts rows (dicts like {"column_name": value}) into the table of model.
+    Pending ORM-changes get flushed first so the order of operations is preserved.
+    The caller has to commit.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    rows = [complete_row(table, row) for row in rows]
+    db.session.flush()
+    conn = db.session.connection()
+    if conn.dialect.name == "postgresql" and len(rows) >= COPY_MIN_ROWS:
+        _copy(conn, table, rows)
+    else:
+        conn.execute(table.insert(), rows)
+    logger.debug(f"Inserted {len(rows)} rows into {table.name}")
+
+
+def complete_row(table, row: dict) -> dict:
+    """Adds the scalar defaults of the columns which are not in row. All rows
+    need the same keys for executemany and COPY doesn't know about python-defaults.
+    """
+    complete = {}
+    for column in table.columns:
+        if column.name in row:
+            complete[column.name] = row[column.name]
+        elif column.primary_key:
+            continue
+        elif column.default is not None and column.default.is_scalar:
+            complete[column.name] = column.default.arg
+        else:
+            complete[column.name] = None
+    return complete
+
+
+def _copy(conn, table, rows):
+    columns = list(rows[0].keys())
+    # quoted as e.g. "index" is a reserved word
+    column_list = ",".join(f'"{c}"' for c in columns)
+    binary = {c.name for c in table.columns if isinstance(c.type, HexBytes)}
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(
+            ",".join(
+                _csv_value(_bytea(row[c]) if c in binary else row[c]) for c in columns
+            )
+        )
+        buf.write("\n")
+    buf.seek(0)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv)',
+            buf,
+        )
+    finally:
+        cursor.close()
+
+
+def _csv_value(value) -> str:
+    """Formats a value for COPY ... WITH (FORMAT csv) where an unquoted empty
+    string is NULL and a quoted one is an empty string
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, Enum):
+        # sqlalchemy's Enum stores the name
+        value = value.name
+    if isinstance(value, int):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _bytea(value):
+    """bytea in the hex-format COPY expects"""
+    if value is None:
+        return None
+    return "\\x" + (value.hex() if isinstance(value, bytes) else value)
@@ -6,7 +6,9 @@ from logging.config import dictConfig
 
 import click
 
+from .cli_db import check_aggregates_command
 from .cli_server import server
+from .cli_sync import sync_command
 
 
 @click.group()
@@ -16,6 +18,8 @@ def entry_point(debug):
 
 
 entry_point.add_command(server)
+entry_point.add_command(check_aggregates_command)
+entry_point.add_command(sync_command)
 
 
 def setup_logging(debug=False):
@@ -0,0 +1,33 @@
+import logging
+
+import click
+
+from ..aggregates import check_aggregates
+from ..db import db
+from ..migrations import migrate
+from ..server import create_app
+
+logger = logging.getLogger(__name__)
+
+
+@click.command("check-aggregates")
+@click.option(
+    "--config",
+    default="cryptoadvance.spectrum.config.LocalElectrumConfig",
+    help="A class which sets reasonable default values.",
+)
+@click.option("--fix/--no-fix", default=True, help="Fix the aggregates which differ.")
+def check_aggregates_command(config, fix):
+    """Recomputes the balance and txcount of all wallets and compares them to the
+    incrementally maintained ones.
+    """
+    app = create_app(config)
+    db.init_app(app)
+    with app.app_context():
+        migrate()
+        mismatches = check_aggregates(fix=fix)
+    for m in mismatches:
+        click.echo(f"{m['wallet']}: {m['actual']} != {m['expected']}")
+    click.echo(
+        f"{len(mismatches)} wallets differed" + (" and got fixed" if fix else "")
+    )
@@ -1,6 +1,6 @@
 import logging
 import os
-from ..server import create_app, init_app
+from ..server import create_app, init_app, run_server
 import click
 
 logger = logging.getLogger(__name__)
@@ -32,4 +32,4 @@ def server(port, host, cert, key, config):
     app = create_app(config)
     init_app(app)
     logger.info("Starting up ...")
-    app.run(debug=debug, port=app.config["PORT"], host=host)
+    run_server(app, host, app.config["PORT"], debug=debug)
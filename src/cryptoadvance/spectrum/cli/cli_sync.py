@@ -0,0 +1,30 @@
+import logging
+import time
+
+import click
+
+from ..server import create_app, init_sync_process
+
+logger = logging.getLogger(__name__)
+
+
+@click.command("sync")
+@click.option(
+    "--config",
+    default="cryptoadvance.spectrum.config.LocalElectrumConfig",
+    help="A class which sets reasonable default values.",
+)
+def sync_command(config):
+    """Runs the Electrum-connection and the sync as a process of its own. Start the
+    server with SYNC_PROCESS=true to let it forward to this one.
+    """
+    app = create_app(config)
+    init_sync_process(app)
+    logger.info("Syncing ...")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Shutting down ...")
+    app.election.stop()
+    app.spectrum.stop()
@@ -0,0 +1,83 @@
+"""Negotiated compression of the responses
+
+listtransactions, gettransaction (with the hex) or PSBTs can be hundreds of kilobytes
+of JSON, which compresses to a fraction. That matters for a Specter reaching Spectrum
+over Tor. With COMPRESSION_ENABLED, responses get compressed if the client accepts
+it (Accept-Encoding) and they're at least COMPRESSION_MIN_SIZE bytes:
+
+- zstd, if the client prefers it and the zstandard package is installed
+- gzip otherwise
+
+Streamed responses (see streaming.py) don't have a size upfront. They're big by
+nature, so they always get compressed, chunk by chunk.
+"""
+
+import gzip
+import logging
+import zlib
+
+from flask import request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+
+def available_encodings() -> list:
+    """The supported encodings, preferred first"""
+    return ["zstd", "gzip"] if zstandard else ["gzip"]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_chunks(chunks, encoding: str):
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    else:
+        # wbits 16 + 15: with gzip-header and -trailer
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def init_compression(app):
+    """Compresses the responses of the app if COMPRESSION_ENABLED"""
+    if not app.config.get("COMPRESSION_ENABLED"):
+        return
+    min_size = app.config.get("COMPRESSION_MIN_SIZE", 1024)
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(available_encodings())
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = compress_chunks(response.iter_encoded(), encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -19,6 +19,70 @@ class BaseConfig(object):
     HOST = "127.0.0.1"
     PORT = 8081
     SPECTRUM_DATADIR = "data"  # used for sqlite but also for txs-cache
+    # utxos and balances of scripts are derived from the (cached) transactions.
+    # Every n-th script-sync is cross-checked with the electrum-server (0 = never)
+    UTXO_VERIFICATION_INTERVAL = int(
+        os.environ.get("UTXO_VERIFICATION_INTERVAL", default="0")
+    )
+    # Scripts are derived (and subscribed) up to GAP_LIMIT beyond the highest used index
+    # and extended on activity. 0 derives the full range of importdescriptor upfront.
+    GAP_LIMIT = int(os.environ.get("GAP_LIMIT", default="20"))
+    # The sync commits every n scripts or after t milliseconds, "relaxed" durability
+    # doesn't wait for the disk (a crash might lose batches which then get resynced)
+    SYNC_COMMIT_EVERY = int(os.environ.get("SYNC_COMMIT_EVERY", default="50"))
+    SYNC_COMMIT_INTERVAL_MS = int(
+        os.environ.get("SYNC_COMMIT_INTERVAL_MS", default="500")
+    )
+    SYNC_COMMIT_DURABILITY = os.environ.get("SYNC_COMMIT_DURABILITY", default="full")
+    # processes used to derive big address-ranges (1 = no pool, derive inline)
+    DERIVATION_WORKERS = int(
+        os.environ.get("DERIVATION_WORKERS", default=str(os.cpu_count() or 1))
+    )
+    # threads shared by all JSON-RPC batches and how many items of a single batch
+    # run concurrently (1 = sequential)
+    RPC_BATCH_WORKERS = int(os.environ.get("RPC_BATCH_WORKERS", default="16"))
+    RPC_BATCH_CONCURRENCY = int(os.environ.get("RPC_BATCH_CONCURRENCY", default="4"))
+    # responses of polled wallet-rpcs kept in memory (0 = no caching)
+    RPC_CACHE_SIZE = int(os.environ.get("RPC_CACHE_SIZE", default="1024"))
+    # streamed results (listtransactions, listunspent) up to that many items get cached
+    RPC_STREAM_CACHE_ITEMS = int(
+        os.environ.get("RPC_STREAM_CACHE_ITEMS", default="1000")
+    )
+    # several processes (e.g. gunicorn-workers) elect one which syncs, the others
+    # forward Electrum-calls to its internal API on SYNC_LEADER_HOST:PORT (leader.py)
+    SYNC_LEADER_ELECTION = _get_bool_env_var("SYNC_LEADER_ELECTION", default="false")
+    SYNC_LEADER_HOST = os.environ.get("SYNC_LEADER_HOST", default="127.0.0.1")
+    SYNC_LEADER_PORT = int(os.environ.get("SYNC_LEADER_PORT", default="8082"))
+    # the RPC-server doesn't sync but forwards to a separate `spectrum sync` process
+    SYNC_PROCESS = _get_bool_env_var("SYNC_PROCESS", default="false")
+    SYNC_LEADER_POLL_INTERVAL = float(
+        os.environ.get("SYNC_LEADER_POLL_INTERVAL", default="1")
+    )
+    # serve counters and latencies on /metrics (metrics.py)
+    METRICS_ENABLED = _get_bool_env_var("METRICS_ENABLED", default="false")
+    # jsonrpc-calls slower than that get recorded (0 = never, profiling.py)
+    SLOW_CALL_THRESHOLD_MS = int(os.environ.get("SLOW_CALL_THRESHOLD_MS", default="0"))
+    # exports tracing-spans (OTLP/JSON) to that file if set (tracing.py)
+    TRACING_FILE = os.environ.get("TRACING_FILE")
+    # bearer-token for the /admin endpoints, which are disabled without it
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+    # gzip/zstd-compress responses of at least that many bytes if the client accepts
+    # it (compression.py)
+    COMPRESSION_ENABLED = _get_bool_env_var("COMPRESSION_ENABLED", default="true")
+    COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", default="1024"))
+    # "werkzeug" (the development server) or "waitress": a production server with
+    # HTTP/1.1 keep-alive and a fixed pool of HTTP_THREADS threads. Idle connections
+    # are kept open for HTTP_KEEPALIVE_TIMEOUT seconds.
+    HTTP_SERVER = os.environ.get("HTTP_SERVER", default="werkzeug")
+    HTTP_THREADS = int(os.environ.get("HTTP_THREADS", default="16"))
+    HTTP_KEEPALIVE_TIMEOUT = int(
+        os.environ.get("HTTP_KEEPALIVE_TIMEOUT", default="120")
+    )
+    HTTP_CONNECTION_LIMIT = int(os.environ.get("HTTP_CONNECTION_LIMIT", default="100"))
+    # with waitress, long-polls of /wallet/<name>/events waiting at once, each one
+    # holds one of the HTTP_THREADS. Further ones get a 503 with Retry-After.
+    # 0: HTTP_THREADS // 2
+    EVENTS_MAX_WAITING = int(os.environ.get("EVENTS_MAX_WAITING", default="0"))
 
 
 # Level 1: How does persistence work?
@@ -31,6 +95,18 @@ class LiteConfig(BaseConfig):
     )
     SQLALCHEMY_DATABASE_URI = "sqlite:///" + DATABASE
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # set on every connection, see engines.py. WAL lets RPC-calls read while the sync
+    # writes, NORMAL is still safe in WAL-mode (but might lose the last commits on a
+    # power loss). An empty dict disables the profile.
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # in KiB
+        "busy_timeout": 30000,  # ms
+    }
+    # read-only connections for RPC-calls, all writes go through a single connection
+    SQLITE_READ_POOL_SIZE = int(os.environ.get("SQLITE_READ_POOL_SIZE", default="4"))
 
 
 class PostgresConfig(BaseConfig):
@@ -5,11 +5,12 @@
 """
 
 from flask_sqlalchemy import SQLAlchemy
-from embit.descriptor import Descriptor as EmbitDescriptor
-from embit.descriptor.checksum import add_checksum
 from embit.script import Script as EmbitScript
 from enum import Enum
+from functools import lru_cache
 import time
+from .derivation import CachedDescriptor, derived_descriptor, get_cached_descriptor
+from .engines import SpectrumSQLAlchemy
 from .util import sat_to_btc
 from sqlalchemy.ext.declarative import declared_attr
 from cryptoadvance.spectrum.util_specter import snake_case2camelcase
@@ -23,7 +24,7 @@ class NoNameMeta(BindMetaMixin, DeclarativeMeta):
 
 CustomModel = declarative_base(cls=Model, metaclass=NoNameMeta, name="Model")
 
-db = SQLAlchemy(model_class=CustomModel)
+db = SpectrumSQLAlchemy(model_class=CustomModel)
 # db = SQLAlchemy()
 
 
@@ -45,6 +46,22 @@ class TxCategory(Enum):
         return self.name.lower()
 
 
+class HexBytes(db.TypeDecorator):
+    """Hex-strings in python, binary in the database (half the size of the hex)"""
+
+    impl = db.LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, bytes):
+            return value
+        return bytes.fromhex(value)
+
+    def process_result_value(self, value, dialect):
+        # postgres returns a memoryview
+        return None if value is None else bytes(value).hex()
+
+
 class Wallet(SpectrumModel):
     id = db.Column(db.Integer, primary_key=True)
     # maybe later User can be added to the wallet,
@@ -64,13 +81,21 @@ class Wallet(SpectrumModel):
                 return desc
 
     def get_keypool(self, internal=False):
-        # TODO
-        return 1000
+        """Number of derived but not yet handed out addresses of the active descriptor"""
+        desc = self.get_descriptor(internal=internal)
+        if desc is None:
+            return 0
+        max_index = desc.max_derived_index()
+        if max_index is None:
+            return 0
+        return max(max_index + 1 - (desc.next_index or 0), 0)
 
 
 class Descriptor(SpectrumModel):
     """Descriptors tracked by the wallet"""
 
+    __table_args__ = (db.Index("ix_spectrum_descriptor_wallet", "wallet_id"),)
+
     id = db.Column(db.Integer, primary_key=True)
     wallet_id = db.Column(
         db.Integer, db.ForeignKey(f"{Wallet.__tablename__}.id"), nullable=False
@@ -90,29 +115,60 @@ class Descriptor(SpectrumModel):
     # address index used by the next getnewaddress() call
     next_index = db.Column(db.Integer, default=0)
 
+    def max_derived_index(self):
+        """The highest index we've derived (and subscribed) a script for, None if none"""
+        return (
+            db.session.query(db.func.max(Script.index))
+            .filter(Script.descriptor_id == self.id)
+            .scalar()
+        )
+
+    @property
+    def cached(self) -> CachedDescriptor:
+        """The parsed descriptor, including private keys if available"""
+        return get_cached_descriptor(self.private_descriptor or self.descriptor)
+
     def getscriptpubkey(self, index=None):
         if index is None:
             index = self.next_index
-        d = EmbitDescriptor.from_string(self.private_descriptor or self.descriptor)
-        return d.derive(index).script_pubkey()
+        return self.cached.script_pubkey(index)
 
     def derive(self, index):
-        d = EmbitDescriptor.from_string(self.private_descriptor or self.descriptor)
-        d = d.derive(index)
-        for k in d.keys:
-            k.key = k.key.get_public_key()
-        return add_checksum(str(d))
+        return derived_descriptor(self.private_descriptor or self.descriptor, index)
 
     def get_descriptor(self, index=None):
-        """Returns Descriptor class"""
-        d = EmbitDescriptor.from_string(self.private_descriptor or self.descriptor)
+        """Returns Descriptor class, the derived one is public. Don't modify it, it's cached."""
         if index is not None:
-            d = d.derive(index)
-        return d
+            return self.cached.derive(index)
+        return self.cached.parsed
+
+
+def script_address(script_hex: str, network) -> str:
+    """Cached as it's needed for every row of listtransactions, listunspent & co"""
+    return _script_address(
+        script_hex, network["bech32"], network["p2pkh"], network["p2sh"]
+    )
+
+
+@lru_cache(maxsize=65536)
+def _script_address(script_hex, bech32, p2pkh, p2sh):
+    # all of the network that Script.address() uses
+    network = {"bech32": bech32, "p2pkh": p2pkh, "p2sh": p2sh}
+    return EmbitScript(bytes.fromhex(script_hex)).address(network)
 
 
 # We store script pubkeys instead of addresses as database is chain-agnostic
 class Script(SpectrumModel):
+    __table_args__ = (
+        # notifications
+        db.Index("ix_spectrum_script_scripthash", "scripthash"),
+        # address lookups (getaddressinfo, setlabel, psbts ...)
+        db.Index("ix_spectrum_script_wallet_script", "wallet_id", "script"),
+        db.Index("ix_spectrum_script_wallet_label", "wallet_id", "label"),
+        # derivation window and subscriptions per descriptor
+        db.Index("ix_spectrum_script_descriptor_index", "descriptor_id", "index"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     wallet_id = db.Column(
         db.Integer, db.ForeignKey(f"{Wallet.__tablename__}.id"), nullable=False
@@ -129,19 +185,19 @@ class Script(SpectrumModel):
     # derivation index if it's our address
     index = db.Column(db.Integer, nullable=True, default=None)
 
-    script = db.Column(db.String(100), nullable=False)
+    script = db.Column(HexBytes, nullable=False)
     label = db.Column(db.String(500), nullable=True, default=None)
     # scripthash for electrum subscribtions, store for lookups
-    scripthash = db.Column(db.String(64), nullable=True, default=None)
+    scripthash = db.Column(HexBytes, nullable=True, default=None)
     # electrum stuff - hash of all txs on the address
-    state = db.Column(db.String(64), nullable=True, default=None)
+    state = db.Column(HexBytes, nullable=True, default=None)
     # confirmed balance in sat
     confirmed = db.Column(db.BigInteger, default=0)
     # unconfirmed balance in sat
     unconfirmed = db.Column(db.BigInteger, default=0)
 
     def address(self, network):
-        return self.script_pubkey.address(network)
+        return script_address(self.script, network)
 
     @property
     def script_pubkey(self):
@@ -149,8 +205,14 @@ class Script(SpectrumModel):
 
 
 class UTXO(SpectrumModel):
+    __table_args__ = (
+        db.Index("ix_spectrum_utxo_wallet_locked", "wallet_id", "locked"),
+        db.Index("ix_spectrum_utxo_wallet_outpoint", "wallet_id", "txid", "vout"),
+        db.Index("ix_spectrum_utxo_script", "script_id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    txid = db.Column(db.String(64))
+    txid = db.Column(HexBytes)
     vout = db.Column(db.Integer)
     height = db.Column(db.Integer, default=None)
     # amount in sat
@@ -167,9 +229,16 @@ class UTXO(SpectrumModel):
 
 
 class Tx(SpectrumModel):
+    __table_args__ = (
+        db.Index("ix_spectrum_tx_wallet_txid", "wallet_id", "txid"),
+        # listtransactions: newest first and keyset-pagination
+        db.Index("ix_spectrum_tx_wallet_height_id", "wallet_id", "height", "id"),
+        db.Index("ix_spectrum_tx_script", "script_id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    txid = db.Column(db.String(64))
-    blockhash = db.Column(db.String(64), default=None)
+    txid = db.Column(HexBytes)
+    blockhash = db.Column(HexBytes, default=None)
     height = db.Column(db.Integer, default=None)
     blocktime = db.Column(db.BigInteger, default=None)
     replaceable = db.Column(db.Boolean, default=False)
@@ -186,33 +255,79 @@ class Tx(SpectrumModel):
     wallet = db.relationship("Wallet", backref=db.backref("txs", lazy=True))
 
     def to_dict(self, blockheight, network):
-        confirmed = bool(self.height)
-        confs = (blockheight - self.height + 1) if self.height else 0
-        t = self.blocktime if confirmed else int(time.time())
-        obj = {
-            "address": self.script.address(network),
-            "category": str(self.category),
-            "amount": sat_to_btc(self.amount),
-            "label": "",
-            "vout": self.vout,
-            "confirmations": confs,
-            "txid": self.txid,
-            "time": t,
-            "timereceived": t,
-            "walletconflicts": [],
-            "bip125-replaceable": "yes" if self.replaceable else "no",
-            "script_id": self.script_id,
-        }
-        if self.category == TxCategory.SEND:
-            obj.update({"fee": -sat_to_btc(self.fee or 0)})
-        if confirmed:
-            obj.update(
-                {
-                    "blockhash": self.blockhash,
-                    "blockheight": self.height,
-                    "blocktime": t,
-                }
-            )
-        else:
-            obj.update({"trusted": False})
-        return obj
+        return tx_to_dict(self, self.script.script, blockheight, network)
+
+
+# the columns tx_to_dict() needs, to query them without loading Tx-objects
+TX_DICT_COLUMNS = [
+    Tx.txid,
+    Tx.blockhash,
+    Tx.height,
+    Tx.blocktime,
+    Tx.replaceable,
+    Tx.category,
+    Tx.vout,
+    Tx.amount,
+    Tx.fee,
+    Tx.script_id,
+]
+
+
+def tx_to_dict(tx, script_hex, blockheight, network):
+    """tx is a Tx or a row with the TX_DICT_COLUMNS, script_hex its Script.script"""
+    confirmed = bool(tx.height)
+    confs = (blockheight - tx.height + 1) if tx.height else 0
+    t = tx.blocktime if confirmed else int(time.time())
+    obj = {
+        "address": script_address(script_hex, network),
+        "category": str(tx.category),
+        "amount": sat_to_btc(tx.amount),
+        "label": "",
+        "vout": tx.vout,
+        "confirmations": confs,
+        "txid": tx.txid,
+        "time": t,
+        "timereceived": t,
+        "walletconflicts": [],
+        "bip125-replaceable": "yes" if tx.replaceable else "no",
+        "script_id": tx.script_id,
+    }
+    if tx.category == TxCategory.SEND:
+        obj.update({"fee": -sat_to_btc(tx.fee or 0)})
+    if confirmed:
+        obj.update(
+            {
+                "blockhash": tx.blockhash,
+                "blockheight": tx.height,
+                "blocktime": t,
+            }
+        )
+    else:
+        obj.update({"trusted": False})
+    return obj
+
+
+class WalletAggregate(SpectrumModel):
+    """Balance and tx-count per wallet, maintained by the sync (see aggregates.py)"""
+
+    wallet_id = db.Column(
+        db.Integer,
+        db.ForeignKey(f"{Wallet.__tablename__}.id"),
+        primary_key=True,
+        autoincrement=False,
+    )
+    # sum of Script.confirmed/unconfirmed in sat
+    confirmed = db.Column(db.BigInteger, default=0, nullable=False)
+    unconfirmed = db.Column(db.BigInteger, default=0, nullable=False)
+    # number of distinct txids
+    txcount = db.Column(db.Integer, default=0, nullable=False)
+    # incremented on every change of the wallet's scripts and txs
+    version = db.Column(db.BigInteger, default=0, nullable=False)
+
+
+class SchemaVersion(SpectrumModel):
+    """The migrations (see migrations.py) which have been applied to the database"""
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200))
+    applied = db.Column(db.BigInteger, default=lambda: int(time.time()))
@@ -0,0 +1,144 @@
+"""Cached parsing and fast child derivation of descriptors
+
+Parsing a descriptor (up to 3000 chars for a 15-of-15 multisig) is expensive and so is
+deriving a child from e.g. [fgp/48h/1h/0h/2h]xpub/0/* as every key needs to be derived
+along the whole path. A CachedDescriptor keeps the parsed descriptor and a public copy
+of it where all keys are already derived up to the wildcard, so deriving index i is
+only the final non-hardened step.
+
+The DerivationService spreads the derivation of large index ranges across a process
+pool as that's pure-python EC math which would otherwise block one core (and the GIL).
+"""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from embit.descriptor import Descriptor as EmbitDescriptor
+from embit.descriptor.checksum import add_checksum
+from embit.descriptor.arguments import AllowedDerivation, KeyOrigin
+
+from .util import scripthash
+
+logger = logging.getLogger(__name__)
+
+
+class CachedDescriptor:
+    def __init__(self, desc: str):
+        self.parsed = EmbitDescriptor.from_string(desc)
+        # a separate instance as we're modifying the keys
+        self._branch = EmbitDescriptor.from_string(desc)
+        seen = set()
+        for k in self._branch.keys:
+            if id(k) in seen:
+                continue
+            seen.add(id(k))
+            if k.can_derive:
+                # e.g. [0, None] for xpub/<0;1>/*
+                der = k.allowed_derivation.fill(None)
+                pos = der.index(None) if None in der else len(der)
+                prefix, suffix = der[:pos], der[pos + 1 :]
+                if k.origin:
+                    k.origin = KeyOrigin(
+                        k.origin.fingerprint, k.origin.derivation + prefix
+                    )
+                else:
+                    k.origin = KeyOrigin(k.key.my_fingerprint, prefix)
+                if prefix:
+                    k.key = k.key.derive(prefix)
+                k.allowed_derivation = (
+                    AllowedDerivation([None] + suffix) if pos < len(der) else None
+                )
+            if k.allowed_derivation is None:
+                # all derived descriptors will share this key
+                k.key = k.get_public_key()
+            elif k.is_private:
+                k.key = k.key.to_public()
+
+    def derive(self, index: int) -> EmbitDescriptor:
+        """Returns the public descriptor derived at index, equivalent to
+        parsed.derive(index) but only doing the last derivation step per key
+        """
+        return self._branch.derive(index)
+
+    def script_pubkey(self, index: int):
+        return self.derive(index).script_pubkey()
+
+
+@lru_cache(maxsize=4096)
+def get_cached_descriptor(desc: str) -> CachedDescriptor:
+    """Returns the CachedDescriptor for a descriptor-string. The returned
+    objects are shared, so don't modify them.
+    """
+    return CachedDescriptor(desc)
+
+
+@lru_cache(maxsize=65536)
+def derived_descriptor(desc: str, index: int) -> str:
+    """The public descriptor of child index with plain pubkeys and checksum,
+    e.g. for the "desc" of listunspent and getaddressinfo
+    """
+    d = get_cached_descriptor(desc).derive(index)
+    for k in d.keys:
+        k.key = k.get_public_key()
+    return add_checksum(str(d))
+
+
+def derive_scripts(desc: str, start: int, end: int) -> list:
+    """Derives the scripts start..end-1 of a descriptor.
+    Returns a list of (index, script_hex, scripthash) tuples.
+    """
+    cached = get_cached_descriptor(desc)
+    result = []
+    for i in range(start, end):
+        script_pubkey = cached.script_pubkey(i)
+        result.append((i, script_pubkey.data.hex(), scripthash(script_pubkey)))
+    return result
+
+
+class DerivationService:
+    """Derives scripts of descriptors, in a process pool if the range is big enough.
+    Falls back to inline derivation if the pool is disabled (workers <= 1) or broken.
+    """
+
+    def __init__(self, workers=None, chunk_size=500, min_pool_range=1000):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.min_pool_range = min_pool_range
+        self._pool = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            logger.info(f"Starting derivation pool with {self.workers} workers")
+            # spawn as forking a process with running threads and db-connections is unsafe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def derive(self, desc: str, start: int, end: int) -> list:
+        """Returns [(index, script_hex, scripthash), ...] for start..end-1"""
+        if self.workers <= 1 or end - start < self.min_pool_range:
+            return derive_scripts(desc, start, end)
+        try:
+            futures = [
+                self.pool.submit(derive_scripts, desc, i, min(i + self.chunk_size, end))
+                for i in range(start, end, self.chunk_size)
+            ]
+            result = []
+            for f in futures:
+                result.extend(f.result())
+            return result
+        except Exception as e:
+            logger.error(f"Derivation pool failed ({e}), deriving inline")
+            self.shutdown()
+            return derive_scripts(desc, start, end)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
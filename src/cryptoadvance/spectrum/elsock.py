@@ -9,7 +9,10 @@ import threading
 import time
 from queue import Queue
 
+from .metrics import ELECTRUM_LATENCY, ELECTRUM_RECONNECTS, ELECTRUM_TIMEOUTS, metrics
+from .profiling import add_stage_time
 from .spectrum_error import RPCError
+from .tracing import KIND_CLIENT, tracer
 from .util import FlaskThread, SpectrumInternalException, handle_exception
 
 # TODO: normal handling of ctrl+C interrupt
@@ -107,6 +110,7 @@ class ElectrumSocket:
         self._results = {}  # store results of the calls here
         self._requests = []
         self._notifications = []
+        self._subscriptions = set()  # scripthashes subscribed on this connection
         self._wanted_status = "ok"  # "ok" or "down"
         # The monitor-thread will create the other threads
         self._monitor_thread = create_and_start_bg_thread(self._monitor_loop)
@@ -160,6 +164,8 @@ class ElectrumSocket:
             boolean if successfull
         """
 
+        # a new connection has no subscriptions
+        self._subscriptions = set()
         # Just to be sure, maybe close it upfront
         try:
             # close if open
@@ -306,6 +312,7 @@ class ElectrumSocket:
                         hasattr(self, "_on_recreation_callback")
                         and self._on_recreation_callback is not None
                     ):
+                        ELECTRUM_RECONNECTS.inc()
                         logger.debug(
                             f"calling self._on_recreation_callback {self._on_recreation_callback.__name__}"
                         )
@@ -546,6 +553,24 @@ class ElectrumSocket:
         might raise a ElSockTimeoutException if self._call_timeout is over
 
         """
+        start = time.time()
+        try:
+            with tracer.span("electrum.call", KIND_CLIENT, **{"rpc.method": method}):
+                result = self._call(method, params)
+        except ElSockTimeoutException:
+            add_stage_time("electrum", time.time() - start)
+            if metrics.enabled:
+                ELECTRUM_TIMEOUTS.inc(method)
+            raise
+        elapsed = time.time() - start
+        add_stage_time("electrum", elapsed)
+        if metrics.enabled:
+            ELECTRUM_LATENCY.observe(elapsed, method)
+        if method == "blockchain.scripthash.subscribe":
+            self._subscriptions.add(params[0])
+        return result
+
+    def _call(self, method, params):
         uid = random.randint(0, 1 << 32)
         obj = {"jsonrpc": "2.0", "method": method, "params": params, "id": uid}
         self._requests.append(obj)
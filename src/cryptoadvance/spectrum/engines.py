@@ -0,0 +1,125 @@
+"""Engine profiles and read/write routing of sessions
+
+With the defaults, SQLite uses a rollback journal with synchronous=FULL and every
+commit of the sync blocks all readers, so RPC-calls stall behind it. If the config
+has SQLITE_PRAGMAS, every connection gets them (typically WAL, which lets readers
+and the writer work concurrently) and the database gets two engines:
+
+- the writer: a single connection which all mutations go through
+- the reader: a pool of SQLITE_READ_POOL_SIZE query-only connections
+
+A RoutingSession sends the SELECTs of a transaction to the reader as long as that
+transaction didn't write anything. Once it did (or if someone asks for the plain
+connection), the rest of the transaction goes to the writer so it sees its own
+changes. Postgres and in-memory SQLite are left alone.
+"""
+
+import logging
+import threading
+from weakref import WeakKeyDictionary
+
+import sqlalchemy
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+# the writer is held for a whole commit-batch of the sync
+WRITER_POOL_TIMEOUT = 60
+
+
+def sqlite_profile_enabled(app, sa_url) -> bool:
+    return (
+        sa_url.drivername.startswith("sqlite")
+        and sa_url.database not in (None, "", ":memory:")
+        and bool(app.config.get("SQLITE_PRAGMAS"))
+    )
+
+
+def set_pragmas(engine, pragmas: dict) -> None:
+    """Executes the pragmas on every new connection of the engine"""
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        self._writing = False
+        super().__init__(db, **options)
+        event.listen(self, "after_transaction_end", self._on_transaction_end)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        reader = self.db.get_read_engine(self.app)
+        if reader is None:
+            return super().get_bind(mapper, clause)
+        if not self._writing and not self._flushing and isinstance(clause, Select):
+            return reader
+        self._writing = True
+        return super().get_bind(mapper, clause)
+
+    def _on_transaction_end(self, session, transaction):
+        if transaction.parent is None:
+            self._writing = False
+
+
+class SpectrumSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy with the SQLite profile and the reader-engine"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._read_engines = WeakKeyDictionary()
+        self._read_engines_lock = threading.Lock()
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        if sqlite_profile_enabled(app, sa_url):
+            # pysqlite would default to a NullPool
+            options.setdefault("poolclass", QueuePool)
+            options.setdefault("pool_size", 1)
+            options.setdefault("max_overflow", 0)
+            options.setdefault("pool_timeout", WRITER_POOL_TIMEOUT)
+            options.setdefault("connect_args", {})["check_same_thread"] = False
+            options["spectrum_pragmas"] = app.config["SQLITE_PRAGMAS"]
+        return super().apply_driver_hacks(app, sa_url, options)
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop("spectrum_pragmas", None)
+        engine = super().create_engine(sa_url, engine_opts)
+        if pragmas:
+            set_pragmas(engine, pragmas)
+        return engine
+
+    def get_read_engine(self, app):
+        """Returns the reader-engine of the app or None if the profile is disabled"""
+        with self._read_engines_lock:
+            if app not in self._read_engines:
+                self._read_engines[app] = self._create_read_engine(app)
+            return self._read_engines[app]
+
+    def _create_read_engine(self, app):
+        writer = self.get_engine(app)
+        size = app.config.get("SQLITE_READ_POOL_SIZE", 0)
+        if not size or not sqlite_profile_enabled(app, writer.url):
+            return None
+        logger.info(f"Using a pool of {size} read-connections for {writer.url}")
+        engine = sqlalchemy.create_engine(
+            writer.url,
+            poolclass=QueuePool,
+            pool_size=size,
+            max_overflow=0,
+            connect_args={"check_same_thread": False},
+        )
+        set_pragmas(engine, {**app.config["SQLITE_PRAGMAS"], "query_only": 1})
+        return engine
@@ -0,0 +1,87 @@
+"""A feed of wallet changes for long-polling clients
+
+Instead of re-polling full wallet-RPCs, a client can long-poll
+GET /wallet/<name>/events?cursor=<n> which returns as soon as something changed:
+
+    {"cursor": 42, "reset": false, "events": [
+        {"id": 41, "type": "tx", "txid": "...", "height": null},
+        {"id": 42, "type": "block", "height": 800001, "blockhash": "..."}]}
+
+The events are compact hints, the client fetches the details via the usual RPCs:
+- tx: a new tx of the wallet
+- confirmation: the height of a tx changed
+- removed: a tx disappeared (replaced or reorged)
+- balance: the balance changed by confirmed/unconfirmed sats
+- block: a new block (for all wallets)
+
+A request without cursor returns the current one right away. The feed keeps the last
+maxsize events in memory. If a client's cursor is older than that (or from before a
+restart), "reset" tells it to refresh everything.
+"""
+
+import logging
+import threading
+from collections import deque
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+
+class EventFeed:
+    def __init__(self, maxsize=10000):
+        self._events = deque(maxlen=maxsize)  # (id, wallet_id, event)
+        self._last_id = 0
+        self._changed = threading.Condition()
+
+    @property
+    def cursor(self) -> int:
+        return self._last_id
+
+    def publish(self, wallet_id, events: list) -> None:
+        """Adds events of a wallet (or with wallet_id None of all wallets)"""
+        if not events:
+            return
+        with self._changed:
+            for event in events:
+                self._last_id += 1
+                self._events.append(
+                    (self._last_id, wallet_id, dict(event, id=self._last_id))
+                )
+            self._changed.notify_all()
+
+    def wait(self, wallet_id: int, cursor: int = None, timeout: float = 30) -> dict:
+        """Returns the events of the wallet after cursor, waits up to timeout
+        seconds for some if there are none yet
+        """
+        with self._changed:
+            if cursor is None or cursor > self._last_id:
+                return {
+                    "cursor": self._last_id,
+                    "reset": cursor is not None,
+                    "events": [],
+                }
+            self._changed.wait_for(
+                lambda: self._lost(cursor) or self._after(wallet_id, cursor), timeout
+            )
+            if self._lost(cursor):
+                return {"cursor": self._last_id, "reset": True, "events": []}
+            return {
+                "cursor": self._last_id,
+                "reset": False,
+                "events": self._after(wallet_id, cursor),
+            }
+
+    def _lost(self, cursor: int) -> bool:
+        """Whether events after cursor already dropped out of the feed"""
+        return bool(self._events) and self._events[0][0] > cursor + 1
+
+    def _after(self, wallet_id: int, cursor: int) -> list:
+        if not self._events:
+            return []
+        # ids are consecutive, so the events after cursor start at this position
+        start = max(cursor + 1 - self._events[0][0], 0)
+        return [
+            event
+            for _, event_wallet_id, event in islice(self._events, start, None)
+            if event_wallet_id is None or event_wallet_id == wallet_id
+        ]
@@ -0,0 +1,347 @@
+"""Serving with several processes (e.g. gunicorn-workers) on one database
+
+Every process creating its own Spectrum would open its own ElectrumSocket and run its
+own sync, duplicating subscriptions and transactions. With SYNC_LEADER_ELECTION, the
+processes elect a leader via an advisory lock (PostgreSQL) or a lock file (SQLite):
+
+- The leader owns the ElectrumSocket, syncs and serves a small internal HTTP API on
+  SYNC_LEADER_HOST:SYNC_LEADER_PORT.
+- The other processes serve RPCs from the database. Their Spectrum gets an
+  ElectrumProxy instead of an ElectrumSocket which forwards the Electrum-calls (and
+  subscriptions of new descriptors) to the leader.
+
+With SYNC_PROCESS, the RPC-server doesn't take part in the election but always
+follows a separate `spectrum sync` process, which keeps the GIL-heavy sync away from
+the request-threads.
+
+All processes poll the wallet versions (see aggregates.py) to drop cached responses
+and wallets changed by others. The followers also poll the tip from the leader and
+try to take over the lock, so one of them becomes the leader if the leader dies. The
+leader checks that it still holds the lock and becomes a follower if it lost it.
+"""
+
+import fcntl
+import logging
+import os
+import threading
+import time
+
+import requests
+from flask import Blueprint, Flask, jsonify, request
+from flask import current_app as internal_app
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from werkzeug.serving import make_server
+
+from .db import Descriptor, db
+from .profiling import add_stage_time
+from .spectrum_error import RPCError
+from .tracing import KIND_CLIENT, tracer
+from .util import SpectrumInternalException
+
+logger = logging.getLogger(__name__)
+
+# key of the PostgreSQL advisory lock ("SPECTRUM" in ascii)
+ADVISORY_LOCK_KEY = 0x5350454354525558
+
+
+class FileLock:
+    """An exclusive flock() on a file, released when the process dies"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        f = open(self.path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.truncate(0)
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def held(self) -> bool:
+        """An flock() lasts as long as the process"""
+        return self._file is not None
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class AdvisoryLock:
+    """A session-level PostgreSQL advisory lock, held by a dedicated connection
+
+    The connection runs in AUTOCOMMIT so it never idles in a transaction (and gets
+    killed by an idle_in_transaction_session_timeout). The lock is gone if the
+    connection is, so held() checks that it's still alive.
+    """
+
+    def __init__(self, engine, key=ADVISORY_LOCK_KEY):
+        self.engine = engine
+        self.key = key
+        self._connection = None
+
+    def acquire(self) -> bool:
+        if self._connection is not None:
+            return True
+        connection = self.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        )
+        locked = connection.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}
+        ).scalar()
+        if not locked:
+            connection.close()
+            return False
+        self._connection = connection
+        return True
+
+    def held(self) -> bool:
+        if self._connection is None:
+            return False
+        try:
+            self._connection.execute(text("SELECT 1"))
+        except DBAPIError as e:
+            logger.error(f"Lost the connection holding the sync-leader lock: {e}")
+            self._connection.invalidate()
+            self._connection = None
+            return False
+        return True
+
+    def release(self):
+        if self._connection is not None:
+            self._connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": self.key}
+            )
+            self._connection.close()
+            self._connection = None
+
+
+def leader_lock(app):
+    """The lock which fits the database of the app"""
+    engine = db.get_engine(app)
+    if engine.dialect.name == "postgresql":
+        return AdvisoryLock(engine)
+    return FileLock(os.path.join(app.config["SPECTRUM_DATADIR"], "sync-leader.lock"))
+
+
+class ElectrumProxy:
+    """Stands in for the ElectrumSocket in processes which aren't the leader"""
+
+    uses_tor = False
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        self.status = "unknown"
+        self._session = requests.Session()
+
+    def call(self, method, params=[]):
+        """Forwards the call to the ElectrumSocket of the leader"""
+        start = time.time()
+        try:
+            with tracer.span(
+                "electrum.call",
+                KIND_CLIENT,
+                **{"rpc.method": method, "spectrum.forwarded": True},
+            ):
+                response = self._session.post(
+                    f"{self.url}/electrum",
+                    json={"method": method, "params": params},
+                    timeout=self.timeout,
+                )
+                obj = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise SpectrumInternalException(f"Sync-leader unreachable: {e}")
+        finally:
+            add_stage_time("electrum", time.time() - start)
+        error = obj.get("error")
+        if error and error.get("code") is not None:
+            raise RPCError(error["message"], error["code"])
+        if error:
+            raise SpectrumInternalException(error["message"])
+        return obj["result"]
+
+    def ping(self):
+        start = time.time()
+        self.call("server.ping")
+        return time.time() - start
+
+    def subscribe_descriptor(self, descriptor_id: int):
+        """Lets the leader subscribe (and sync) the scripts of a new descriptor"""
+        self._session.post(
+            f"{self.url}/subscribe/{descriptor_id}", timeout=self.timeout
+        ).raise_for_status()
+
+    def wait_for_events(self, wallet_id: int, cursor=None, timeout=30) -> dict:
+        """Long-polls the event-feed of the leader"""
+        params = {"timeout": timeout}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = self._session.get(
+            f"{self.url}/events/{wallet_id}", params=params, timeout=timeout + 10
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def leader_status(self) -> dict:
+        """Tip and connection-status of the leader, None if it's unreachable"""
+        try:
+            obj = self._session.get(f"{self.url}/status", timeout=self.timeout).json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Sync-leader unreachable: {e}")
+            self.status = "sync-leader unreachable"
+            return None
+        self.status = "ok" if obj["connected"] else "leader offline"
+        return obj
+
+    def shutdown(self):
+        self._session.close()
+
+
+leader_api = Blueprint("leader_api", __name__)
+
+
+@leader_api.route("/electrum", methods=["POST"])
+def electrum():
+    data = request.get_json()
+    try:
+        result = internal_app.spectrum.sock.call(data["method"], data["params"])
+    except RPCError as e:
+        return jsonify(error=e.to_dict())
+    except Exception as e:
+        return jsonify(error={"message": str(e)}), 500
+    return jsonify(result=result)
+
+
+@leader_api.route("/subscribe/<int:descriptor_id>", methods=["POST"])
+def subscribe(descriptor_id):
+    spectrum = internal_app.spectrum
+    with spectrum.app.app_context():
+        descriptor = Descriptor.query.get(descriptor_id)
+        if descriptor is None:
+            return jsonify(error={"message": "Unknown descriptor"}), 404
+        spectrum.subcribe_scripts(descriptor)
+    return jsonify(result=True)
+
+
+@leader_api.route("/events/<int:wallet_id>")
+def events(wallet_id):
+    return internal_app.spectrum.events.wait(
+        wallet_id,
+        request.args.get("cursor", type=int),
+        request.args.get("timeout", default=30, type=float),
+    )
+
+
+@leader_api.route("/status")
+def status():
+    spectrum = internal_app.spectrum
+    return jsonify(
+        connected=spectrum.is_connected(),
+        blocks=spectrum.blocks,
+        bestblockhash=spectrum.bestblockhash,
+        roothash=spectrum.roothash,
+        chain=spectrum.chain,
+        progress_percent=spectrum.progress_percent,
+    )
+
+
+class LeaderServer:
+    """The internal HTTP-API of the leader, in a thread"""
+
+    def __init__(self, spectrum, host="127.0.0.1", port=8082):
+        app = Flask("spectrum-leader")
+        app.spectrum = spectrum
+        app.register_blueprint(leader_api)
+        self._server = make_server(host, port, app, threaded=True)
+        self.port = self._server.port
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="spectrum-leader", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+
+
+class LeaderElection:
+    def __init__(self, app, lock=None, candidate=True):
+        """candidate: False for processes which never become the leader"""
+        self.app = app
+        self.candidate = candidate
+        self.lock = lock or leader_lock(app)
+        self.host = app.config.get("SYNC_LEADER_HOST", "127.0.0.1")
+        self.port = app.config.get("SYNC_LEADER_PORT", 8082)
+        self.interval = app.config.get("SYNC_LEADER_POLL_INTERVAL", 1)
+        self.is_leader = False
+        self.spectrum = None
+        self._server = None
+        self._stopped = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def try_acquire(self) -> bool:
+        self.is_leader = self.candidate and self.lock.acquire()
+        return self.is_leader
+
+    def start(self, spectrum):
+        """Starts serving (as leader) and polling"""
+        self.spectrum = spectrum
+        if self.is_leader:
+            self._serve()
+        threading.Thread(
+            target=self._run, name="spectrum-election", daemon=True
+        ).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._server:
+            self._server.stop()
+        self.lock.release()
+
+    def _serve(self):
+        logger.info(f"Sync-leader, serving internal API on {self.url}")
+        self._server = LeaderServer(self.spectrum, self.host, self.port)
+        self._server.start()
+
+    def _demote(self):
+        """Stops leading after the lock got lost, another process may hold it already"""
+        logger.error("Lost the sync-leader lock, following the new leader")
+        self.is_leader = False
+        if self._server:
+            self._server.stop()
+            self._server = None
+        self.lock.release()
+        self.spectrum.demote(self.url)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    self.spectrum.follow_versions()
+                    if self.is_leader:
+                        if not self.lock.held():
+                            self._demote()
+                        continue
+                    self.spectrum.refresh_from_leader()
+                    if self.try_acquire():
+                        logger.info("Took over the sync-leadership")
+                        self.spectrum.promote()
+                        self._serve()
+            except Exception as e:
+                logger.error(f"Leader-election: {e}")
@@ -0,0 +1,212 @@
+"""Counters, latency-histograms and gauges in the Prometheus text-format
+
+With METRICS_ENABLED, GET /metrics serves:
+- spectrum_rpc_*: calls, errors and latency per JSON-RPC method
+- spectrum_electrum_*: latency and timeouts per Electrum method, reconnects,
+  subscriptions and the backlog of unprocessed notifications
+- spectrum_db_query_seconds: latency of the database-queries per statement-type
+- gauges like the depth of the write-queue and the response-cache hits
+
+Instrumented code checks metrics.enabled before taking any time, so the overhead is
+a single attribute lookup if the metrics are disabled.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+def _labels(labelnames, values) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value)}"' for name, value in zip(labelnames, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name + _labels(self.labelnames, labels), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [counts per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = {k: (list(v[0]), v[1]) for k, v in self._values.items()}
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield self.name + "_bucket" + _labels(
+                    names, labels + (bound,)
+                ), cumulative
+            yield self.name + "_sum" + _labels(self.labelnames, labels), total
+            yield self.name + "_count" + _labels(self.labelnames, labels), cumulative
+
+
+class Gauge:
+    """A value which gets computed by fn() when the metrics are collected"""
+
+    type = "gauge"
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def samples(self):
+        yield self.name, self.fn()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.enabled = False
+        self._metrics = {}
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, fn) -> Gauge:
+        """Registers (or replaces) a gauge"""
+        return self._register(Gauge(name, help, fn))
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text-format"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.warning(f"Metric {metric.name} failed: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines += [f"{name} {value}" for name, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+RPC_CALLS = metrics.counter(
+    "spectrum_rpc_calls_total", "JSON-RPC calls per method", ("method",)
+)
+RPC_ERRORS = metrics.counter(
+    "spectrum_rpc_errors_total", "JSON-RPC calls which failed", ("method",)
+)
+RPC_LATENCY = metrics.histogram(
+    "spectrum_rpc_seconds", "Latency of JSON-RPC calls", ("method",)
+)
+ELECTRUM_LATENCY = metrics.histogram(
+    "spectrum_electrum_seconds", "Latency of calls to the Electrum-server", ("method",)
+)
+ELECTRUM_TIMEOUTS = metrics.counter(
+    "spectrum_electrum_timeouts_total", "Calls to Electrum which timed out", ("method",)
+)
+ELECTRUM_RECONNECTS = metrics.counter(
+    "spectrum_electrum_reconnects_total", "Recreations of the Electrum-connection"
+)
+DB_QUERY_LATENCY = metrics.histogram(
+    "spectrum_db_query_seconds", "Latency of database-queries", ("statement",)
+)
+
+STATEMENT_TYPES = {"SELECT", "INSERT", "UPDATE", "DELETE", "COPY", "PRAGMA"}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("metrics_query_start", None)
+    if start is None:
+        return
+    statement_type = statement.lstrip().split(None, 1)[0].upper()
+    if statement_type not in STATEMENT_TYPES:
+        statement_type = "OTHER"
+    DB_QUERY_LATENCY.observe(time.perf_counter() - start, statement_type)
@@ -0,0 +1,212 @@
+"""A lightweight, versioned schema-migration system
+
+db.create_all() only creates missing tables, it never touches existing ones. Every
+change to existing tables (indexes, columns, types) is therefore a migration here:
+
+    @migration(2, "what it does")
+    def _some_change(conn):
+        ...
+
+migrate() runs at startup. On a brand-new database create_all() already creates the
+latest schema, so all migrations are just recorded as applied. Otherwise all migrations
+which are not yet in the SchemaVersion-table are applied in order, each one in its
+own transaction.
+
+Several processes (e.g. gunicorn-workers) starting at once run migrate() one after
+the other, under the migration_lock().
+"""
+
+import fcntl
+import logging
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import LargeBinary, distinct, func, inspect, select, text
+
+from .db import UTXO, SchemaVersion, Script, Tx, Wallet, WalletAggregate, db
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = {}  # version -> (description, function)
+
+# key of the PostgreSQL advisory lock for migrations ("SPECMIGR" in ascii)
+MIGRATION_LOCK_KEY = 0x535045434D494752
+
+
+def migration(version: int, description: str):
+    """A decorator that registers a migration, the function gets a connection"""
+
+    def decorator(f):
+        if version in MIGRATIONS:
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS[version] = (description, f)
+        return f
+
+    return decorator
+
+
+def migrate():
+    """Brings the database to the latest schema. Needs an app_context."""
+    fresh = not inspect(db.engine).has_table(Wallet.__tablename__)
+    db.create_all()
+    applied = {v.version for v in SchemaVersion.query.all()}
+    # the migrations run on their own connections, the session must not hold any
+    # locks (on PostgreSQL, ALTER TABLE would wait for them forever)
+    db.session.commit()
+    for version in sorted(MIGRATIONS):
+        if version in applied:
+            continue
+        description, f = MIGRATIONS[version]
+        with db.engine.begin() as conn:
+            if fresh:
+                logger.debug(f"Fresh database, skipping migration {version}")
+            else:
+                logger.info(f"Applying migration {version}: {description}")
+                f(conn)
+            conn.execute(
+                SchemaVersion.__table__.insert(),
+                {"version": version, "description": description},
+            )
+    db.session.commit()
+
+
+@contextmanager
+def migration_lock(datadir):
+    """Blocks until no other process migrates the database. Needs an app_context."""
+    engine = db.engine
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(
+                text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY}
+            )
+            try:
+                yield
+            finally:
+                conn.execute(
+                    text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY}
+                )
+        return
+    with open(os.path.join(datadir, "migrate.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def create_missing_indexes(conn):
+    """Creates the indexes of all Spectrum-tables which don't exist yet"""
+    for table in db.metadata.sorted_tables:
+        if not table.name.startswith("spectrum_"):
+            continue
+        existing = {ix["name"] for ix in inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info(f"Creating index {index.name}")
+                index.create(bind=conn)
+
+
+@migration(1, "Indexes for scripthash-, script-, tx- and utxo-lookups")
+def _indexes(conn):
+    create_missing_indexes(conn)
+
+
+@migration(2, "Per-wallet balance and tx-count aggregates")
+def _wallet_aggregates(conn):
+    # the table itself got created by create_all(). Everything is read via conn,
+    # like in compute_aggregate() but for all wallets at once.
+    scripts = Script.__table__.c
+    txs = Tx.__table__.c
+    balances = {
+        wallet_id: (confirmed or 0, unconfirmed or 0)
+        for wallet_id, confirmed, unconfirmed in conn.execute(
+            select(
+                scripts.wallet_id,
+                func.sum(scripts.confirmed),
+                func.sum(scripts.unconfirmed),
+            ).group_by(scripts.wallet_id)
+        )
+    }
+    txcounts = dict(
+        conn.execute(
+            select(txs.wallet_id, func.count(distinct(txs.txid))).group_by(
+                txs.wallet_id
+            )
+        ).fetchall()
+    )
+    rows = [
+        {
+            "wallet_id": wallet_id,
+            "confirmed": balances.get(wallet_id, (0, 0))[0],
+            "unconfirmed": balances.get(wallet_id, (0, 0))[1],
+            "txcount": txcounts.get(wallet_id, 0),
+        }
+        for (wallet_id,) in conn.execute(select(Wallet.__table__.c.id))
+    ]
+    conn.execute(WalletAggregate.__table__.delete())
+    if rows:
+        conn.execute(WalletAggregate.__table__.insert(), rows)
+
+
+@migration(3, "Binary columns for scripts, scripthashes, states, txids and blockhashes")
+def _binary_columns(conn):
+    for model, columns in [
+        (Script, ["script", "scripthash", "state"]),
+        (Tx, ["txid", "blockhash"]),
+        (UTXO, ["txid"]),
+    ]:
+        table = model.__tablename__
+        existing = {c["name"]: c["type"] for c in inspect(conn).get_columns(table)}
+        columns = [c for c in columns if not isinstance(existing[c], LargeBinary)]
+        if not columns:
+            continue
+        logger.info(f"Converting {table}.{columns} to binary")
+        if conn.dialect.name == "postgresql":
+            for c in columns:
+                conn.execute(
+                    text(
+                        f'ALTER TABLE "{table}" ALTER COLUMN "{c}" TYPE BYTEA USING decode("{c}", \'hex\')'
+                    )
+                )
+        else:
+            # SQLite doesn't care about the declared type, only the values change
+            _hex_to_binary(conn, table, columns)
+
+
+def _hex_to_binary(conn, table, columns):
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    rows = conn.execute(text(f'SELECT id, {column_list} FROM "{table}"')).fetchall()
+    updates = []
+    for row in rows:
+        values = {c: row[i + 1] for i, c in enumerate(columns)}
+        if not any(isinstance(v, str) for v in values.values()):
+            continue
+        updates.append(
+            {
+                "id": row[0],
+                **{
+                    c: bytes.fromhex(v) if isinstance(v, str) else v
+                    for c, v in values.items()
+                },
+            }
+        )
+    if updates:
+        assignments = ", ".join(f'"{c}" = :{c}' for c in columns)
+        conn.execute(
+            text(f'UPDATE "{table}" SET {assignments} WHERE id = :id'), updates
+        )
+
+
+@migration(4, "Aggregate versions and the index for ordered listtransactions")
+def _tx_order(conn):
+    table = WalletAggregate.__tablename__
+    if "version" not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(
+            text(f'ALTER TABLE "{table}" ADD COLUMN version BIGINT NOT NULL DEFAULT 0')
+        )
+    create_missing_indexes(conn)
+    # superseded by ix_spectrum_tx_wallet_height_id
+    if "ix_spectrum_tx_wallet_height" in {
+        ix["name"] for ix in inspect(conn).get_indexes(Tx.__tablename__)
+    }:
+        conn.execute(text("DROP INDEX ix_spectrum_tx_wallet_height"))
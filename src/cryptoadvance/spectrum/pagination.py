@@ -0,0 +1,117 @@
+"""Stable ordering and keyset-pagination for listtransactions
+
+Transactions are listed newest first: the unconfirmed ones (height NULL or <= 0) by
+id, then the confirmed ones by height and id. Both parts are read by separate queries
+with plain ORDER BYs, so the confirmed part (the bulk of a wallet) gets read from the
+(wallet_id, height, id) index in order instead of being sorted for every page.
+
+listtransactions only knows count and skip (like Bitcoin Core), so with OFFSET every
+page costs O(skip). The KeysetCache remembers the sort key of the last row of every
+page that got served, per wallet-version (see aggregates.py). Scrolling requests the
+next page with skip = previous skip + count, and that one starts right after the
+remembered key instead.
+
+iter_page_oldest_first() reads a page in the order listtransactions returns it, in
+chunks of YIELD_PER rows, so large pages can be streamed (see streaming.py).
+"""
+
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import and_, or_
+
+from .db import Tx
+
+# rows fetched at once when reading a page chunk-wise
+YIELD_PER = 500
+
+
+class KeysetCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scope, skip):
+        """The key of the row before position skip, None if unknown"""
+        with self._lock:
+            key = self._keys.get((scope, skip))
+            if key is not None:
+                self._keys.move_to_end((scope, skip))
+            return key
+
+    def put(self, scope, skip, key):
+        with self._lock:
+            self._keys[(scope, skip)] = key
+            self._keys.move_to_end((scope, skip))
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+
+def _pending(height=Tx.height):
+    return or_(height.is_(None), height <= 0)
+
+
+def sort_key(row) -> tuple:
+    """(pending, height, id) of a row with Tx.height and Tx.id"""
+    if not row.height or row.height <= 0:
+        return (True, 0, row.id)
+    return (False, row.height, row.id)
+
+
+def _page_parts(query, count: int, skip=0, after=None) -> list:
+    """The page of ordered_page() as (query, column names to order it oldest first)
+    parts: the pending part (if any) followed by the confirmed one
+    """
+    pending = query.filter(_pending())
+    confirmed = query.filter(Tx.height > 0)
+    if after is not None:
+        is_pending, height, id = after
+        if is_pending:
+            pending = pending.filter(Tx.id < id)
+        else:
+            pending = None
+            confirmed = confirmed.filter(
+                or_(Tx.height < height, and_(Tx.height == height, Tx.id < id))
+            )
+        skip = 0
+    parts = []
+    n_pending = 0 if pending is None else pending.count()
+    if skip < n_pending:
+        n = min(n_pending - skip, count)
+        page = pending.order_by(Tx.id.desc()).offset(skip).limit(n)
+        parts.append((page, ["id"]))
+        count -= n
+    if count > 0:
+        page = (
+            confirmed.order_by(Tx.height.desc(), Tx.id.desc())
+            .offset(max(skip - n_pending, 0))
+            .limit(count)
+        )
+        parts.append((page, ["height", "id"]))
+    return parts
+
+
+def ordered_page(query, count: int, skip=0, after=None) -> list:
+    """Returns count rows of a query on Tx, newest first, starting at skip or, if
+    given, right after the sort_key after.
+    """
+    if count <= 0:
+        return []
+    return [row for page, _ in _page_parts(query, count, skip, after) for row in page]
+
+
+def iter_page_oldest_first(query, count: int, skip=0, after=None, yield_per=YIELD_PER):
+    """Yields the rows of ordered_page(query, count, skip, after) in reverse order,
+    reading yield_per rows at once instead of the whole page
+    """
+    if count <= 0:
+        return
+    # the older (confirmed) end of the page comes first
+    for page, columns in reversed(_page_parts(query, count, skip, after)):
+        rows = page.subquery()
+        yield from (
+            page.session.query(rows)
+            .order_by(*[rows.c[name] for name in columns])
+            .yield_per(yield_per)
+        )
@@ -0,0 +1,236 @@
+"""On-demand profiling of a running Spectrum
+
+- SamplingProfiler: a thread which samples the stacks of all other threads every few
+  milliseconds. The result is in the "folded" format (one stack per line, frames
+  separated by ";", followed by the number of samples) which flamegraph.pl,
+  speedscope and others render as flamegraph.
+- SlowCallRecorder: keeps the jsonrpc-calls which took longer than a threshold
+  together with their params and how much of the time went to the database, to
+  Electrum and to the serialization of the response.
+
+Both are controlled via the admin-endpoints (server_endpoints/admin.py).
+"""
+
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .streaming import StreamedList
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# params which hold secrets: method -> [(position, name)]
+SECRET_PARAMS = {
+    "createwallet": [(3, "passphrase")],
+    "encryptwallet": [(0, "passphrase")],
+    "walletpassphrase": [(0, "passphrase")],
+    "walletpassphrasechange": [(0, "oldpassphrase"), (1, "newpassphrase")],
+    "importprivkey": [(0, "privkey")],
+    "signmessagewithprivkey": [(0, "privkey")],
+    "signrawtransactionwithkey": [(1, "privkeys")],
+}
+# a private key in WIF (e.g. within a descriptor)
+WIF_PATTERN = re.compile(
+    r"(?<![1-9A-HJ-NP-Za-km-z])[5KLc9][1-9A-HJ-NP-Za-km-z]{50,51}(?![1-9A-HJ-NP-Za-km-z])"
+)
+
+
+def add_stage_time(stage: str, seconds: float) -> None:
+    """Adds to the per-stage breakdown of the call tracked in this thread (if any)"""
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + seconds
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._stacks = Counter()
+        self._thread = None
+        self._stopped = threading.Event()
+        self.samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval=None):
+        if self.running:
+            return
+        self.interval = interval or self.interval
+        self._stacks = Counter()
+        self.samples = 0
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="spectrum-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> str:
+        """Stops sampling and returns the folded stacks"""
+        if self.running:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        return self.folded()
+
+    def folded(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self._stacks.most_common()
+        )
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+class _Call:
+    __slots__ = ["response"]
+
+    def __init__(self):
+        self.response = None
+
+
+class SlowCallRecorder:
+    def __init__(self, threshold_ms=0, maxsize=100):
+        """threshold_ms: calls taking longer get recorded (0 = disabled)"""
+        self.threshold_ms = threshold_ms
+        self.calls = deque(maxlen=maxsize)
+        self._listening = False
+        if self.enabled:
+            self._listen()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def set_threshold(self, threshold_ms):
+        self.threshold_ms = threshold_ms
+        if self.enabled:
+            self._listen()
+
+    def _listen(self):
+        if not self._listening:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            self._listening = True
+
+    @contextmanager
+    def track(self, method, wallet_name, params):
+        """Measures the call in the with-block, which should set .response"""
+        call = _Call()
+        if not self.enabled or getattr(_local, "timings", None) is not None:
+            yield call
+            return
+        _local.timings = {}
+        start = time.perf_counter()
+        try:
+            yield call
+        finally:
+            stages = _local.timings
+            _local.timings = None
+            result = call.response.get("result") if call.response else None
+            if isinstance(result, StreamedList):
+                # the call ends with the stream, which includes the serialization
+                result.around_reads(lambda: _tracked(stages))
+                result.on_finish(
+                    lambda error: self._finish(
+                        method, wallet_name, params, start, stages, call, True
+                    )
+                )
+            else:
+                self._finish(method, wallet_name, params, start, stages, call)
+
+    def _finish(self, method, wallet_name, params, start, stages, call, streamed=False):
+        elapsed = time.perf_counter() - start
+        if elapsed * 1000 >= self.threshold_ms:
+            self._record(method, wallet_name, params, elapsed, stages, call, streamed)
+
+    def _record(self, method, wallet_name, params, elapsed, stages, call, streamed):
+        if not streamed:
+            start = time.perf_counter()
+            json.dumps(call.response, default=str)
+            stages["serialization"] = time.perf_counter() - start
+        stages["other"] = max(
+            elapsed - stages.get("db", 0) - stages.get("electrum", 0), 0
+        )
+        logger.warning(f"Slow call {method} took {elapsed * 1000:.0f}ms {stages}")
+        self.calls.append(
+            {
+                "time": time.time(),
+                "method": method,
+                "wallet": wallet_name,
+                "params": _redact_params(method, params),
+                "ms": round(elapsed * 1000, 1),
+                "streamed": streamed,
+                "stages_ms": {k: round(v * 1000, 1) for k, v in stages.items()},
+            }
+        )
+
+
+@contextmanager
+def _tracked(stages):
+    """Adds the stage times within the with-block to stages"""
+    _local.timings = stages
+    try:
+        yield
+    finally:
+        _local.timings = None
+
+
+def _redact_params(method, params):
+    """Hides passphrases and private keys"""
+    secrets = SECRET_PARAMS.get(method, [])
+    if isinstance(params, dict):
+        names = {name for _, name in secrets}
+        params = {k: "***" if k in names else v for k, v in params.items()}
+    elif isinstance(params, (list, tuple)):
+        positions = {position for position, _ in secrets}
+        params = ["***" if i in positions else v for i, v in enumerate(params)]
+    return _redact(params)
+
+
+def _redact(params):
+    """Hides extended private keys and WIFs (e.g. in descriptors of importdescriptors)"""
+    if isinstance(params, dict):
+        return {k: _redact(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [_redact(v) for v in params]
+    if isinstance(params, str) and ("prv" in params or WIF_PATTERN.search(params)):
+        return "***"
+    return params
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, "timings", None) is not None:
+        conn.info["profiling_query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("profiling_query_start", None)
+    if start is not None:
+        add_stage_time("db", time.perf_counter() - start)
@@ -0,0 +1,68 @@
+"""A cache for the wallet lookup of every wallet-RPC
+
+Every wallet-RPC starts by loading the Wallet by name and most of them also load its
+descriptors. The WalletRegistry keeps a detached copy of each wallet together with
+its descriptors and attaches it to the session of the caller via
+merge(load=False), which doesn't hit the database.
+
+The copies get invalidated whenever the wallet or its descriptors change
+(createwallet, importdescriptor, a descriptor's next_index moving).
+"""
+
+import logging
+import threading
+
+from sqlalchemy.orm import selectinload
+
+from .db import Wallet, db
+
+logger = logging.getLogger(__name__)
+
+
+class WalletRegistry:
+    def __init__(self):
+        self._wallets = {}  # name -> detached Wallet with descriptors
+        self._lock = threading.Lock()
+        # incremented by invalidate() so that a concurrent _load() doesn't cache stale data
+        self._generation = 0
+
+    def get(self, name: str):
+        """Returns the Wallet attached to the current session or None"""
+        cached = self._wallets.get(name)
+        if cached is None:
+            cached = self._load(name)
+            if cached is None:
+                return None
+        return db.session.merge(cached, load=False)
+
+    def _load(self, name: str):
+        generation = self._generation
+        # a separate session, so the copy is independent of the caller's objects
+        session = db.create_session({})()
+        try:
+            wallet = (
+                session.query(Wallet)
+                .options(selectinload(Wallet.descriptors))
+                .filter_by(name=name)
+                .first()
+            )
+            session.expunge_all()
+        finally:
+            session.close()
+        if wallet is None:
+            return None
+        with self._lock:
+            if generation == self._generation:
+                self._wallets[name] = wallet
+        return wallet
+
+    def invalidate(self, wallet_id: int = None):
+        """Forgets one or (without wallet_id) all wallets"""
+        with self._lock:
+            self._generation += 1
+            if wallet_id is None:
+                self._wallets.clear()
+                return
+            for name, wallet in list(self._wallets.items()):
+                if wallet.id == wallet_id:
+                    del self._wallets[name]
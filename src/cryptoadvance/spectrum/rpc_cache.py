@@ -0,0 +1,117 @@
+"""A cache for the responses of idempotent wallet-RPCs
+
+Specter polls getbalances, getwalletinfo, listtransactions, listunspent and listlabels
+every few seconds, mostly for wallets which didn't change. The ResponseCache keeps
+the results keyed by (wallet, method, params, version, tip height), so a repeated poll
+is a dict lookup.
+
+The version of a wallet is a counter in memory which gets bumped (after the commit)
+whenever the sync, a label or a lock changes the wallet. Entries of older versions
+aren't looked up anymore and drop out of the LRU eventually.
+
+Streamed results (see streaming.py) get cached once they're through, unless they're
+too big to keep in memory.
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from .streaming import StreamedList
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# wallet-rpcs whose result only depends on the wallet's state and the tip
+CACHED_METHODS = {
+    "getbalances",
+    "getwalletinfo",
+    "listtransactions",
+    "listunspent",
+    "listlabels",
+}
+
+
+class ResponseCache:
+    def __init__(self, maxsize=1024):
+        """maxsize: number of responses kept (0 = no caching)"""
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._versions = {}  # wallet_id -> version
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, wallet_id: int) -> int:
+        return self._versions.get(wallet_id, 0)
+
+    def bump(self, wallet_id: int) -> None:
+        """Call after a change of the wallet got committed"""
+        with self._lock:
+            self._versions[wallet_id] = self._versions.get(wallet_id, 0) + 1
+
+    def call(self, wallet_id: int, method: str, params, height: int, fn):
+        """Returns the cached response or fn() which gets cached.
+        The responses are shared, so don't modify them.
+        """
+        if self.maxsize <= 0:
+            return fn()
+        key = self._key(wallet_id, method, params, height)
+        result = self._get(key)
+        if result is _MISSING:
+            result = fn()
+            self._put(key, result)
+        return result
+
+    def stream(self, wallet_id: int, method: str, params, height: int, fn, keep=1000):
+        """Like call() for a fn() returning a generator: returns the cached list or a
+        StreamedList of fn(), which gets cached if it has no more than keep items
+        """
+        if self.maxsize <= 0:
+            return StreamedList(fn())
+        key = self._key(wallet_id, method, params, height)
+        result = self._get(key)
+        if result is _MISSING:
+            result = StreamedList(
+                fn(), keep=keep, on_complete=lambda items: self._put(key, items)
+            )
+        return result
+
+    def _key(self, wallet_id, method, params, height) -> tuple:
+        return (
+            wallet_id,
+            method,
+            json.dumps(params, sort_keys=True, default=str),
+            self.version(wallet_id),
+            height,
+        )
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        return _MISSING
+
+    def _put(self, key, result):
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+        }
@@ -1,13 +1,20 @@
 import json
 import logging
 import os
+import time
 
 from flask import Flask, g, request
 
+from .compression import init_compression
 from .db import Script, db
+from .leader import LeaderElection
+from .metrics import metrics
+from .tracing import FileSpanExporter, tracer
+from .migrations import migrate, migration_lock
 from .spectrum import Spectrum
 from .server_endpoints.core_api import core_api
 from .server_endpoints.healthz import healthz
+from .util import SpectrumInternalException
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +28,7 @@ def create_app(config="cryptoadvance.spectrum.config.EmzyElectrumLiteConfig"):
     return app
 
 
-def init_app(app, datadir=None, standalone=True):
+def init_db(app, datadir=None):
     # create folder if doesn't exist
     if datadir is None:
         datadir = app.config["SPECTRUM_DATADIR"]
@@ -30,31 +37,136 @@ def init_app(app, datadir=None, standalone=True):
     db.init_app(app)
 
     with app.app_context():
-        db.create_all()
+        with migration_lock(datadir):
+            migrate()
         app.logger.info("-------------------------CONFIGURATION-OVERVIEW------------")
         app.logger.info("Config from " + os.environ.get("CONFIG", "empty"))
         for key, value in sorted(app.config.items()):
-            if key in ["DB_PASSWORD", "SECRET_KEY", "SQLALCHEMY_DATABASE_URI"]:
+            if key in [
+                "DB_PASSWORD",
+                "SECRET_KEY",
+                "SQLALCHEMY_DATABASE_URI",
+                "ADMIN_TOKEN",
+            ]:
                 app.logger.info("{} = {}".format(key, "xxxxxxxxxxxx"))
             else:
                 app.logger.info("{} = {}".format(key, value))
         app.logger.info("-----------------------------------------------------------")
+
+
+def init_observability(app):
+    """Enables the (process-wide) metrics and tracing if configured"""
+    if app.config.get("METRICS_ENABLED"):
+        metrics.enable()
+    if app.config.get("TRACING_FILE"):
+        tracer.enable(FileSpanExporter(app.config["TRACING_FILE"]))
+
+
+def create_spectrum(app, leader_url=None) -> Spectrum:
+    # if not getattr(g, "electrum", None):
+    logger.info("Creating Spectrum Object ...")
+    return Spectrum(
+        app.config["ELECTRUM_HOST"],
+        app.config["ELECTRUM_PORT"],
+        ssl=app.config["ELECTRUM_USES_SSL"],
+        datadir=app.config["SPECTRUM_DATADIR"],
+        app=app,
+        leader_url=leader_url,
+    )
+
+
+def init_app(app, datadir=None, standalone=True):
+    init_db(app, datadir)
+
+    with app.app_context():
         from cryptoadvance.spectrum.server_endpoints.core_api import core_api
+        from .server_endpoints.admin import admin
         from .server_endpoints.healthz import healthz
+        from .server_endpoints.metrics_api import metrics_api
+        from .server_endpoints.wallet_events import wallet_events
 
         app.register_blueprint(core_api)
         app.register_blueprint(healthz)
+        app.register_blueprint(wallet_events)
+        app.register_blueprint(metrics_api)
+        app.register_blueprint(admin)
+        init_compression(app)
+        init_observability(app)
 
-        # if not getattr(g, "electrum", None):
-        logger.info("Creating Spectrum Object ...")
-        app.spectrum = Spectrum(
-            app.config["ELECTRUM_HOST"],
-            app.config["ELECTRUM_PORT"],
-            ssl=app.config["ELECTRUM_USES_SSL"],
-            datadir=app.config["SPECTRUM_DATADIR"],
-            app=app,
-        )
+        # with several processes, only the elected leader connects to Electrum
+        election = None
+        leader_url = None
+        if app.config.get("SYNC_PROCESS"):
+            # a separate `spectrum sync` process is always the leader
+            election = LeaderElection(app, candidate=False)
+            leader_url = election.url
+        elif app.config.get("SYNC_LEADER_ELECTION"):
+            election = LeaderElection(app)
+            if not election.try_acquire():
+                leader_url = election.url
+
+        app.spectrum = create_spectrum(app, leader_url)
         app.spectrum.sync()
+        if election:
+            election.start(app.spectrum)
+        app.election = election
+
+
+def init_sync_process(app, datadir=None):
+    """Sets up the `spectrum sync` process: the leader which owns the ElectrumSocket
+    and syncs while RPC-servers with SYNC_PROCESS forward to it
+    """
+    init_db(app, datadir)
+    with app.app_context():
+        init_observability(app)
+        election = LeaderElection(app)
+        while not election.try_acquire():
+            logger.info("Another process is syncing, waiting ...")
+            time.sleep(5 * election.interval)
+        app.spectrum = create_spectrum(app)
+        app.spectrum.sync()
+        election.start(app.spectrum)
+        app.election = election
+
+
+def run_server(app, host, port, debug=False):
+    """Serves the app with the server chosen by HTTP_SERVER"""
+    if app.config.get("HTTP_SERVER", "werkzeug") != "waitress":
+        app.run(debug=debug, port=port, host=host)
+        return
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SpectrumInternalException(
+            "HTTP_SERVER=waitress needs waitress: pip3 install waitress"
+        )
+    from .server_endpoints.wallet_events import max_waiting
+
+    threads = app.config.get("HTTP_THREADS", 16)
+    if max_waiting(app.config) >= threads:
+        logger.warning(
+            "EVENTS_MAX_WAITING >= HTTP_THREADS: waiting long-polls can block all RPCs"
+        )
+    serve(
+        app,
+        host=host,
+        port=port,
+        threads=threads,
+        channel_timeout=app.config.get("HTTP_KEEPALIVE_TIMEOUT", 120),
+        connection_limit=app.config.get("HTTP_CONNECTION_LIMIT", 100),
+        ident="spectrum",
+    )
+
+
+def create_wsgi_app():
+    """The app for WSGI-servers running several worker-processes, e.g.
+    gunicorn -w 4 -b 0.0.0.0:8081 'cryptoadvance.spectrum.server:create_wsgi_app()'
+    (without --preload, every worker needs its own threads)
+    """
+    app = create_app()
+    app.config["SYNC_LEADER_ELECTION"] = True
+    init_app(app)
+    return app
 
 
 def main():
@@ -0,0 +1,62 @@
+import hmac
+import logging
+from functools import wraps
+
+from flask import Blueprint, Response, request
+
+from flask import current_app as app
+
+logger = logging.getLogger(__name__)
+
+admin = Blueprint("admin", __name__)
+
+
+def admin_required(f):
+    """Requires the header "Authorization: Bearer <ADMIN_TOKEN>", all endpoints are
+    disabled if no ADMIN_TOKEN is configured
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        token = app.config.get("ADMIN_TOKEN")
+        if not token:
+            return {"message": "admin-endpoints are disabled (ADMIN_TOKEN)"}, 404
+        if not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            return {"message": "unauthorized"}, 401
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+@admin.route("/admin/profiler/start", methods=["POST"])
+@admin_required
+def profiler_start():
+    interval_ms = request.args.get("interval_ms", default=5, type=float)
+    app.spectrum.profiler.start(interval=interval_ms / 1000)
+    return {"running": True, "interval_ms": interval_ms}
+
+
+@admin.route("/admin/profiler/stop", methods=["POST"])
+@admin_required
+def profiler_stop():
+    """Returns the folded stacks, e.g. for flamegraph.pl or speedscope"""
+    folded = app.spectrum.profiler.stop()
+    return Response(
+        folded,
+        mimetype="text/plain",
+        headers={"Content-Disposition": "attachment; filename=spectrum.folded"},
+    )
+
+
+@admin.route("/admin/slow-calls", methods=["GET", "DELETE"])
+@admin_required
+def slow_calls():
+    recorder = app.spectrum.slow_calls
+    if request.method == "DELETE":
+        recorder.calls.clear()
+    threshold_ms = request.args.get("threshold_ms", type=int)
+    if threshold_ms is not None:
+        recorder.set_threshold(threshold_ms)
+    return {"threshold_ms": recorder.threshold_ms, "calls": list(recorder.calls)}
@@ -2,15 +2,26 @@ import logging
 from decimal import Decimal
 import json
 
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, stream_with_context
 
 from flask import current_app as app
 
+from ..streaming import StreamedList, json_chunks
+
 logger = logging.getLogger(__name__)
 
 core_api = Blueprint("core_api", __name__)
 
 
+def _respond(response):
+    """Streams list-results (keeping the app-context for the db-session)"""
+    if isinstance(response["result"], StreamedList):
+        return Response(
+            stream_with_context(json_chunks(response)), mimetype="application/json"
+        )
+    return json.dumps(response)
+
+
 @core_api.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "GET":
@@ -19,7 +30,7 @@ def index():
     if isinstance(data, dict):
         return json.dumps(app.spectrum.jsonrpc(data))
     if isinstance(data, list):
-        return json.dumps([app.spectrum.jsonrpc(item) for item in data])
+        return json.dumps(app.spectrum.jsonrpc_batch(data))
 
 
 @core_api.route("/wallet/", methods=["GET", "POST"])
@@ -29,8 +40,8 @@ def walletrpc(wallet_name=""):
         return "JSONRPC server handles only POST requests"
     data = request.get_json()
     if isinstance(data, dict):
-        return json.dumps(app.spectrum.jsonrpc(data, wallet_name=wallet_name))
-    if isinstance(data, list):
-        return json.dumps(
-            [app.spectrum.jsonrpc(item, wallet_name=wallet_name) for item in data]
+        return _respond(
+            app.spectrum.jsonrpc(data, wallet_name=wallet_name, stream=True)
         )
+    if isinstance(data, list):
+        return json.dumps(app.spectrum.jsonrpc_batch(data, wallet_name=wallet_name))
@@ -0,0 +1,16 @@
+import logging
+
+from flask import Blueprint, Response
+
+from ..metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics_api = Blueprint("metrics_api", __name__)
+
+
+@metrics_api.route("/metrics")
+def prometheus_metrics():
+    if not metrics.enabled:
+        return {"message": "metrics are disabled (METRICS_ENABLED)"}, 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,65 @@
+import logging
+import threading
+
+from flask import Blueprint, request
+
+from flask import current_app as app
+
+from ..db import db
+from ..spectrum_error import RPCError
+
+logger = logging.getLogger(__name__)
+
+wallet_events = Blueprint("wallet_events", __name__)
+
+# seconds a long-poll may wait at most
+MAX_TIMEOUT = 60
+# seconds a client should wait before retrying if too many long-polls are waiting
+RETRY_AFTER = 5
+
+
+def max_waiting(config):
+    """How many long-polls may wait at once, None if there's no limit"""
+    # werkzeug starts a thread per request, waitress has a fixed pool of
+    # HTTP_THREADS and every waiting long-poll holds one of them
+    if config.get("HTTP_SERVER", "werkzeug") != "waitress":
+        return None
+    return config.get("EVENTS_MAX_WAITING") or max(
+        config.get("HTTP_THREADS", 16) // 2, 1
+    )
+
+
+@wallet_events.record_once
+def init_waiting(state):
+    limit = max_waiting(state.app.config)
+    state.app.extensions["spectrum_events_waiting"] = (
+        None if limit is None else threading.BoundedSemaphore(limit)
+    )
+
+
+@wallet_events.route("/wallet/<path:wallet_name>/events")
+def events(wallet_name):
+    """Long-poll for changes of a wallet, see events.py"""
+    try:
+        wallet = app.spectrum.get_wallet(wallet_name)
+    except RPCError as e:
+        return {"error": e.to_dict()}, 404
+    wallet_id = wallet.id
+    # don't hold a database-connection while waiting
+    db.session.close()
+    timeout = min(request.args.get("timeout", default=30, type=float), MAX_TIMEOUT)
+    cursor = request.args.get("cursor", type=int)
+    waiting = app.extensions["spectrum_events_waiting"]
+    # without a cursor (or timeout) it returns right away
+    if waiting is None or cursor is None or timeout <= 0:
+        return app.spectrum.wait_for_events(wallet_id, cursor, timeout)
+    if not waiting.acquire(blocking=False):
+        return (
+            {"error": {"code": -503, "message": "Too many waiting long-polls"}},
+            503,
+            {"Retry-After": str(RETRY_AFTER)},
+        )
+    try:
+        return app.spectrum.wait_for_events(wallet_id, cursor, timeout)
+    finally:
+        waiting.release()
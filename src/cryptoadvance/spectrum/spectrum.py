@@ -1,3 +1,4 @@
+import itertools
 import json
 import logging
 import math
@@ -21,14 +22,41 @@ from embit.script import Script as EmbitScript
 from embit.script import Witness
 from embit.transaction import Transaction as EmbitTransaction
 from embit.transaction import TransactionInput, TransactionOutput
+from sqlalchemy import or_
 from sqlalchemy.sql import func
 
 from .spectrum_error import RPCError
-from .db import UTXO, Descriptor, Script, Tx, TxCategory, Wallet, db
+from .aggregates import add_to_aggregate, existing_txids, get_aggregate
+from .db import (
+    TX_DICT_COLUMNS,
+    UTXO,
+    Descriptor,
+    Script,
+    Tx,
+    TxCategory,
+    Wallet,
+    WalletAggregate,
+    db,
+    script_address,
+    tx_to_dict,
+)
+from .batch import BatchExecutor
+from .batching import CommitBatcher
+from .bulk import bulk_insert
+from .derivation import DerivationService, derived_descriptor
+from .pagination import YIELD_PER, KeysetCache, iter_page_oldest_first, sort_key
+from .events import EventFeed
+from .leader import ElectrumProxy
+from .metrics import RPC_CALLS, RPC_ERRORS, RPC_LATENCY, metrics
+from .profiling import SamplingProfiler, SlowCallRecorder
+from .tracing import KIND_SERVER, tracer
+from .registry import WalletRegistry
+from .rpc_cache import CACHED_METHODS, ResponseCache
+from .streaming import StreamedList
+from .writer import WriteQueue
 from .elsock import ElectrumSocket, ElSockTimeoutException
 from .util import (
     FlaskThread,
-    SpectrumException,
     btc_to_sat,
     get_blockhash,
     handle_exception,
@@ -36,6 +64,7 @@ from .util import (
     sat_to_btc,
     scripthash,
 )
+from .utxo_engine import derive_script_state, state_matches
 
 
 logger = logging.getLogger(__name__)
@@ -44,6 +73,24 @@ logger = logging.getLogger(__name__)
 RPC_METHODS = set()
 # wallet-specific rpc calls
 WALLETRPC_METHODS = set()
+# rpc calls which change state, they don't run concurrently within a batch
+MUTATING_METHODS = {
+    "createwallet",
+    "loadwallet",
+    "unloadwallet",
+    "importdescriptors",
+    "rescanblockchain",
+    "setlabel",
+    "lockunspent",
+    "sendrawtransaction",
+    "walletcreatefundedpsbt",
+}
+# list-rpcs which can stream their result (see streaming.py), with the generator
+# producing the items
+STREAMED_METHODS = {
+    "listtransactions": "_iter_transactions",
+    "listunspent": "_iter_unspent",
+}
 
 
 def rpc(f):
@@ -93,7 +140,11 @@ class Spectrum:
         datadir="data",
         app=None,
         proxy_url=None,
+        leader_url=None,
     ):
+        """leader_url: if given, this process isn't the sync-leader and forwards the
+        Electrum-calls to the leader's internal API (see leader.py)
+        """
         self.app = app
         self.host = host
         self.port = port
@@ -101,23 +152,100 @@ class Spectrum:
         self.proxy_url = proxy_url
         assert type(ssl) == bool, f"ssl is of type {type(ssl)}"
         self.datadir = datadir
+        self._sync_script_counter = itertools.count(1)
+        # where the pages of listtransactions start, see pagination.py
+        self._tx_pages = KeysetCache()
+        self.wallets = WalletRegistry()
+        config = app.config if app else {}
+        # responses of the polled wallet-rpcs, see rpc_cache.py
+        self.responses = ResponseCache(maxsize=config.get("RPC_CACHE_SIZE", 0))
+        self.stream_cache_items = config.get("RPC_STREAM_CACHE_ITEMS", 1000)
+        # other processes write to the same database (leader.py), cached responses
+        # get checked against the version of the wallet in the database
+        self.shared_db = bool(
+            config.get("SYNC_LEADER_ELECTION") or config.get("SYNC_PROCESS")
+        )
+        # changes of the wallets for long-polling clients, see events.py
+        self.events = EventFeed()
+        self._register_gauges()
+        # see profiling.py and the admin-endpoints
+        self.profiler = SamplingProfiler()
+        self.slow_calls = SlowCallRecorder(config.get("SLOW_CALL_THRESHOLD_MS", 0))
+        # method name -> (bound method, whether it's a wallet-rpc)
+        self._rpc_table = {
+            **{method: (getattr(self, method), False) for method in RPC_METHODS},
+            **{method: (getattr(self, method), True) for method in WALLETRPC_METHODS},
+        }
+        self.commits = CommitBatcher(
+            every=config.get("SYNC_COMMIT_EVERY", 1),
+            interval_ms=config.get("SYNC_COMMIT_INTERVAL_MS", 0),
+            durability=config.get("SYNC_COMMIT_DURABILITY", "full"),
+        )
+        self.derivation = DerivationService(workers=config.get("DERIVATION_WORKERS", 1))
+        # executes the items of JSON-RPC batches concurrently
+        self.batches = BatchExecutor(
+            workers=config.get("RPC_BATCH_WORKERS", 1),
+            concurrency=config.get("RPC_BATCH_CONCURRENCY", 1),
+        )
+        # all writes to the database go through the writer-thread
+        self.writer = WriteQueue(app, self.commits)
+        self.writer.start()
         if not os.path.exists(self.txdir):
             logger.info(f"Creating txdir {self.txdir} ")
             os.makedirs(self.txdir)
 
-        logger.info(f"Creating ElectrumSocket {host}:{port} (ssl={ssl})")
+        # wallet_id -> version in the database, see follow_versions()
+        self._db_versions = {}
+        self.t0 = time.time()  # for uptime
+        self.is_leader = leader_url is None
+        if self.is_leader:
+            self._connect()
+        else:
+            logger.info(f"Forwarding Electrum-calls to the sync-leader at {leader_url}")
+            self.sock = ElectrumProxy(leader_url)
+            self.refresh_from_leader()
+
+    def _register_gauges(self):
+        metrics.gauge(
+            "spectrum_write_queue_depth",
+            "Units of work waiting for the writer-thread",
+            lambda: self.writer.queue_depth,
+        )
+        metrics.gauge(
+            "spectrum_electrum_notification_backlog",
+            "Electrum-notifications not processed yet",
+            lambda: len(getattr(self.sock, "_notifications", [])),
+        )
+        metrics.gauge(
+            "spectrum_electrum_subscriptions",
+            "Scripthashes subscribed on the current Electrum-connection",
+            lambda: len(getattr(self.sock, "_subscriptions", [])),
+        )
+        metrics.gauge(
+            "spectrum_response_cache_hits",
+            "Responses served from the cache (rpc_cache.py)",
+            lambda: self.responses.hits,
+        )
+        metrics.gauge(
+            "spectrum_response_cache_misses",
+            "Responses computed and cached",
+            lambda: self.responses.misses,
+        )
+        metrics.gauge("spectrum_blocks", "Height of the tip", lambda: self.blocks)
+
+    def _connect(self):
+        logger.info(f"Creating ElectrumSocket {self.host}:{self.port} (ssl={self.ssl})")
         self.sock = ElectrumSocket(
-            host=host,
-            port=port,
+            host=self.host,
+            port=self.port,
             callback=self.process_notification,
             socket_recreation_callback=self._sync,
-            use_ssl=ssl,
-            proxy_url=proxy_url,
+            use_ssl=self.ssl,
+            proxy_url=self.proxy_url,
         )
 
         # self.sock = ElectrumSocket(host="35.201.74.156", port=143, callback=self.process_notification)
         # 143 - Testnet, 110 - Mainnet, 195 - Liquid
-        self.t0 = time.time()  # for uptime
         if self.sock and self.sock.status == "ok":
             logger.info(f"Pinged electrum in {self.sock.ping()} ")
             logger.info("subscribe to block headers")
@@ -130,9 +258,67 @@ class Spectrum:
             self.roothash = get_blockhash(rootheader)
             self.chain = ROOT_HASHES.get(self.roothash, "regtest")
 
+    def promote(self):
+        """Becomes the sync-leader: connects to Electrum and syncs"""
+        self.sock.shutdown()
+        self.is_leader = True
+        self._connect()
+        self.sync()
+
+    def demote(self, leader_url):
+        """Stops being the sync-leader: forwards the Electrum-calls to leader_url"""
+        self.is_leader = False
+        self.sock.shutdown()
+        logger.info(f"Forwarding Electrum-calls to the sync-leader at {leader_url}")
+        self.sock = ElectrumProxy(leader_url)
+
+    def refresh_from_leader(self):
+        """Takes over the tip from the leader (followers get no notifications)"""
+        status = self.sock.leader_status()
+        if status is None:
+            return
+        self.blocks = status["blocks"]
+        self.bestblockhash = status["bestblockhash"]
+        self.roothash = status["roothash"]
+        self.chain = status["chain"]
+        self._progress_percent = status["progress_percent"]
+
+    def follow_versions(self):
+        """Drops the cached responses and wallets of wallets changed by other
+        processes, detected by the version of their aggregate
+        """
+        for wallet_id, version in db.session.query(
+            WalletAggregate.wallet_id, WalletAggregate.version
+        ):
+            known = self._db_versions.get(wallet_id)
+            if known is not None and known != version:
+                self.responses.bump(wallet_id)
+                self.wallets.invalidate(wallet_id)
+            self._db_versions[wallet_id] = version
+        db.session.rollback()
+
+    def _follow_version(self, wallet_id: int):
+        """Like follow_versions() for one wallet, right before a cached response
+        would be served (another process might have changed it since the last poll)
+        """
+        version = (
+            db.session.query(WalletAggregate.version)
+            .filter(WalletAggregate.wallet_id == wallet_id)
+            .scalar()
+        )
+        known = self._db_versions.get(wallet_id)
+        if known is not None and known != version:
+            self.responses.bump(wallet_id)
+            self.wallets.invalidate(wallet_id)
+        self._db_versions[wallet_id] = version
+
     def stop(self):
         logger.info("Stopping Spectrum")
+        if not self.writer.stop(timeout=10):
+            logger.error("The writer didn't commit the pending writes")
         self.sock.shutdown()
+        self.derivation.shutdown()
+        self.batches.shutdown()
 
     def is_connected(self) -> bool:
         """Returns True if there is a socket connection, False otherwise."""
@@ -225,6 +411,8 @@ class Spectrum:
             self._sync_in_progress = False
 
     def sync(self, asyncc=True):
+        if not self.is_leader:
+            return
         if asyncc:
             # Using a FlaskThread means also by default that it's a daemon-thread. This has the advantage that
             # The thread is killed when the main-thread is killed but it does not do it in a tidy way.
@@ -242,6 +430,9 @@ class Spectrum:
         """Takes a descriptor and syncs all the scripts into the DB
         creates a new thread doing that.
         """
+        if not self.is_leader:
+            self.sock.subscribe_descriptor(descriptor.id)
+            return
         if asyncc:
             t = FlaskThread(
                 target=self._subcribe_scripts,
@@ -296,6 +487,13 @@ class Spectrum:
         )
 
     def sync_script(self, script, state=None):
+        with tracer.span(
+            "sync_script",
+            **{"spectrum.script_id": script.id, "spectrum.wallet_id": script.wallet_id},
+        ):
+            return self._sync_script(script, state)
+
+    def _sync_script(self, script, state=None):
         # Normally every script has 1-2 transactions and 0-1 utxos,
         # so even if we delete everything and resync it's ok
         # except donation addresses that may have many txs...
@@ -307,42 +505,64 @@ class Spectrum:
                 f"Script {script.scripthash[:7]} has an update from state {script.state} to {state}"
             )
         script_pubkey = script.script_pubkey
-        internal = script.descriptor.internal
-        # get all transactions, utxos and update balances
-        # {height,tx_hash,tx_pos,value}
-        utxos = self.sock.call("blockchain.scripthash.listunspent", [script.scripthash])
-        # {confirmed,unconfirmed}
-        balance = self.sock.call(
-            "blockchain.scripthash.get_balance", [script.scripthash]
-        )
+        # get all transactions, utxos and balances get derived locally from them
         # {height,tx_hash}
         txs = self.sock.call("blockchain.scripthash.get_history", [script.scripthash])
+        blockheaders = {}
+        parsed_txs = {}
+        for tx in txs:
+            height = tx.get("height")
+            if height not in blockheaders:
+                blockheader = self.sock.call("blockchain.block.header", [height])
+                blockheaders[height] = parse_blockheader(blockheader)
+            parsed_txs[tx["tx_hash"]] = self._fetch_tx(tx["tx_hash"])
+
+        # {height,tx_hash,tx_pos,value} and {confirmed,unconfirmed}
+        utxos, balance = derive_script_state(script_pubkey, txs, parsed_txs)
+        if self._should_verify_utxos():
+            utxos, balance = self._verify_script_state(script, utxos, balance)
+
+        wallet_id = script.wallet_id
+        self.writer.submit(
+            self._store_script_state,
+            script.id,
+            state,
+            txs,
+            blockheaders,
+            parsed_txs,
+            utxos,
+            balance,
+        ).add_done_callback(lambda f: self._script_stored(wallet_id, f))
+        if txs:
+            self._extend_gap(script)
+
+    def _store_script_state(
+        self, script_id, state, txs, blockheaders, parsed_txs, utxos, balance
+    ):
+        """Unit of work for the writer: brings the txs, utxos and balance of the script
+        in the database to what sync_script got from electrum
+        """
+        script = Script.query.get(script_id)
+        script_pubkey = script.script_pubkey
+        internal = script.descriptor.internal
         # dict with all txs in the database
         db_txs = {tx.txid: tx for tx in script.txs}
         # delete all txs that are not there any more:
         all_txids = {tx["tx_hash"] for tx in txs}
+        deleted_txids = set()
         for txid, tx in db_txs.items():
             if txid not in all_txids:
                 db.session.delete(tx)
+                deleted_txids.add(txid)
+        new_txs = []
+        confirmations = []  # (txid, height) of existing txs with a new height
         for tx in txs:
-            blockheader = self.sock.call("blockchain.block.header", [tx.get("height")])
-            blockheader = parse_blockheader(blockheader)
+            blockheader = blockheaders[tx.get("height")]
+            parsedTx = parsed_txs[tx["tx_hash"]]
             # update existing - set height
-            tx_in_db = tx["tx_hash"] in db_txs
-            try:
-                tx_magic = self.sock.call(
-                    "blockchain.transaction.get", [tx["tx_hash"], tx_in_db]
-                )
-            except ValueError as e:
-                if str(e).startswith(
-                    "verbose transactions are currently unsupported"
-                ):  # electrs doesn't support it
-                    tx_magic = self.sock.call(
-                        "blockchain.transaction.get", [tx["tx_hash"], False]
-                    )
-                else:
-                    raise e
-            if tx_in_db:
+            if tx["tx_hash"] in db_txs:
+                if db_txs[tx["tx_hash"]].height != tx.get("height"):
+                    confirmations.append((tx["tx_hash"], tx.get("height")))
                 db_txs[tx["tx_hash"]].height = tx.get("height")
                 db_txs[tx["tx_hash"]].blockhash = blockheader.get(
                     "blockhash"
@@ -352,18 +572,6 @@ class Spectrum:
                 )  # not existing, how can we fix that?
             # new tx
             else:
-                tx_details = {
-                    "tx_hash": tx_magic,
-                    "blockhash": blockheader.get("blockhash"),
-                    "blocktime": blockheader.get("blocktime"),
-                }
-                # dump to file
-                fname = os.path.join(self.txdir, "%s.raw" % tx["tx_hash"])
-                if not os.path.exists(fname):
-                    with open(fname, "w") as f:
-                        f.write(tx_magic)
-
-                parsedTx = EmbitTransaction.from_string(tx_magic)
                 replaceable = all([inp.sequence < 0xFFFFFFFE for inp in parsedTx.vin])
 
                 category = TxCategory.RECEIVE
@@ -380,21 +588,22 @@ class Spectrum:
                     if internal:  # receive to change is hidden in txlist
                         category = TxCategory.CHANGE
 
-                t = Tx(
-                    txid=tx["tx_hash"],
-                    blockhash=tx_details.get("blockhash"),
-                    height=tx.get("height"),
-                    blocktime=tx_details.get("blocktime"),
-                    replaceable=replaceable,
-                    category=category,
-                    vout=vout,
-                    amount=amount,
-                    fee=tx.get("fee", 0),
-                    # refs
-                    script=script,
-                    wallet=script.wallet,
+                new_txs.append(
+                    {
+                        "txid": tx["tx_hash"],
+                        "blockhash": blockheader.get("blockhash"),
+                        "height": tx.get("height"),
+                        "blocktime": blockheader.get("blocktime"),
+                        "replaceable": replaceable,
+                        "category": category,
+                        "vout": vout,
+                        "amount": amount,
+                        "fee": tx.get("fee", 0),
+                        # refs
+                        "script_id": script.id,
+                        "wallet_id": script.wallet_id,
+                    }
                 )
-                db.session.add(t)
 
         # dicts of all electrum utxos and all db utxos
         all_utxos = {(u["tx_hash"], u["tx_pos"]): u for u in utxos}
@@ -405,6 +614,7 @@ class Spectrum:
             if k not in all_utxos:
                 db.session.delete(utxo)
         # add all utxos
+        new_utxos = []
         for k, utxo in all_utxos.items():
             # update existing
             if k in db_utxos:
@@ -413,19 +623,86 @@ class Spectrum:
                 u.amount = utxo["value"]
             # add new
             else:
-                u = UTXO(
-                    txid=utxo["tx_hash"],
-                    vout=utxo["tx_pos"],
-                    height=utxo.get("height"),
-                    amount=utxo["value"],
-                    script=script,
-                    wallet=script.wallet,
+                new_utxos.append(
+                    {
+                        "txid": utxo["tx_hash"],
+                        "vout": utxo["tx_pos"],
+                        "height": utxo.get("height"),
+                        "amount": utxo["value"],
+                        "script_id": script.id,
+                        "wallet_id": script.wallet_id,
+                    }
                 )
-                db.session.add(u)
+        # the txcount of the wallet only changes by txids it didn't have / doesn't have anymore
+        new_txids = {tx["txid"] for tx in new_txs}
+        txcount_delta = len(new_txids - existing_txids(script.wallet_id, new_txids))
+        bulk_insert(Tx, new_txs)
+        bulk_insert(UTXO, new_utxos)
+        txcount_delta -= len(
+            deleted_txids - existing_txids(script.wallet_id, deleted_txids)
+        )
+        confirmed_delta = balance["confirmed"] - (script.confirmed or 0)
+        unconfirmed_delta = balance["unconfirmed"] - (script.unconfirmed or 0)
         script.state = state
         script.confirmed = balance["confirmed"]
         script.unconfirmed = balance["unconfirmed"]
-        db.session.commit()
+        db.session.flush()
+        add_to_aggregate(
+            script.wallet_id,
+            confirmed=confirmed_delta,
+            unconfirmed=unconfirmed_delta,
+            txcount=txcount_delta,
+        )
+        # for the event-feed, see events.py
+        events = [{"type": "removed", "txid": txid} for txid in deleted_txids]
+        events += [
+            {"type": "tx", "txid": tx["txid"], "height": tx["height"]} for tx in new_txs
+        ]
+        events += [
+            {"type": "confirmation", "txid": txid, "height": height}
+            for txid, height in confirmations
+        ]
+        if confirmed_delta or unconfirmed_delta:
+            events.append(
+                {
+                    "type": "balance",
+                    "confirmed": confirmed_delta,
+                    "unconfirmed": unconfirmed_delta,
+                }
+            )
+        return events
+
+    def _script_stored(self, wallet_id, future):
+        """Called once the changes of sync_script are committed"""
+        self.responses.bump(wallet_id)
+        if future.exception() is None:
+            self.events.publish(wallet_id, future.result())
+
+    def _should_verify_utxos(self) -> bool:
+        """Whether the locally derived state of the currently synced script should be
+        cross-checked with the Electrum server (every UTXO_VERIFICATION_INTERVAL-th sync)
+        """
+        interval = self.app.config.get("UTXO_VERIFICATION_INTERVAL", 0)
+        if not interval:
+            return False
+        return next(self._sync_script_counter) % interval == 0
+
+    def _verify_script_state(self, script, utxos, balance):
+        """Asks the Electrum server for the utxos and the balance of the script and compares
+        them to the locally derived ones. The server wins if they differ.
+        """
+        server_utxos = self.sock.call(
+            "blockchain.scripthash.listunspent", [script.scripthash]
+        )
+        server_balance = self.sock.call(
+            "blockchain.scripthash.get_balance", [script.scripthash]
+        )
+        if not state_matches(utxos, balance, server_utxos, server_balance):
+            logger.warning(
+                f"Script {script.scripthash[:7]}: local utxos/balance {utxos}/{balance} differ from electrum's {server_utxos}/{server_balance}"
+            )
+            return server_utxos, server_balance
+        return utxos, balance
 
     @property
     def network(self):
@@ -439,6 +716,16 @@ class Spectrum:
             logger.info(params)
             self.blocks = params[0]["height"]
             self.bestblockhash = get_blockhash(params[0]["hex"])
+            self.events.publish(
+                None,
+                [
+                    {
+                        "type": "block",
+                        "height": self.blocks,
+                        "blockhash": self.bestblockhash,
+                    }
+                ],
+            )
         if method == "blockchain.scripthash.subscribe":
             scripthash = params[0]
             state = params[1]
@@ -448,15 +735,91 @@ class Spectrum:
                 for sc in scripts:
                     self.sync_script(sc, state)
 
+    def wait_for_events(self, wallet_id: int, cursor=None, timeout=30) -> dict:
+        """Long-polls the event-feed (of the sync-leader, see events.py)"""
+        if self.is_leader:
+            return self.events.wait(wallet_id, cursor, timeout)
+        return self.sock.wait_for_events(wallet_id, cursor, timeout)
+
     def get_wallet(self, wallet_name):
-        w = Wallet.query.filter_by(name=wallet_name).first()
+        w = self.wallets.get(wallet_name)
         if not w:
             raise RPCError(
                 f"Requested wallet {wallet_name} does not exist or is not loaded", -18
             )
         return w
 
-    def jsonrpc(self, obj, wallet_name=None, catch_exceptions=True):
+    def jsonrpc_batch(self, objs: list, wallet_name=None) -> list:
+        """Executes a JSON-RPC batch, independent calls concurrently (see batch.py)"""
+        with tracer.span("jsonrpc_batch", KIND_SERVER, **{"rpc.batch_size": len(objs)}):
+            return self.batches.map(
+                lambda obj: self.jsonrpc(obj, wallet_name=wallet_name),
+                objs,
+                barrier=lambda obj: not isinstance(obj, dict)
+                or obj.get("method") in MUTATING_METHODS,
+            )
+
+    def jsonrpc(self, obj, wallet_name=None, catch_exceptions=True, stream=False):
+        """stream: the result of the STREAMED_METHODS may be a StreamedList, which
+        gets produced while it's serialized (see streaming.py)
+        """
+        if not (metrics.enabled or self.slow_calls.enabled or tracer.enabled):
+            return self._jsonrpc(obj, wallet_name, catch_exceptions, stream)
+        method = obj.get("method")
+        span_context = tracer.span(
+            f"jsonrpc {method if method in self._rpc_table else 'unknown'}",
+            KIND_SERVER,
+            **{"rpc.method": str(method), "spectrum.wallet": wallet_name or ""},
+        )
+        with span_context as span, self.slow_calls.track(
+            method, wallet_name, obj.get("params")
+        ) as call:
+            call.response = self._metered_jsonrpc(
+                obj, wallet_name, catch_exceptions, stream
+            )
+            result = call.response["result"]
+            if span is not None and isinstance(result, StreamedList):
+                # the span ends with the stream and covers the reads of the rows
+                span_context.defer()
+                result.around_reads(lambda: tracer.attach(span))
+                result.on_finish(lambda error: tracer.finish(span, error))
+            elif span is not None and call.response["error"] is not None:
+                span.error = call.response["error"]["message"]
+        return call.response
+
+    def _metered_jsonrpc(
+        self, obj, wallet_name=None, catch_exceptions=True, stream=False
+    ):
+        if not metrics.enabled:
+            return self._jsonrpc(obj, wallet_name, catch_exceptions, stream)
+        method = obj.get("method")
+        # only known methods as labels, clients could send anything
+        label = method if method in self._rpc_table else "unknown"
+        start = time.perf_counter()
+        streamed = False
+        try:
+            res = self._jsonrpc(obj, wallet_name, catch_exceptions, stream)
+            streamed = isinstance(res["result"], StreamedList)
+        except Exception:
+            RPC_ERRORS.inc(label)
+            raise
+        finally:
+            RPC_CALLS.inc(label)
+            if not streamed:
+                RPC_LATENCY.observe(time.perf_counter() - start, label)
+        if streamed:
+
+            def observe(error):
+                if isinstance(error, Exception):
+                    RPC_ERRORS.inc(label)
+                RPC_LATENCY.observe(time.perf_counter() - start, label)
+
+            res["result"].on_finish(observe)
+        if res["error"] is not None:
+            RPC_ERRORS.inc(label)
+        return res
+
+    def _jsonrpc(self, obj, wallet_name=None, catch_exceptions=True, stream=False):
         method = obj.get("method")
         id = obj.get("id", 0)
         params = obj.get("params", [])
@@ -470,20 +833,43 @@ class Spectrum:
             # get wallet by name
             wallet = self.get_wallet(wallet_name) if wallet_name is not None else None
             # unknown method
-            if method not in RPC_METHODS and method not in WALLETRPC_METHODS:
+            if method not in self._rpc_table:
                 raise RPCError(f"Method not found ({method})", -32601)
+            m, is_walletrpc = self._rpc_table[method]
             # wallet is not provided
-            if method in WALLETRPC_METHODS and wallet is None:
+            if is_walletrpc and wallet is None:
                 raise RPCError("Wallet file not specified", -19)
-            m = getattr(self, f"{method}")
+            # read what has been synced so far
+            if is_walletrpc:
+                self.commits.wait_for_flush()
             if isinstance(params, list):
                 args = params
                 kwargs = {}
             else:
                 args = []
                 kwargs = params
+            if is_walletrpc and self.shared_db and method in CACHED_METHODS:
+                self._follow_version(wallet.id)
             # for wallet-specific methods also pass wallet
-            if method in WALLETRPC_METHODS:
+            if is_walletrpc and stream and method in STREAMED_METHODS:
+                iter_items = getattr(self, STREAMED_METHODS[method])
+                res = self.responses.stream(
+                    wallet.id,
+                    method,
+                    params,
+                    self.blocks,
+                    lambda: iter_items(wallet, *args, **kwargs),
+                    keep=self.stream_cache_items,
+                )
+            elif is_walletrpc and method in CACHED_METHODS:
+                res = self.responses.call(
+                    wallet.id,
+                    method,
+                    params,
+                    self.blocks,
+                    lambda: m(wallet, *args, **kwargs),
+                )
+            elif is_walletrpc:
                 res = m(wallet, *args, **kwargs)
             else:
                 res = m(*args, **kwargs)
@@ -745,19 +1131,32 @@ class Spectrum:
         """Creates a wallet
         By default, it'll get a hotwallet
         """
+        wallet_id = self.writer.call(
+            self._create_wallet, wallet_name, not disable_private_keys
+        )
+        self.wallets.invalidate(wallet_id)
+        w = Wallet.query.get(wallet_id)
+        if not blank and not disable_private_keys:
+            self.set_seed(w)  # random seed is set if nothing is passed as an argument
+        return {"name": wallet_name, "warning": ""}
+
+    def _create_wallet(self, wallet_name, private_keys_enabled):
         w = Wallet.query.filter_by(name=wallet_name).first()
         if w:
             raise RPCError("Wallet already exists", -4)
         w = Wallet(
             name=wallet_name,
-            private_keys_enabled=(not disable_private_keys),
+            private_keys_enabled=private_keys_enabled,
             seed=None,
         )
         db.session.add(w)
-        db.session.commit()
-        if not blank and not disable_private_keys:
-            self.set_seed(w)  # random seed is set if nothing is passed as an argument
-        return {"name": wallet_name, "warning": ""}
+        db.session.flush()
+        db.session.add(
+            WalletAggregate(
+                wallet_id=w.id, confirmed=0, unconfirmed=0, txcount=0, version=0
+            )
+        )
+        return w.id
 
     @rpc
     def loadwallet(self, filename, load_on_startup=True):
@@ -774,21 +1173,15 @@ class Spectrum:
 
     @walletrpc
     def getwalletinfo(self, wallet):
-        confirmed, unconfirmed = self._get_balance(wallet)
-        txnum = (
-            db.session.query(Tx.txid)
-            .filter(Tx.wallet_id == wallet.id)
-            .distinct()
-            .count()
-        )
+        aggregate = get_aggregate(wallet.id)
         return {
             "walletname": wallet.name,
             "walletversion": 169900,
             "format": "sqlite",
-            "balance": sat_to_btc(confirmed),
-            "unconfirmed_balance": sat_to_btc(unconfirmed),
+            "balance": sat_to_btc(aggregate.confirmed),
+            "unconfirmed_balance": sat_to_btc(aggregate.unconfirmed),
             "immature_balance": 0,
-            "txcount": txnum,
+            "txcount": aggregate.txcount,
             "keypoolsize": wallet.get_keypool(internal=False),
             "keypoolsize_hd_internal": wallet.get_keypool(internal=True),
             "paytxfee": 0,
@@ -858,14 +1251,10 @@ class Spectrum:
         }
         if ismine:
             desc = sc.descriptor.get_descriptor()
-            derived_desc = desc.derive(sc.index).to_public()
-            # convert xpubs to pubs
-            for k in derived_desc.keys:
-                if k.is_extended:
-                    k.key = k.key.key
             obj.update(
                 {
-                    "desc": add_checksum(str(derived_desc)),
+                    # derive() converts xpubs to pubs
+                    "desc": sc.descriptor.derive(sc.index),
                     "parent_desc": add_checksum(str(desc.to_public())),
                 }
             )
@@ -889,12 +1278,15 @@ class Spectrum:
     @walletrpc
     def setlabel(self, wallet, address, label):
         scriptpubkey = EmbitScript.from_address(address)
-        sc = Script.query.filter_by(
-            script=scriptpubkey.data.hex(), wallet=wallet
-        ).first()
+        self.writer.call(self._set_label, wallet.id, scriptpubkey.data.hex(), label)
+        self.responses.bump(wallet.id)
+
+    def _set_label(self, wallet_id, script_hex, label):
+        sc = Script.query.filter_by(script=script_hex, wallet_id=wallet_id).first()
         if sc:
             sc.label = label
-        db.session.commit()
+            # label-filtered listings change
+            add_to_aggregate(wallet_id)
 
     @walletrpc
     def getaddressesbylabel(self, wallet, label):
@@ -913,6 +1305,20 @@ class Spectrum:
                 tx = EmbitTransaction.from_string(f.read())
             return tx
 
+    def _fetch_tx(self, txid):
+        """Returns the parsed transaction from the txs-cache and fetches it
+        from electrum (and dumps it to the cache) if it's not there yet
+        """
+        tx = self._get_tx(txid)
+        if tx is not None:
+            return tx
+        raw_tx = self.sock.call("blockchain.transaction.get", [txid, False])
+        # dump to file
+        fname = os.path.join(self.txdir, "%s.raw" % txid)
+        with open(fname, "w") as f:
+            f.write(raw_tx)
+        return EmbitTransaction.from_string(raw_tx)
+
     @walletrpc
     def gettransaction(self, wallet, txid, include_watchonly=True, verbose=False):
         tx = self._get_tx(txid)
@@ -965,28 +1371,38 @@ class Spectrum:
     def listtransactions(
         self, wallet, label="*", count=10, skip=0, include_watchonly=True
     ):
-        txs = (
-            db.session.query(Tx)
+        """The count most recent txs after skipping skip, oldest first like in Core"""
+        return list(
+            self._iter_transactions(wallet, label, count, skip, include_watchonly)
+        )
+
+    def _iter_transactions(
+        self, wallet, label="*", count=10, skip=0, include_watchonly=True
+    ):
+        query = (
+            db.session.query(*TX_DICT_COLUMNS, Tx.id, Script.script)
+            .join(Script, Tx.script_id == Script.id)
             .filter(Tx.wallet_id == wallet.id)
-            .offset(skip)
-            .limit(count)
-            .all()
         )
-        return [tx.to_dict(self.blocks, self.network) for tx in txs]
+        if label == "":
+            query = query.filter(or_(Script.label == "", Script.label.is_(None)))
+        elif label != "*":
+            query = query.filter(Script.label == label)
+        scope = (wallet.id, label, get_aggregate(wallet.id).version)
+        after = self._tx_pages.get(scope, skip) if skip else None
+        n = 0
+        for row in iter_page_oldest_first(query, count, skip=skip, after=after):
+            if n == 0:
+                oldest = sort_key(row)
+            n += 1
+            yield tx_to_dict(row, row.script, self.blocks, self.network)
+        if n:
+            self._tx_pages.put(scope, skip + n, oldest)
 
     def _get_balance(self, wallet: Wallet):
         """Returns a tuple: (confirmed, unconfirmed) in sats"""
-        confirmed, unconfirmed = (
-            db.session.query(
-                func.sum(Script.confirmed).label("confirmed"),
-                func.sum(Script.unconfirmed).label("unconfirmed"),
-            )
-            .filter(Script.wallet == wallet)
-            .first()
-        )
-        if confirmed is None or unconfirmed is None:
-            raise SpectrumException(f"No scripts for wallet {wallet.name}")
-        return confirmed, unconfirmed
+        aggregate = get_aggregate(wallet.id)
+        return aggregate.confirmed, aggregate.unconfirmed
 
     @walletrpc
     def getbalances(self, wallet):
@@ -1006,10 +1422,17 @@ class Spectrum:
 
     @walletrpc
     def lockunspent(self, wallet, unlock, transactions=[]):
+        result = self.writer.call(self._lock_unspent, wallet.id, unlock, transactions)
+        self.responses.bump(wallet.id)
+        return result
+
+    def _lock_unspent(self, wallet_id, unlock, transactions):
         for txobj in transactions:
             txid = txobj["txid"]
             vout = txobj["vout"]
-            utxo = UTXO.query.filter_by(wallet=wallet, txid=txid, vout=vout).first()
+            utxo = UTXO.query.filter_by(
+                wallet_id=wallet_id, txid=txid, vout=vout
+            ).first()
             if utxo is None:
                 raise RPCError("Invalid parameter, unknown transaction", -8)
             if utxo.locked and not unlock:
@@ -1017,7 +1440,7 @@ class Spectrum:
             if not utxo.locked and unlock:
                 raise RPCError("Invalid parameter, expected locked output", -8)
             utxo.locked = not unlock
-            db.session.commit()
+        add_to_aggregate(wallet_id)
         return True
 
     @walletrpc
@@ -1034,6 +1457,21 @@ class Spectrum:
         addresses=[],
         include_unsafe=True,
         query_options={},
+    ):
+        return list(
+            self._iter_unspent(
+                wallet, minconf, maxconf, addresses, include_unsafe, query_options
+            )
+        )
+
+    def _iter_unspent(
+        self,
+        wallet,
+        minconf=1,
+        maxconf=9999999,
+        addresses=[],
+        include_unsafe=True,
+        query_options={},
     ):
         # TODO: options are currently ignored
         options = {
@@ -1043,27 +1481,42 @@ class Spectrum:
             "minimumSumAmount": 0,
         }
         options.update(query_options)
-        utxos = UTXO.query.filter_by(wallet=wallet, locked=False).all()
-        return [
-            {
-                "txid": utxo.txid,
-                "vout": utxo.vout,
-                "amount": round(utxo.amount * 1e-8, 8),
+        rows = (
+            db.session.query(
+                UTXO.txid,
+                UTXO.vout,
+                UTXO.amount,
+                UTXO.height,
+                Script.script,
+                Script.index,
+                Descriptor.descriptor,
+                Descriptor.private_descriptor,
+            )
+            .join(Script, UTXO.script_id == Script.id)
+            .join(Descriptor, Script.descriptor_id == Descriptor.id)
+            .filter(UTXO.wallet_id == wallet.id, UTXO.locked == False)
+            .yield_per(YIELD_PER)
+        )
+        for row in rows:
+            yield {
+                "txid": row.txid,
+                "vout": row.vout,
+                "amount": round(row.amount * 1e-8, 8),
                 "spendable": True,
                 "solvable": True,
-                "safe": utxo.height is not None,
-                "confirmations": (self.blocks - utxo.height + 1)
-                if utxo.height
+                "safe": row.height is not None,
+                "confirmations": (self.blocks - row.height + 1)
+                if row.height
                 else 0
-                if utxo.height is not None
+                if row.height is not None
                 else 0,
-                "address": utxo.script.address(self.network),
-                "scriptPubKey": utxo.script.script,
-                "desc": utxo.script.descriptor.derive(utxo.script.index),
+                "address": script_address(row.script, self.network),
+                "scriptPubKey": row.script,
+                "desc": derived_descriptor(
+                    row.private_descriptor or row.descriptor, row.index
+                ),
                 # "desc": True, # should be descriptor, but we only check if desc is there or not
             }
-            for utxo in utxos
-        ]
 
     @walletrpc
     def listsinceblock(
@@ -1111,7 +1564,7 @@ class Spectrum:
     @walletrpc
     def getreceivedbyaddress(self, wallet, address, minconf=1):
         sc = EmbitScript.from_address(address)
-        script = Script.query.filter_by(script=sc.data.hex()).first()
+        script = Script.query.filter_by(script=sc.data.hex(), wallet=wallet).first()
         if not script:
             return 0
         # no transactions on this script
@@ -1266,11 +1719,15 @@ class Spectrum:
             if sc:
                 self._fill_scope(psbt.outputs[changepos], sc)
         if lockUnspents:
-            for inp in inputs:
-                inp.locked = True
-            db.session.commit()
+            self.writer.call(self._lock_utxos, wallet.id, [inp.id for inp in inputs])
+            self.responses.bump(wallet.id)
         return {"psbt": str(psbt), "fee": sat_to_btc(fee), "changepos": changepos}
 
+    def _lock_utxos(self, wallet_id, utxo_ids):
+        for utxo in UTXO.query.filter(UTXO.id.in_(utxo_ids)):
+            utxo.locked = True
+        add_to_aggregate(wallet_id)
+
     @walletrpc
     def walletprocesspsbt(self, wallet, psbt, sign=True, sighashtype=None):
         psbt = PSBT.from_string(psbt)
@@ -1344,20 +1801,57 @@ class Spectrum:
         **kwargs,
     ):
         logger.info(f"Importing descriptor {desc}")
-        addr_range = kwargs.get("range", 300)  # because range is special keyword
+        # because range is special keyword, an int or [begin, end] like in Core.
+        # Without GAP_LIMIT it defaults to 300, otherwise derivation is lazy beyond
+        # an explicit range (clients like Specter derive addresses on their own).
+        addr_range = kwargs.get("range")
+        if isinstance(addr_range, (list, tuple)):
+            addr_range = addr_range[1] + 1
         descriptor = EmbitDescriptor.from_string(desc)
         has_private_keys = any([k.is_private for k in descriptor.keys])
         private_descriptor = None
         if has_private_keys:
             private_descriptor = desc
             desc = str(descriptor)
+        gap_limit = self.gap_limit
+        if gap_limit:
+            derive_until = max(next_index + gap_limit, addr_range or 0)
+        else:
+            derive_until = next_index + (addr_range or 300)
+        descriptor_id = self.writer.call(
+            self._import_descriptor,
+            wallet.id,
+            desc,
+            private_descriptor,
+            internal,
+            active,
+            next_index,
+            derive_until,
+        )
+        self.wallets.invalidate(wallet.id)
+        self.responses.bump(wallet.id)
+        d = Descriptor.query.get(descriptor_id)
+        self.subcribe_scripts(d)
+        return d
+
+    def _import_descriptor(
+        self,
+        wallet_id,
+        desc,
+        private_descriptor,
+        internal,
+        active,
+        next_index,
+        derive_until,
+    ):
         if active:
             # deactivate other active descriptor
-            for old_desc in wallet.descriptors:
-                if old_desc.internal == internal and old_desc.active:
-                    old_desc.active = False
+            for old_desc in Descriptor.query.filter_by(
+                wallet_id=wallet_id, internal=internal, active=True
+            ):
+                old_desc.active = False
         d = Descriptor(
-            wallet_id=wallet.id,
+            wallet_id=wallet_id,
             active=active,
             internal=internal,
             descriptor=desc,
@@ -1365,24 +1859,101 @@ class Spectrum:
             next_index=next_index,
         )
         db.session.add(d)
-        db.session.commit()
-        # TODO: move to keypoolrefill or something
+        db.session.flush()
         # Add scripts
+        logger.info(f"Creating {derive_until} scriptpubkeys for wallet {wallet_id}")
+        self._derive_scripts(d, 0, derive_until)
+        add_to_aggregate(wallet_id)
+        return d.id
+
+    @property
+    def gap_limit(self) -> int:
+        return self.app.config.get("GAP_LIMIT", 0) if self.app else 0
+
+    def _extend_descriptor(self, descriptor_id: int, index: int) -> tuple:
+        """Unit of work for the writer: marks index as used and derives the scripts
+        up to next_index + gap_limit. Returns whether next_index moved and the new
+        scripts like _derive_scripts().
+        """
+        descriptor = Descriptor.query.get(descriptor_id)
+        moved = index >= (descriptor.next_index or 0)
+        if moved:
+            descriptor.next_index = index + 1
+            # the keypool changes
+            add_to_aggregate(descriptor.wallet_id)
+        max_index = descriptor.max_derived_index()
+        start = 0 if max_index is None else max_index + 1
+        end = descriptor.next_index + self.gap_limit
+        if end <= start:
+            return moved, []
         logger.info(
-            f"Creating {next_index + addr_range} scriptpubkeys for wallet {wallet}"
+            f"Extending gap of descriptor {descriptor.descriptor[:30]} to index {end - 1}"
+        )
+        return moved, self._derive_scripts(descriptor, start, end)
+
+    def _derive_scripts(self, descriptor: Descriptor, start: int, end: int) -> list:
+        """Inserts the scripts with index start..end-1 of the descriptor and returns
+        them as a list of dicts. The caller has to commit.
+        """
+        rows = [
+            {
+                "wallet_id": descriptor.wallet_id,
+                "descriptor_id": descriptor.id,
+                "index": i,
+                "script": script_hex,
+                "scripthash": sh,
+            }
+            for i, script_hex, sh in self.derivation.derive(
+                descriptor.descriptor, start, end
+            )
+        ]
+        bulk_insert(Script, rows)
+        return rows
+
+    def _extend_gap(self, script: Script):
+        """Called after a script of ours got activity. Marks the address as used (next_index)
+        and derives and subscribes more scripts if the activity is close to the edge of the
+        derived window so that there are always gap_limit unused scripts beyond it.
+        The extension goes into the current batch of the writer, the returned future
+        (None if there's nothing to do) resolves once it's committed.
+        """
+        gap_limit = self.gap_limit
+        if not gap_limit or script.index is None or script.descriptor is None:
+            return None
+        # activity on an already used index changes nothing, so it mustn't touch the
+        # descriptor (and force a commit of the pending batch). next_index only grows,
+        # so a stale value in this session errs on the safe side.
+        if script.index < (script.descriptor.next_index or 0):
+            return None
+        wallet_id = script.wallet_id
+        future = self.writer.submit(
+            self._extend_descriptor, script.descriptor_id, script.index
         )
-        for i in range(0, next_index + addr_range):
-            scriptpubkey = descriptor.derive(i).script_pubkey()
-            address = scriptpubkey.address()
-            # logger.info(f"   {address}")
-            sc = Script(
-                wallet=wallet,
-                descriptor=d,
-                index=i,
-                script=scriptpubkey.data.hex(),
-                scripthash=scripthash(scriptpubkey),
+        future.add_done_callback(lambda f: self._gap_extended(wallet_id, f))
+        return future
+
+    def _gap_extended(self, wallet_id, future):
+        """Called once the changes of _extend_descriptor are committed"""
+        if future.exception() is not None:
+            logger.error(
+                f"Extending the gap of wallet {wallet_id} failed: {future.exception()}"
             )
-            db.session.add(sc)
-        db.session.commit()
-        self.subcribe_scripts(d)
-        return d
+            return
+        moved, new_scripts = future.result()
+        if moved:
+            self.wallets.invalidate(wallet_id)
+            self.responses.bump(wallet_id)
+        if new_scripts:
+            # this runs in the writer-thread which mustn't wait for the Electrum server
+            FlaskThread(target=self._subscribe_scripts, args=[new_scripts]).start()
+
+    def _subscribe_scripts(self, rows: list) -> None:
+        """Subscribes the freshly derived scripts and syncs the ones with a state"""
+        for row in rows:
+            res = self.sock.call("blockchain.scripthash.subscribe", [row["scripthash"]])
+            # new scripts have no state yet
+            if res is not None:
+                sc = Script.query.filter_by(
+                    descriptor_id=row["descriptor_id"], index=row["index"]
+                ).first()
+                self.sync_script(sc, res)
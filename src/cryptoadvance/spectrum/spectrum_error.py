@@ -6,4 +6,4 @@ class RPCError(Exception):
         self.code = code
 
     def to_dict(self):
-        return {"code": self.code, "message": self.message}
\ No newline at end of file
+        return {"code": self.code, "message": self.message}
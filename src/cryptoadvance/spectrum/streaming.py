@@ -0,0 +1,103 @@
+"""Streamed responses for list-style wallet-RPCs
+
+A listtransactions with count=100000 or the listunspent of a big wallet would build
+the full list of dicts and then one big JSON-string from it. For single (non-batch)
+calls of the STREAMED_METHODS (see spectrum.py), the result is a StreamedList instead:
+a generator reading the rows chunk-wise (yield_per) from the database, which
+json_chunks() serializes into the chunks of a Flask streaming response. So the peak
+memory doesn't depend on the size of the result.
+
+The generator runs up to its first item before the response starts, so invalid params
+still get a regular error-response. Errors later on can only abort the stream.
+
+Most of the work happens after jsonrpc() returned, so the metrics, the tracing-span
+and the slow-call record of a streamed call get finished via on_finish(), and
+around_reads() lets them cover the reads of the rows.
+"""
+
+import json
+import logging
+from contextlib import ExitStack
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+# serialized items are sent in chunks of at least that many bytes
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamedList:
+    """A list-result which gets produced while it's serialized"""
+
+    def __init__(self, items, keep=0, on_complete=None):
+        """keep: up to that many items are collected and passed to on_complete(items)
+        once the stream is through (e.g. to cache small results)
+        """
+        self._items = iter(items)
+        self._first = next(self._items, _END)
+        self._keep = keep
+        self._on_complete = on_complete
+        self._around = []
+        self._finish = []
+
+    def around_reads(self, context_factory):
+        """context_factory() gets entered around every read of the next item"""
+        self._around.append(context_factory)
+
+    def on_finish(self, fn):
+        """fn(error) gets called when the stream ends, error is None if it completed
+        (GeneratorExit if it got closed early, e.g. by a disconnected client)
+        """
+        self._finish.append(fn)
+
+    def __iter__(self):
+        kept = [] if self._on_complete else None
+        error = None
+        try:
+            item, self._first = self._first, _END
+            while item is not _END:
+                if kept is not None:
+                    kept.append(item)
+                    if len(kept) > self._keep:
+                        kept = None
+                yield item
+                with ExitStack() as stack:
+                    for context_factory in self._around:
+                        stack.enter_context(context_factory())
+                    item = next(self._items, _END)
+            if kept is not None:
+                self._on_complete(kept)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            for fn in self._finish:
+                fn(error)
+
+
+def json_chunks(response: dict, chunk_size=CHUNK_SIZE):
+    """Serializes a JSON-RPC response like json.dumps(), in chunks"""
+    result = response["result"]
+    if not isinstance(result, StreamedList):
+        yield json.dumps(response)
+        return
+    buf = ['{"result": [']
+    size = 0
+    separator = ""
+    try:
+        for item in result:
+            s = separator + json.dumps(item)
+            separator = ", "
+            buf.append(s)
+            size += len(s)
+            if size >= chunk_size:
+                yield "".join(buf)
+                buf = []
+                size = 0
+    except Exception as e:
+        logger.error(f"Streaming the response {response['id']} failed: {e}")
+        raise
+    rest = {k: v for k, v in response.items() if k != "result"}
+    buf.append("], " + json.dumps(rest)[1:])
+    yield "".join(buf)
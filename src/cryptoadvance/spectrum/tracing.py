@@ -0,0 +1,280 @@
+"""Lightweight tracing spans, exported as OpenTelemetry (OTLP/JSON) to a file
+
+With TRACING_FILE set, Spectrum records spans for
+- jsonrpc (and JSON-RPC batches)
+- sync_script and the units of work of the writer-thread
+- ElectrumSocket.call
+- database-queries (only within a trace, otherwise the sync would be very noisy)
+
+Spans of one RPC share a trace-id, so a request-waterfall shows where the time goes.
+The current span lives in a ContextVar. Threads don't inherit that, so FlaskThread,
+the BatchExecutor and the WriteQueue carry it over explicitly (tracer.attach()).
+
+Every line of the file is an ExportTraceServiceRequest in the OTLP/JSON encoding,
+which e.g. the otlpjsonfile-receiver of the OpenTelemetry-collector can read.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar("spectrum_span", default=None)
+
+# OTLP span-kinds and status-codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Span:
+    __slots__ = [
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "kind",
+        "start",
+        "end",
+        "attributes",
+        "error",
+    ]
+
+    def __init__(self, name, parent=None, kind=KIND_INTERNAL, attributes=None):
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [
+                {"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()
+            ],
+            "status": {"code": STATUS_OK}
+            if self.error is None
+            else {"code": STATUS_ERROR, "message": self.error},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class FileSpanExporter:
+    """Appends the finished spans in batches to a file, from a thread"""
+
+    def __init__(self, path, interval=1, service_name="spectrum"):
+        self.path = path
+        self.interval = interval
+        self.service_name = service_name
+        self._spans = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="spectrum-tracing", daemon=True
+        )
+        self._thread.start()
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+
+    def flush(self):
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(request) + "\n")
+
+    def shutdown(self):
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Exporting spans failed: {e}")
+
+
+class _NoSpan:
+    """What tracer.span() returns if tracing is disabled"""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _SpanContext:
+    __slots__ = ["tracer", "span", "token", "deferred"]
+
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+        self.deferred = False
+
+    def __enter__(self):
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        if not self.deferred or exc is not None:
+            self.tracer.finish(self.span, exc)
+        return False
+
+    def defer(self):
+        """Leaves tracer.finish() of the span to the caller, e.g. for a response
+        which gets produced after the with-block (a streamed one)
+        """
+        self.deferred = True
+
+
+class _Attached:
+    __slots__ = ["span", "token"]
+
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+        return False
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.exporter = None
+
+    def enable(self, exporter):
+        self.exporter = exporter
+        if not self.enabled:
+            self.enabled = True
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(Engine, "handle_error", _handle_error)
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.remove(Engine, "handle_error", _handle_error)
+        if self.exporter:
+            self.exporter.shutdown()
+            self.exporter = None
+
+    def current(self):
+        """The current span, to be attached in another thread"""
+        return _current.get()
+
+    def attach(self, span):
+        """Makes span (from another thread) the parent of the spans in the with-block"""
+        if span is None:
+            return _NO_SPAN
+        return _Attached(span)
+
+    def span(self, name, kind=KIND_INTERNAL, **attributes):
+        """A child-span of the current span (or a new trace) for the with-block"""
+        if not self.enabled:
+            return _NO_SPAN
+        return _SpanContext(self, Span(name, _current.get(), kind, attributes))
+
+    def finish(self, span: Span, error=None):
+        span.end = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        if self.exporter:
+            self.exporter.export(span)
+
+
+tracer = Tracer()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current.get()
+    if parent is not None:
+        conn.info["tracing_span"] = Span(
+            "db.query",
+            parent,
+            KIND_CLIENT,
+            {"db.statement": statement[:200], "db.system": conn.dialect.name},
+        )
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = conn.info.pop("tracing_span", None)
+    if span is not None:
+        tracer.finish(span)
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    span = connection.info.pop("tracing_span", None) if connection else None
+    if span is not None:
+        tracer.finish(span, exception_context.original_exception)
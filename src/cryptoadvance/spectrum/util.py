@@ -8,6 +8,8 @@ from decimal import Decimal
 from embit import hashes
 from flask import current_app as app
 
+from .tracing import tracer
+
 logger = logging.getLogger(__name__)
 
 
@@ -61,6 +63,8 @@ class FlaskThread(Thread):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.daemon = True
+        # the thread's spans belong to the trace of its creator
+        self.parent_span = tracer.current()
         try:
             self.app = app._get_current_object()
             self.flask_mode = True
@@ -69,13 +73,14 @@ class FlaskThread(Thread):
                 self.flask_mode = False
 
     def run(self):
-        if self.flask_mode:
-            with self.app.app_context():
-                logger.debug(f"starting new FlaskThread: {self._target.__name__}")
+        with tracer.attach(self.parent_span):
+            if self.flask_mode:
+                with self.app.app_context():
+                    logger.debug(f"starting new FlaskThread: {self._target.__name__}")
+                    super().run()
+            else:
+                logger.debug(f"starting new Thread: {self._target.__name__}")
                 super().run()
-        else:
-            logger.debug(f"starting new Thread: {self._target.__name__}")
-            super().run()
 
 
 # inspired by Jimmy:
@@ -0,0 +1,78 @@
+"""Derives utxos and balances of a script locally
+
+The Electrum history of a scripthash contains every transaction which either funds
+or spends that script. As all of those transactions are cached locally anyway, the
+unspent outputs and the balance can be calculated by walking the outputs and the
+spends instead of asking the Electrum server via blockchain.scripthash.listunspent
+and blockchain.scripthash.get_balance.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def derive_script_state(script_pubkey, history, txs):
+    """Calculates the utxos and the balance of script_pubkey
+
+    Args:
+    - script_pubkey (embit Script): the script we're interested in
+    - history (list): the result of blockchain.scripthash.get_history, like
+        [{"tx_hash": "...", "height": 123}, ...] where a height <= 0 means mempool
+    - txs (dict): txid -> embit Transaction, needs to contain all txs of the history
+
+    Returns:
+    a tuple (utxos, balance) in the same format as the Electrum server would return them:
+    - utxos: [{"tx_hash": "...", "tx_pos": 0, "height": 123, "value": 1000}, ...]
+    - balance: {"confirmed": 1000, "unconfirmed": -500}
+    """
+    heights = {tx["tx_hash"]: tx.get("height") or 0 for tx in history}
+    outputs = {}  # (txid, vout) -> value
+    spent = set()  # all outpoints spent by any tx of the history
+    spent_confirmed = set()  # outpoints spent by confirmed txs
+    for txid, height in heights.items():
+        tx = txs[txid]
+        for vout, out in enumerate(tx.vout):
+            if out.script_pubkey == script_pubkey:
+                outputs[(txid, vout)] = out.value
+        for inp in tx.vin:
+            outpoint = (inp.txid.hex(), inp.vout)
+            spent.add(outpoint)
+            if height > 0:
+                spent_confirmed.add(outpoint)
+
+    utxos = [
+        {
+            "tx_hash": txid,
+            "tx_pos": vout,
+            # Electrum's listunspent reports 0 for all mempool outputs
+            "height": max(heights[txid], 0),
+            "value": value,
+        }
+        for (txid, vout), value in outputs.items()
+        if (txid, vout) not in spent
+    ]
+    # confirmed is the balance of the chain-state, unconfirmed is the mempool's delta
+    confirmed = sum(
+        value
+        for (txid, vout), value in outputs.items()
+        if heights[txid] > 0 and (txid, vout) not in spent_confirmed
+    )
+    total = sum(utxo["value"] for utxo in utxos)
+    balance = {"confirmed": confirmed, "unconfirmed": total - confirmed}
+    return utxos, balance
+
+
+def state_matches(local_utxos, local_balance, server_utxos, server_balance) -> bool:
+    """Compares a locally derived state with the one reported by the Electrum server"""
+
+    def normalize(utxos):
+        return sorted(
+            (u["tx_hash"], u["tx_pos"], max(u.get("height") or 0, 0), u["value"])
+            for u in utxos
+        )
+
+    return normalize(local_utxos) == normalize(server_utxos) and (
+        local_balance["confirmed"],
+        local_balance["unconfirmed"],
+    ) == (server_balance["confirmed"], server_balance["unconfirmed"])
@@ -0,0 +1,187 @@
+"""A single thread which applies all mutations of the database
+
+The sync-threads, the notification-thread and RPC-calls like setlabel or lockunspent
+used to write concurrently which, on SQLite, means lock-contention and "database is
+locked" retries. Instead, they submit units of work (functions which mutate
+db.session) to the WriteQueue. Its thread applies them in order and commits them in
+batches via the CommitBatcher, at the latest when the queue runs empty.
+
+submit() returns a Future which resolves once the unit is committed. If a unit
+raises, the batch gets rolled back and the other units of it are applied again one by
+one, so a failing unit doesn't take the others down.
+"""
+
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from .batching import CommitBatcher
+from .db import db
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _Unit:
+    __slots__ = ["fn", "args", "kwargs", "future", "result", "parent_span"]
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.result = None
+        # the span of the submitter, see tracing.py
+        self.parent_span = tracer.current()
+
+    def run(self):
+        if self.parent_span is None:
+            self.result = self.fn(*self.args, **self.kwargs)
+            return
+        with tracer.attach(self.parent_span), tracer.span(f"write {self}"):
+            self.result = self.fn(*self.args, **self.kwargs)
+
+    def __repr__(self):
+        return getattr(self.fn, "__name__", repr(self.fn))
+
+
+class WriteQueue:
+    def __init__(self, app=None, commits: CommitBatcher = None, maxsize=1000):
+        """
+        - app: the writer-thread runs in its app_context. Without an app, units are
+          applied right away in the calling thread.
+        - commits: decides when to commit and with which durability
+        - maxsize: submit() blocks if that many units are waiting
+        """
+        self.app = app
+        self.commits = commits or CommitBatcher(every=1, interval_ms=0)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._batch = []  # applied but not yet committed
+        self._thread = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def in_writer(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def start(self):
+        if self.app is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="spectrum-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None) -> bool:
+        """Applies what's in the queue and stops the thread.
+        Returns False if that took longer than timeout.
+        """
+        if self._thread is None:
+            return True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        self._thread = None
+        return True
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queues fn(*args, **kwargs) which can mutate db.session but must not commit"""
+        unit = _Unit(fn, args, kwargs)
+        if self.in_writer:
+            # submitted by another unit: part of the current batch
+            unit.run()
+            unit.future.set_result(unit.result)
+        elif self._thread is None:
+            self._apply_inline(unit)
+        else:
+            self._queue.put(unit)
+        return unit.future
+
+    def call(self, fn, *args, **kwargs):
+        """Submits fn and waits until it's committed. Returns what fn returned and
+        expires the session of the caller so it sees the changes.
+        """
+        result = self.submit(fn, *args, **kwargs).result()
+        if not self.in_writer:
+            db.session.expire_all()
+        return result
+
+    def _apply_inline(self, unit: _Unit):
+        try:
+            unit.run()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            unit.future.set_exception(e)
+        else:
+            unit.future.set_result(unit.result)
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                unit = self._queue.get()
+                if unit is _STOP:
+                    break
+                self._apply(unit)
+            self._commit()
+
+    def _apply(self, unit: _Unit):
+        self.commits.begin()
+        try:
+            unit.run()
+        except Exception as e:
+            logger.warning(f"Write {unit} failed: {e}")
+            unit.future.set_exception(e)
+            # the failed unit might have left changes in the session
+            self.commits.rollback()
+            self._replay()
+            return
+        self._batch.append(unit)
+        try:
+            self.commits.done()
+            if self.commits.pending and self._queue.empty():
+                self.commits.flush()
+        except Exception as e:
+            logger.error(f"Commit of {len(self._batch)} writes failed: {e}")
+            self.commits.rollback()
+            self._replay()
+            return
+        if not self.commits.pending:
+            self._resolve()
+
+    def _commit(self):
+        try:
+            self.commits.flush()
+        except Exception as e:
+            logger.error(f"Commit of {len(self._batch)} writes failed: {e}")
+            self.commits.rollback()
+            self._replay()
+            return
+        self._resolve()
+
+    def _resolve(self):
+        batch, self._batch = self._batch, []
+        for unit in batch:
+            unit.future.set_result(unit.result)
+
+    def _replay(self):
+        """Applies and commits the units of a rolled back batch one by one"""
+        batch, self._batch = self._batch, []
+        for unit in batch:
+            self.commits.begin()
+            try:
+                unit.run()
+                db.session.commit()
+            except Exception as e:
+                logger.warning(f"Write {unit} failed: {e}")
+                db.session.rollback()
+                unit.future.set_exception(e)
+            else:
+                unit.future.set_result(unit.result)
@@ -0,0 +1,59 @@
+from flask import Flask
+
+from cryptoadvance.spectrum.aggregates import (
+    add_to_aggregate,
+    check_aggregates,
+    existing_txids,
+    get_aggregate,
+)
+from cryptoadvance.spectrum.db import Script, Tx, Wallet, WalletAggregate, db
+
+
+def test_aggregates(app: Flask):
+    with app.app_context():
+        wallet = Wallet(name="aggregated_wallet")
+        db.session.add(wallet)
+        db.session.commit()
+        # computed on access, but only the writer stores it
+        aggregate = get_aggregate(wallet.id)
+        assert (aggregate.confirmed, aggregate.unconfirmed, aggregate.txcount) == (
+            0,
+            0,
+            0,
+        )
+        assert WalletAggregate.query.get(wallet.id) is None
+
+        scripts = [
+            Script(script=f"0014{i:040x}", wallet=wallet, confirmed=1000, unconfirmed=5)
+            for i in range(2)
+        ]
+        db.session.add_all(scripts)
+        db.session.flush()
+        # the same tx on both scripts counts once
+        for s in scripts:
+            db.session.add(Tx(txid="aa" * 32, wallet_id=wallet.id, script_id=s.id))
+        assert existing_txids(wallet.id, {"aa" * 32, "bb" * 32}) == {"aa" * 32}
+        add_to_aggregate(wallet.id, confirmed=2000, unconfirmed=10, txcount=1)
+        db.session.commit()
+        assert check_aggregates() == []
+
+        # drifted
+        add_to_aggregate(wallet.id, confirmed=-1)
+        db.session.commit()
+        mismatches = check_aggregates()
+        assert mismatches == [
+            {
+                "wallet": "aggregated_wallet",
+                "actual": {"confirmed": 1999, "unconfirmed": 10, "txcount": 1},
+                "expected": {"confirmed": 2000, "unconfirmed": 10, "txcount": 1},
+            }
+        ]
+        assert check_aggregates() == []
+        assert WalletAggregate.query.get(wallet.id).confirmed == 2000
+
+
+def test_new_wallet_has_aggregate(app: Flask):
+    with app.app_context():
+        app.spectrum.createwallet("fresh_wallet", disable_private_keys=True)
+        wallet = Wallet.query.filter_by(name="fresh_wallet").one()
+        assert WalletAggregate.query.get(wallet.id).version == 0
@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, current_app
+
+from cryptoadvance.spectrum.batch import BatchExecutor
+
+
+def test_map_keeps_order_and_runs_concurrently():
+    executor = BatchExecutor(workers=8, concurrency=4)
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def slow(i):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return i * 2
+
+    t0 = time.time()
+    assert executor.map(slow, list(range(8))) == [i * 2 for i in range(8)]
+    # 8 items, 4 at a time
+    assert time.time() - t0 < 0.3
+    assert max_running == 4
+    max_running = 0
+    assert executor.map(slow, [1, 2, 3], concurrency=2) == [2, 4, 6]
+    assert max_running == 2
+    assert executor.map(slow, []) == []
+    executor.shutdown()
+
+
+def test_map_barrier():
+    executor = BatchExecutor(workers=4, concurrency=4)
+    calls = []
+
+    def record(item):
+        calls.append(item)
+        time.sleep(0.01 if item != "write" else 0)
+        return item
+
+    items = ["a", "b", "write", "c", "d"]
+    assert executor.map(record, items, barrier=lambda i: i == "write") == items
+    # everything before the barrier ran before it, everything after it after it
+    assert set(calls[:2]) == {"a", "b"}
+    assert calls[2] == "write"
+    assert set(calls[3:]) == {"c", "d"}
+    executor.shutdown()
+
+
+def test_map_errors_and_app_context():
+    executor = BatchExecutor(workers=4, concurrency=4)
+
+    def fail(i):
+        if i == 2:
+            raise ValueError(i)
+        return i
+
+    with pytest.raises(ValueError):
+        executor.map(fail, [1, 2, 3])
+    app = Flask("batch_test")
+    with app.app_context():
+        assert executor.map(lambda i: current_app.name, [1, 2, 3]) == ["batch_test"] * 3
+    # without a pool, items run sequentially in the calling thread
+    sequential = BatchExecutor(workers=1)
+    assert (
+        sequential.map(lambda i: threading.current_thread(), [1, 2])
+        == [threading.current_thread()] * 2
+    )
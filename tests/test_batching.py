@@ -0,0 +1,70 @@
+import threading
+import time
+
+from flask import Flask
+
+from cryptoadvance.spectrum.batching import CommitBatcher
+from cryptoadvance.spectrum.db import Wallet, db
+
+
+def _committed_wallets(app):
+    """counts the wallets as seen from another session"""
+    result = []
+
+    def count():
+        with app.app_context():
+            result.append(Wallet.query.filter(Wallet.name.like("batch_%")).count())
+
+    t = threading.Thread(target=count)
+    t.start()
+    t.join()
+    return result[0]
+
+
+def test_commit_every(app: Flask):
+    batcher = CommitBatcher(every=3, interval_ms=100000)
+    with app.app_context():
+        for i in range(2):
+            batcher.begin()
+            db.session.add(Wallet(name=f"batch_{i}"))
+            batcher.done()
+        assert batcher.pending == 2
+        assert _committed_wallets(app) == 0
+        batcher.begin()
+        db.session.add(Wallet(name="batch_2"))
+        batcher.done()
+        assert batcher.pending == 0
+        assert _committed_wallets(app) == 3
+        # a rollback throws away the batch
+        db.session.add(Wallet(name="batch_3"))
+        batcher.done()
+        batcher.rollback()
+        assert batcher.pending == 0
+        assert _committed_wallets(app) == 3
+
+
+def test_wait_for_flush(app: Flask):
+    batcher = CommitBatcher(every=1000, interval_ms=100000)
+    assert batcher.wait_for_flush()  # nothing pending
+    stop = threading.Event()
+
+    def sync():
+        with app.app_context():
+            i = 0
+            while not stop.is_set():
+                db.session.add(Wallet(name=f"batch_sync_{i}"))
+                batcher.done()
+                i += 1
+                time.sleep(0.01)
+            batcher.flush()
+
+    t = threading.Thread(target=sync)
+    t.start()
+    try:
+        while batcher._dirty_threads == 0:
+            time.sleep(0.01)
+        assert batcher.wait_for_flush(timeout=5)
+        assert _committed_wallets(app) > 0
+    finally:
+        stop.set()
+        t.join()
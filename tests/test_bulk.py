@@ -0,0 +1,35 @@
+from flask import Flask
+
+from cryptoadvance.spectrum.bulk import _bytea, _csv_value, bulk_insert
+from cryptoadvance.spectrum.db import Tx, TxCategory, Wallet, db
+
+
+def _columns(tx):
+    return {c.name: getattr(tx, c.name) for c in Tx.__table__.columns if c.name != "id"}
+
+
+def test_bulk_insert_same_as_orm(app: Flask):
+    with app.app_context():
+        wallet = Wallet(name="bulky_wallet")
+        db.session.add(wallet)
+        db.session.commit()
+        db.session.add(Tx(txid="aa" * 32, amount=5, wallet_id=wallet.id))
+        bulk_insert(Tx, [{"txid": "bb" * 32, "amount": 5, "wallet_id": wallet.id}])
+        db.session.commit()
+        orm_tx, bulk_tx = Tx.query.filter_by(wallet_id=wallet.id).order_by(Tx.id)
+        assert bulk_tx.category == TxCategory.UNKNOWN
+        bulk_columns = _columns(bulk_tx)
+        bulk_columns["txid"] = "aa" * 32
+        assert bulk_columns == _columns(orm_tx)
+        bulk_insert(Tx, [])  # nothing happens
+
+
+def test_csv_value():
+    assert _csv_value(None) == ""
+    assert _csv_value("") == '""'
+    assert _csv_value('a "label", with\nnewline') == '"a ""label"", with\nnewline"'
+    assert _csv_value(True) == "t"
+    assert _csv_value(12) == "12"
+    assert _csv_value(TxCategory.SEND) == '"SEND"'
+    assert _csv_value(_bytea("abcd")) == '"\\xabcd"'
+    assert _bytea(bytes.fromhex("abcd")) == "\\xabcd"
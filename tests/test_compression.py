@@ -0,0 +1,47 @@
+import gzip
+import json
+
+from conftest import spectrum_app_with_config
+
+from cryptoadvance.spectrum.compression import compress_chunks
+
+
+def test_compress_chunks():
+    chunks = [b"a" * 1000, b"", b"b" * 10]
+    assert gzip.decompress(b"".join(compress_chunks(chunks, "gzip"))) == b"".join(
+        chunks
+    )
+
+
+def test_compressed_responses():
+    app = spectrum_app_with_config(config={"COMPRESSION_MIN_SIZE": 200})
+    client = app.test_client()
+    with app.app_context():
+        app.spectrum.createwallet("compressed_wallet", disable_private_keys=True)
+
+    def call(method, url="/", encoding="gzip"):
+        headers = {"Accept-Encoding": encoding} if encoding else {}
+        return client.post(url, json={"method": method, "id": 1}, headers=headers)
+
+    res = call("getblockchaininfo")
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in res.headers["Vary"]
+    assert json.loads(gzip.decompress(res.data))["result"]["chain"]
+    # not accepted by the client
+    for encoding in [None, "gzip;q=0", "br"]:
+        res = call("getblockchaininfo", encoding=encoding)
+        assert "Content-Encoding" not in res.headers
+        assert json.loads(res.data)["result"]["chain"]
+    # too small
+    res = call("listwallets")
+    assert "Content-Encoding" not in res.headers
+    # streamed responses get compressed chunk-wise
+    res = call("listunspent", url="/wallet/compressed_wallet")
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in res.headers
+    assert json.loads(gzip.decompress(res.data)) == {
+        "result": [],
+        "error": None,
+        "id": 1,
+    }
+    app.spectrum.stop()
@@ -0,0 +1,20 @@
+from embit.networks import NETWORKS
+from embit.script import Script as EmbitScript
+
+from cryptoadvance.spectrum.db import _script_address, script_address
+
+
+def test_script_address():
+    scripts = [
+        "0014" + "11" * 20,  # p2wpkh
+        "a914" + "22" * 20 + "87",  # p2sh
+        "76a914" + "33" * 20 + "88ac",  # p2pkh
+        "5120" + "44" * 32,  # p2tr
+    ]
+    for script_hex in scripts:
+        for network in [NETWORKS["main"], NETWORKS["test"], NETWORKS["regtest"]]:
+            expected = EmbitScript(bytes.fromhex(script_hex)).address(network)
+            assert script_address(script_hex, network) == expected
+    hits = _script_address.cache_info().hits
+    assert script_address(scripts[0], NETWORKS["main"]).startswith("bc1")
+    assert _script_address.cache_info().hits == hits + 1
@@ -0,0 +1,78 @@
+from embit import bip32
+from embit.descriptor import Descriptor as EmbitDescriptor
+from embit.descriptor.checksum import add_checksum
+
+from cryptoadvance.spectrum.derivation import (
+    DerivationService,
+    derive_scripts,
+    derived_descriptor,
+    get_cached_descriptor,
+)
+from cryptoadvance.spectrum.util import scripthash
+
+
+def _descriptors():
+    root = bip32.HDKey.from_seed(bytes(32))
+    fgp = root.my_fingerprint.hex()
+    cosigners = []
+    for i in range(3):
+        cosigner = bip32.HDKey.from_seed(bytes([i + 1]) * 32)
+        xpub = cosigner.derive("m/48h/1h/0h/2h").to_public()
+        cosigners.append(
+            f"[{cosigner.my_fingerprint.hex()}/48h/1h/0h/2h]{xpub}/<0;1>/*"
+        )
+    return [
+        f"wpkh([{fgp}]{root}/84h/1h/0h/0/*)",  # private with hardened steps
+        f"sh(wpkh({root.to_public()}/0/*))",  # no origin
+        f"wsh(sortedmulti(2,{','.join(cosigners)}))",
+        f"wsh(multi(1,{root.to_public()}/0/5,{root.to_public()}/1/*))",  # fixed path
+        f"tr({root.to_public()}/1/*)",
+    ]
+
+
+def test_derived_descriptor():
+    for desc in _descriptors():
+        d = EmbitDescriptor.from_string(desc).derive(7)
+        for k in d.keys:
+            k.key = k.get_public_key()
+        assert derived_descriptor(desc, 7) == add_checksum(str(d))
+        assert "xpub" not in derived_descriptor(desc, 7)
+
+
+def test_cached_descriptor_derive():
+    for desc in _descriptors():
+        parsed = EmbitDescriptor.from_string(desc)
+        cached = get_cached_descriptor(desc)
+        assert get_cached_descriptor(desc) is cached
+        for index in [0, 1, 42]:
+            expected = parsed.derive(index).to_public()
+            derived = cached.derive(index)
+            assert derived.script_pubkey() == expected.script_pubkey()
+            assert cached.script_pubkey(index) == expected.script_pubkey()
+            # same keys with the same origins
+            assert [str(k.origin) for k in derived.keys] == [
+                str(k.origin) for k in expected.keys
+            ]
+            assert [k.get_public_key().sec() for k in derived.keys] == [
+                k.get_public_key().sec() for k in expected.keys
+            ]
+            assert not any(k.is_private for k in derived.keys)
+        # the parsed descriptor is untouched
+        assert str(cached.parsed) == str(parsed)
+
+
+def test_derivation_service():
+    desc = _descriptors()[2]
+    inline = derive_scripts(desc, 0, 30)
+    assert [i for i, _, _ in inline] == list(range(30))
+    index, script_hex, sh = inline[7]
+    assert script_hex == get_cached_descriptor(desc).script_pubkey(7).data.hex()
+    assert sh == scripthash(get_cached_descriptor(desc).script_pubkey(7))
+
+    service = DerivationService(workers=2, chunk_size=7, min_pool_range=10)
+    try:
+        assert service.derive(desc, 0, 30) == inline
+        assert service.derive(desc, 5, 8) == inline[5:8]  # too small for the pool
+    finally:
+        service.shutdown()
+    assert DerivationService(workers=1).derive(desc, 0, 30) == inline
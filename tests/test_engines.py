@@ -0,0 +1,30 @@
+import pytest
+from flask import Flask
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+
+from cryptoadvance.spectrum.db import Wallet, db
+
+
+def test_sqlite_profile(app: Flask):
+    with app.app_context():
+        writer = db.engine
+        reader = db.get_read_engine(app)
+        assert reader is not None and reader is not writer
+        with writer.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        with reader.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text("DELETE FROM spectrum_wallet"))
+
+        query = select(Wallet)
+        assert db.session.get_bind(Wallet.__mapper__, query) is reader
+        db.session.add(Wallet(name="routed_wallet"))
+        db.session.flush()
+        # the rest of the transaction needs to see its own writes
+        assert db.session.get_bind(Wallet.__mapper__, query) is writer
+        assert Wallet.query.filter_by(name="routed_wallet").count() == 1
+        db.session.commit()
+        assert db.session.get_bind(Wallet.__mapper__, query) is reader
+        assert Wallet.query.filter_by(name="routed_wallet").count() == 1
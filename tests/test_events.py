@@ -0,0 +1,86 @@
+import threading
+import time
+
+from conftest import spectrum_app_with_config
+from flask import Flask
+
+from cryptoadvance.spectrum.events import EventFeed
+from cryptoadvance.spectrum.server_endpoints.wallet_events import max_waiting
+
+
+def test_event_feed():
+    feed = EventFeed(maxsize=3)
+    assert feed.wait(1) == {"cursor": 0, "reset": False, "events": []}
+    t0 = time.time()
+    assert feed.wait(1, 0, timeout=0.1)["events"] == []
+    assert time.time() - t0 >= 0.1
+    # waiting returns as soon as something gets published
+    threading.Timer(0.1, feed.publish, [1, [{"type": "tx", "txid": "aa"}]]).start()
+    res = feed.wait(1, 0, timeout=10)
+    assert res == {
+        "cursor": 1,
+        "reset": False,
+        "events": [{"id": 1, "type": "tx", "txid": "aa"}],
+    }
+    # other wallets don't see it, blocks go to everybody
+    feed.publish(None, [{"type": "block", "height": 2}])
+    assert feed.wait(2, 0, timeout=0)["events"] == [
+        {"id": 2, "type": "block", "height": 2}
+    ]
+    assert [e["id"] for e in feed.wait(1, 0, timeout=0)["events"]] == [1, 2]
+    assert [e["id"] for e in feed.wait(1, 1, timeout=0)["events"]] == [2]
+    # events after the cursor dropped out / a cursor from before a restart
+    feed.publish(1, [{"type": "balance"}] * 3)
+    assert feed.wait(1, 1, timeout=0) == {"cursor": 5, "reset": True, "events": []}
+    assert len(feed.wait(1, 2, timeout=0)["events"]) == 3
+    assert feed.wait(1, 100, timeout=0)["reset"]
+
+
+def test_events_endpoint(app: Flask):
+    client = app.test_client()
+    with app.app_context():
+        app.spectrum.createwallet("evented_wallet", disable_private_keys=True)
+        wallet_id = app.spectrum.get_wallet("evented_wallet").id
+    assert client.get("/wallet/unknown_wallet/events").status_code == 404
+    cursor = client.get("/wallet/evented_wallet/events").json["cursor"]
+    app.spectrum.events.publish(wallet_id, [{"type": "tx", "txid": "bb"}])
+    res = client.get(f"/wallet/evented_wallet/events?cursor={cursor}&timeout=1").json
+    assert res["events"] == [{"id": cursor + 1, "type": "tx", "txid": "bb"}]
+
+
+def test_events_waiting_limit():
+    app = spectrum_app_with_config(
+        config={"HTTP_SERVER": "waitress", "EVENTS_MAX_WAITING": 1}
+    )
+    client = app.test_client()
+    with app.app_context():
+        app.spectrum.createwallet("waited_wallet", disable_private_keys=True)
+        wallet_id = app.spectrum.get_wallet("waited_wallet").id
+    cursor = client.get("/wallet/waited_wallet/events").json["cursor"]
+    results = []
+    waiter = threading.Thread(
+        target=lambda: results.append(
+            client.get(f"/wallet/waited_wallet/events?cursor={cursor}&timeout=10").json
+        )
+    )
+    waiter.start()
+    time.sleep(0.2)
+    # the only slot is taken
+    res = client.get(f"/wallet/waited_wallet/events?cursor={cursor}&timeout=10")
+    assert res.status_code == 503
+    assert res.headers["Retry-After"]
+    # requests which don't wait don't need a slot
+    assert client.get("/wallet/waited_wallet/events").status_code == 200
+    res = client.get(f"/wallet/waited_wallet/events?cursor={cursor}&timeout=0")
+    assert res.status_code == 200
+    app.spectrum.events.publish(wallet_id, [{"type": "tx", "txid": "cc"}])
+    waiter.join()
+    assert results[0]["events"][0]["txid"] == "cc"
+    # the default leaves half of the HTTP_THREADS for the RPCs
+    assert max_waiting({"HTTP_SERVER": "waitress", "HTTP_THREADS": 16}) == 8
+    # werkzeug starts a thread per request
+    assert max_waiting({"HTTP_SERVER": "werkzeug", "EVENTS_MAX_WAITING": 1}) is None
+    # and it's free again
+    res = client.get(f"/wallet/waited_wallet/events?cursor={cursor}&timeout=0.1")
+    assert res.status_code == 200
+    app.spectrum.stop()
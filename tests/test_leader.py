@@ -0,0 +1,141 @@
+import itertools
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from flask import Flask
+
+from cryptoadvance.spectrum.aggregates import add_to_aggregate
+from cryptoadvance.spectrum.db import Script, Wallet, db
+from cryptoadvance.spectrum.leader import (
+    ElectrumProxy,
+    FileLock,
+    LeaderElection,
+    LeaderServer,
+)
+from cryptoadvance.spectrum.spectrum_error import RPCError
+from conftest import spectrum_app_with_config
+
+
+def test_file_lock(tmp_path):
+    path = str(tmp_path / "sync-leader.lock")
+    leader, follower = FileLock(path), FileLock(path)
+    assert leader.acquire()
+    assert leader.acquire()  # reentrant
+    assert not follower.acquire()
+    assert leader.held()
+    leader.release()
+    assert not leader.held()
+    assert follower.acquire()
+    follower.release()
+
+
+def test_proxy_forwards_to_leader():
+    def call(method, params):
+        if method == "blockchain.transaction.broadcast":
+            raise RPCError("bad-txns", -26)
+        return {"method": method, "params": params}
+
+    spectrum = SimpleNamespace(
+        sock=MagicMock(call=MagicMock(side_effect=call)),
+        is_connected=lambda: True,
+        blocks=123,
+        bestblockhash="00" * 32,
+        roothash="11" * 32,
+        chain="regtest",
+        progress_percent=100,
+    )
+    server = LeaderServer(spectrum, port=0)
+    server.start()
+    try:
+        proxy = ElectrumProxy(f"http://127.0.0.1:{server.port}")
+        assert proxy.call("blockchain.estimatefee", [2]) == {
+            "method": "blockchain.estimatefee",
+            "params": [2],
+        }
+        with pytest.raises(RPCError) as e:
+            proxy.call("blockchain.transaction.broadcast", ["00"])
+        assert e.value.code == -26
+        assert proxy.leader_status()["blocks"] == 123
+        assert proxy.status == "ok"
+    finally:
+        server.stop()
+    assert proxy.leader_status() is None
+    assert proxy.status != "ok"
+
+
+def test_follow_versions(app: Flask):
+    spectrum = app.spectrum
+    with app.app_context():
+        wallet = Wallet(name="followed_wallet")
+        db.session.add(wallet)
+        db.session.commit()
+        add_to_aggregate(wallet.id)
+        db.session.commit()
+        spectrum.follow_versions()
+        version = spectrum.responses.version(wallet.id)
+        # e.g. a label set by another process
+        add_to_aggregate(wallet.id)
+        db.session.commit()
+        spectrum.follow_versions()
+        assert spectrum.responses.version(wallet.id) == version + 1
+        spectrum.follow_versions()
+        assert spectrum.responses.version(wallet.id) == version + 1
+
+
+def test_cached_responses_follow_versions(app: Flask):
+    """With several processes, a change by another one is seen right away"""
+    spectrum = app.spectrum
+    spectrum.shared_db = True
+    with app.app_context():
+        spectrum.createwallet("shared_wallet", disable_private_keys=True)
+        wallet = spectrum.get_wallet("shared_wallet")
+        call = {"method": "listlabels", "id": 1}
+        assert spectrum.jsonrpc(call, wallet_name="shared_wallet")["result"] == []
+        # another process labels a script, without bumping our cache
+        db.session.add(Script(script="0014" + "44" * 20, wallet=wallet, label="new"))
+        add_to_aggregate(wallet.id)
+        db.session.commit()
+        res = spectrum.jsonrpc(call, wallet_name="shared_wallet")
+        assert res["result"] == ["new"]
+
+
+def test_sync_process_follower():
+    app = spectrum_app_with_config(config={"SYNC_PROCESS": True})
+    try:
+        assert not app.election.candidate
+        assert not app.election.is_leader
+        assert not app.spectrum.is_leader
+        assert isinstance(app.spectrum.sock, ElectrumProxy)
+        # no sync-process running
+        assert not app.spectrum.is_connected()
+    finally:
+        app.election.stop()
+        app.spectrum.stop()
+
+
+def test_leader_demoted_when_lock_lost(app: Flask):
+    """e.g. the connection holding the advisory lock got killed"""
+    lock = MagicMock()
+    lock.acquire.side_effect = itertools.chain([True], itertools.repeat(False))
+    lock.held.return_value = False
+    election = LeaderElection(app, lock=lock)
+    election.interval = 0.01
+    assert election.try_acquire()
+    election.spectrum = MagicMock()
+    server = election._server = MagicMock()
+    threading.Thread(target=election._run, daemon=True).start()
+    try:
+        # once demoted, it follows (and is a candidate again)
+        for _ in range(100):
+            if election.spectrum.refresh_from_leader.called:
+                break
+            time.sleep(0.05)
+        election.spectrum.demote.assert_called_once_with(election.url)
+        assert not election.is_leader
+        server.stop.assert_called_once()
+        lock.release.assert_called()
+    finally:
+        election.stop()
@@ -0,0 +1,61 @@
+from conftest import spectrum_app_with_config
+
+from cryptoadvance.spectrum.metrics import (
+    DB_QUERY_LATENCY,
+    RPC_CALLS,
+    RPC_ERRORS,
+    MetricsRegistry,
+    metrics,
+)
+
+
+def test_render():
+    registry = MetricsRegistry()
+    calls = registry.counter("calls_total", "Calls", ("method",))
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    registry.gauge("depth", "Depth", lambda: 7)
+    calls.inc("a")
+    calls.inc("a", amount=2)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+    assert registry.render().splitlines() == [
+        "# HELP calls_total Calls",
+        "# TYPE calls_total counter",
+        'calls_total{method="a"} 3',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+        "# HELP depth Depth",
+        "# TYPE depth gauge",
+        "depth 7",
+    ]
+
+
+def test_metrics_endpoint():
+    app = spectrum_app_with_config(config={"METRICS_ENABLED": True})
+    try:
+        assert metrics.enabled
+        calls = RPC_CALLS.value("getblockcount")
+        errors = RPC_ERRORS.value("unknown")
+        queries = DB_QUERY_LATENCY.count("SELECT")
+        with app.app_context():
+            app.spectrum.jsonrpc({"method": "getblockcount"})
+            app.spectrum.jsonrpc({"method": "nonexisting"})
+            app.spectrum.jsonrpc({"method": "listwallets"})
+        assert RPC_CALLS.value("getblockcount") == calls + 1
+        assert RPC_ERRORS.value("unknown") == errors + 1
+        assert DB_QUERY_LATENCY.count("SELECT") > queries
+        response = app.test_client().get("/metrics")
+        assert response.status_code == 200
+        text = response.get_data(as_text=True)
+        assert 'spectrum_rpc_seconds_count{method="getblockcount"}' in text
+        assert "spectrum_write_queue_depth 0" in text
+    finally:
+        metrics.disable()
+        app.spectrum.stop()
+    assert app.test_client().get("/metrics").status_code == 404
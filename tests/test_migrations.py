@@ -0,0 +1,136 @@
+import multiprocessing
+
+from flask import Flask
+from sqlalchemy import inspect, text
+
+from cryptoadvance.spectrum.db import (
+    UTXO,
+    SchemaVersion,
+    Script,
+    Tx,
+    Wallet,
+    WalletAggregate,
+    db,
+)
+from cryptoadvance.spectrum.migrations import MIGRATIONS, migrate
+from cryptoadvance.spectrum.server import init_db
+
+
+def test_fresh_database_is_stamped(app: Flask):
+    with app.app_context():
+        versions = [
+            v.version for v in SchemaVersion.query.order_by(SchemaVersion.version)
+        ]
+        assert versions == sorted(MIGRATIONS)
+        indexes = {
+            ix["name"] for ix in inspect(db.engine).get_indexes(Script.__tablename__)
+        }
+        assert "ix_spectrum_script_scripthash" in indexes
+
+
+def test_migrate_existing_database(app: Flask):
+    with app.app_context():
+        # simulate a database from before the migrations
+        for table in [Script.__table__, Tx.__table__]:
+            for index in table.indexes:
+                index.drop(bind=db.engine)
+        SchemaVersion.__table__.drop(bind=db.engine)
+        assert not inspect(db.engine).get_indexes(Script.__tablename__)
+
+        migrate()
+        indexes = {
+            ix["name"] for ix in inspect(db.engine).get_indexes(Script.__tablename__)
+        }
+        assert indexes == {ix.name for ix in Script.__table__.indexes}
+        indexes = {
+            ix["name"] for ix in inspect(db.engine).get_indexes(Tx.__tablename__)
+        }
+        assert "ix_spectrum_tx_wallet_txid" in indexes
+        assert SchemaVersion.query.count() == len(MIGRATIONS)
+        # and nothing happens the second time
+        migrate()
+        assert SchemaVersion.query.count() == len(MIGRATIONS)
+
+
+def test_migrate_hex_to_binary(app: Flask):
+    with app.app_context():
+        # the utxo-table as it was before the binary columns
+        UTXO.__table__.drop(bind=db.engine)
+        with db.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "CREATE TABLE spectrum_utxo (id INTEGER PRIMARY KEY, txid VARCHAR(64), "
+                    "vout INTEGER, height INTEGER, amount BIGINT, locked BOOLEAN, "
+                    "script_id INTEGER, wallet_id INTEGER NOT NULL)"
+                )
+            )
+            conn.execute(
+                text(
+                    "INSERT INTO spectrum_utxo (txid, vout, amount, locked, wallet_id) "
+                    "VALUES (:txid, 1, 1000, 0, 1)"
+                ),
+                {"txid": "ab" * 32},
+            )
+        SchemaVersion.query.filter_by(version=3).delete()
+        db.session.commit()
+
+        migrate()
+        with db.engine.connect() as conn:
+            assert (
+                conn.execute(text("SELECT typeof(txid) FROM spectrum_utxo")).scalar()
+                == "blob"
+            )
+        assert UTXO.query.filter_by(txid="ab" * 32).one().vout == 1
+
+
+def test_migrate_wallet_aggregates(app: Flask):
+    with app.app_context():
+        wallet = Wallet(name="unaggregated_wallet")
+        empty_wallet = Wallet(name="empty_wallet")
+        db.session.add_all([wallet, empty_wallet])
+        db.session.flush()
+        scripts = [
+            Script(script=f"0014{i:040x}", wallet=wallet, confirmed=1000, unconfirmed=5)
+            for i in range(2)
+        ]
+        db.session.add_all(scripts)
+        db.session.flush()
+        for s in scripts:
+            db.session.add(Tx(txid="aa" * 32, wallet_id=wallet.id, script_id=s.id))
+        WalletAggregate.query.delete()
+        SchemaVersion.query.filter_by(version=2).delete()
+        db.session.commit()
+
+        migrate()
+        aggregate = WalletAggregate.query.get(wallet.id)
+        assert (aggregate.confirmed, aggregate.unconfirmed, aggregate.txcount) == (
+            2000,
+            10,
+            1,
+        )
+        assert WalletAggregate.query.get(empty_wallet.id).txcount == 0
+
+
+def _init_db(datadir, barrier):
+    app = Flask("concurrent")
+    app.config.update(
+        SPECTRUM_DATADIR=datadir,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{datadir}/wallets.sqlite",
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    )
+    barrier.wait()
+    init_db(app)
+
+
+def test_concurrent_init_db(tmp_path):
+    """Several workers (e.g. of gunicorn) start on a fresh database at once"""
+    ctx = multiprocessing.get_context("fork")
+    barrier = ctx.Barrier(4)
+    processes = [
+        ctx.Process(target=_init_db, args=(str(tmp_path), barrier)) for _ in range(4)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join(60)
+    assert [p.exitcode for p in processes] == [0] * 4
@@ -0,0 +1,87 @@
+import random
+
+from flask import Flask
+from sqlalchemy import text
+
+from cryptoadvance.spectrum.db import Tx, Wallet, db
+from cryptoadvance.spectrum.pagination import (
+    KeysetCache,
+    _page_parts,
+    iter_page_oldest_first,
+    ordered_page,
+    sort_key,
+)
+
+
+def test_ordered_page(app: Flask):
+    with app.app_context():
+        wallet = Wallet(name="paged_wallet")
+        db.session.add(wallet)
+        db.session.flush()
+        heights = [random.choice([None, 0, -1, 5, 5, 7, 100]) for _ in range(57)]
+        for i, height in enumerate(heights):
+            db.session.add(Tx(txid=f"{i:064x}", height=height, wallet_id=wallet.id))
+        db.session.commit()
+
+        txs = Tx.query.filter_by(wallet_id=wallet.id).all()
+        expected = [
+            tx.id for tx in sorted(txs, key=lambda tx: sort_key(tx), reverse=True)
+        ]
+        query = db.session.query(Tx.id, Tx.height).filter(Tx.wallet_id == wallet.id)
+        assert [r.id for r in ordered_page(query, 100)] == expected
+
+        # offset- and keyset-pages are the same
+        after = None
+        for skip in range(0, 60, 10):
+            by_offset = ordered_page(query, 10, skip=skip)
+            assert [r.id for r in by_offset] == expected[skip : skip + 10]
+            if after is not None:
+                by_key = ordered_page(query, 10, after=after)
+                assert by_key == by_offset
+            after = sort_key(by_offset[-1]) if by_offset else None
+        assert ordered_page(query, 0) == []
+
+        # the same pages, oldest first and read in chunks
+        after = None
+        for skip in range(0, 60, 7):
+            expected_page = [r.id for r in reversed(ordered_page(query, 7, skip=skip))]
+            by_offset = iter_page_oldest_first(query, 7, skip=skip, yield_per=3)
+            assert [r.id for r in by_offset] == expected_page
+            if after is not None:
+                by_key = iter_page_oldest_first(query, 7, after=after, yield_per=3)
+                assert [r.id for r in by_key] == expected_page
+            rows = ordered_page(query, 7, skip=skip)
+            after = sort_key(rows[-1]) if rows else None
+        assert list(iter_page_oldest_first(query, 0)) == []
+
+
+def test_confirmed_part_uses_index(app: Flask):
+    """The confirmed rows of a page are read in index order, without sorting them"""
+    with app.app_context():
+        wallet = Wallet(name="planned_wallet")
+        db.session.add(wallet)
+        db.session.flush()
+        for i, height in enumerate([None, 3, 5, 7]):
+            db.session.add(Tx(txid=f"{i:064x}", height=height, wallet_id=wallet.id))
+        db.session.commit()
+        query = db.session.query(Tx.id, Tx.height).filter(Tx.wallet_id == wallet.id)
+        parts = _page_parts(query, 10, skip=2)
+        assert [columns for _, columns in parts] == [["height", "id"]]
+        page, _ = parts[0]
+        sql = page.statement.compile(compile_kwargs={"literal_binds": True})
+        plan = db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        details = " ".join(row[-1] for row in plan)
+        assert "ix_spectrum_tx_wallet_height_id" in details
+        assert "TEMP B-TREE" not in details
+
+
+def test_keyset_cache():
+    cache = KeysetCache(maxsize=2)
+    cache.put("wallet", 10, (False, 5, 1))
+    cache.put("wallet", 20, (False, 4, 1))
+    assert cache.get("wallet", 10) == (False, 5, 1)
+    cache.put("wallet", 30, (False, 3, 1))
+    # the least recently used one got evicted
+    assert cache.get("wallet", 20) is None
+    assert cache.get("wallet", 10) == (False, 5, 1)
+    assert cache.get("other_wallet", 10) is None
@@ -0,0 +1,106 @@
+import threading
+import time
+
+from conftest import spectrum_app_with_config
+
+from cryptoadvance.spectrum.profiling import (
+    SamplingProfiler,
+    SlowCallRecorder,
+    add_stage_time,
+)
+
+
+def _busy_function(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler():
+    profiler = SamplingProfiler(interval=0.001)
+    stop = threading.Event()
+    thread = threading.Thread(target=_busy_function, args=[stop], name="busy")
+    thread.start()
+    profiler.start()
+    time.sleep(0.2)
+    folded = profiler.stop()
+    stop.set()
+    thread.join()
+    assert not profiler.running
+    assert profiler.samples > 0
+    busy = [line for line in folded.splitlines() if line.startswith("busy;")]
+    assert busy and "_busy_function" in busy[0]
+    stack, count = busy[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+
+def test_slow_call_recorder():
+    recorder = SlowCallRecorder(threshold_ms=0)
+    with recorder.track("getbalances", "w", []) as call:
+        call.response = {}
+    assert not recorder.calls
+    recorder.set_threshold(10)
+    with recorder.track("fast", "w", []) as call:
+        call.response = {}
+    params = [[{"desc": "wpkh(tprv8ZgxMBicQKsPd/0/*)", "timestamp": "now"}]]
+    with recorder.track("importdescriptors", "w", params) as call:
+        add_stage_time("electrum", 0.01)
+        time.sleep(0.02)
+        call.response = {"result": [{"success": True}]}
+    # nothing is tracked outside of calls
+    add_stage_time("electrum", 1)
+    (slow,) = recorder.calls
+    assert slow["method"] == "importdescriptors"
+    assert slow["params"] == [[{"desc": "***", "timestamp": "now"}]]
+    assert slow["ms"] >= 20
+    assert slow["stages_ms"]["electrum"] == 10
+    assert set(slow["stages_ms"]) == {"electrum", "serialization", "other"}
+
+
+def test_redacted_params():
+    recorder = SlowCallRecorder(threshold_ms=0.001)
+    wif = "cVt4o7BGAig1UXywgGSmARhxMdzP5qvQsxKkSsc1XEkw3tDTQFpy"
+    calls = [
+        ("createwallet", ["w", False, False, "secret"]),
+        ("createwallet", {"wallet_name": "w", "passphrase": "secret"}),
+        ("importdescriptors", [[{"desc": f"wpkh({wif})"}]]),
+        ("gettransaction", ["ab" * 32]),
+    ]
+    for method, params in calls:
+        with recorder.track(method, "w", params) as call:
+            time.sleep(0.002)
+            call.response = {}
+    assert [c["params"] for c in recorder.calls] == [
+        ["w", False, False, "***"],
+        {"wallet_name": "w", "passphrase": "***"},
+        [[{"desc": "***"}]],
+        ["ab" * 32],
+    ]
+
+
+def test_admin_endpoints():
+    app = spectrum_app_with_config(
+        config={"ADMIN_TOKEN": "secret", "SLOW_CALL_THRESHOLD_MS": 1}
+    )
+    client = app.test_client()
+    auth = {"Authorization": "Bearer secret"}
+    try:
+        assert client.post("/admin/profiler/start").status_code == 401
+        assert client.post("/admin/profiler/start", headers=auth).json["running"]
+        time.sleep(0.05)
+        response = client.post("/admin/profiler/stop", headers=auth)
+        assert response.status_code == 200
+        assert "spectrum-writer" in response.get_data(as_text=True)
+        with app.app_context():
+            # listwallets is fast, but even that queries the database
+            app.spectrum.slow_calls.set_threshold(0.001)
+            app.spectrum.jsonrpc({"method": "listwallets", "params": []})
+        calls = client.get("/admin/slow-calls", headers=auth).json["calls"]
+        assert calls[-1]["method"] == "listwallets"
+        assert "db" in calls[-1]["stages_ms"]
+        response = client.delete("/admin/slow-calls?threshold_ms=0", headers=auth)
+        assert response.json == {"threshold_ms": 0, "calls": []}
+    finally:
+        app.spectrum.stop()
+    app = spectrum_app_with_config()
+    assert app.test_client().get("/admin/slow-calls").status_code == 404
+    app.spectrum.stop()
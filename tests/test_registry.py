@@ -0,0 +1,44 @@
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from cryptoadvance.spectrum.db import Descriptor, Wallet, db
+from cryptoadvance.spectrum.registry import WalletRegistry
+
+
+def test_wallet_registry(app: Flask):
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        # other threads of the app might query other tables
+        if "spectrum_wallet" in statement.lower():
+            statements.append(statement)
+
+    with app.app_context():
+        wallet = Wallet(name="registered_wallet")
+        db.session.add(wallet)
+        db.session.flush()
+        db.session.add(
+            Descriptor(wallet_id=wallet.id, descriptor="wpkh(xpub/0/*)", active=True)
+        )
+        db.session.commit()
+        wallet_id = wallet.id
+
+    registry = WalletRegistry()
+    with app.app_context():
+        assert registry.get("unknown_wallet") is None
+        assert registry.get("registered_wallet").id == wallet_id
+    event.listen(Engine, "before_cursor_execute", count)
+    try:
+        with app.app_context():
+            wallet = registry.get("registered_wallet")
+            assert wallet.get_descriptor(internal=False).descriptor == "wpkh(xpub/0/*)"
+            assert wallet in db.session
+        assert statements == []
+
+        registry.invalidate(wallet_id)
+        with app.app_context():
+            assert registry.get("registered_wallet").id == wallet_id
+        assert len(statements) > 0
+    finally:
+        event.remove(Engine, "before_cursor_execute", count)
@@ -0,0 +1,35 @@
+from cryptoadvance.spectrum.rpc_cache import ResponseCache
+
+
+def test_response_cache():
+    cache = ResponseCache(maxsize=2)
+    calls = []
+
+    def compute(value):
+        def fn():
+            calls.append(value)
+            return value
+
+        return fn
+
+    assert cache.call(1, "getbalances", [], 100, compute("a")) == "a"
+    assert cache.call(1, "getbalances", [], 100, compute("b")) == "a"
+    assert calls == ["a"]
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+    # a new tip or a new version of the wallet
+    assert cache.call(1, "getbalances", [], 101, compute("c")) == "c"
+    cache.bump(1)
+    assert cache.version(1) == 1
+    assert cache.call(1, "getbalances", [], 101, compute("d")) == "d"
+    # other wallets are unaffected, params are part of the key
+    assert cache.version(2) == 0
+    assert cache.call(1, "listtransactions", {"count": 1}, 101, compute("e")) == "e"
+    assert cache.call(1, "listtransactions", {"count": 2}, 101, compute("f")) == "f"
+    # LRU
+    assert cache.stats()["size"] == 2
+    assert cache.call(1, "listtransactions", {"count": 1}, 101, compute("g")) == "e"
+    assert cache.call(1, "getbalances", [], 101, compute("h")) == "h"
+    # disabled
+    cache = ResponseCache(maxsize=0)
+    assert cache.call(1, "getbalances", [], 100, compute("i")) == "i"
+    assert cache.call(1, "getbalances", [], 100, compute("j")) == "j"
@@ -3,7 +3,15 @@ import time
 from unittest.mock import MagicMock
 
 from flask import Flask
-from cryptoadvance.spectrum.db import Descriptor, Script, Wallet
+from cryptoadvance.spectrum.db import (
+    UTXO,
+    Descriptor,
+    Script,
+    Tx,
+    TxCategory,
+    Wallet,
+    db,
+)
 from cryptoadvance.spectrum.spectrum import Spectrum
 from embit.descriptor.checksum import add_checksum
 from embit.bip32 import NETWORKS
@@ -54,3 +62,140 @@ def test_importdescriptor(app: Flask, rootkey_hold_accident, acc0key0addr_hold_a
     spectrum.stop()
     del spectrum
 
+
+
+def test_importdescriptor_gap_limit(app: Flask, rootkey_hold_accident):
+    """Scripts get derived lazily: only GAP_LIMIT beyond the last used one"""
+    spectrum: Spectrum = app.spectrum
+    spectrum.sock = MagicMock()
+    spectrum.sock.call.return_value = None  # nothing happened on any script
+    tpriv = rootkey_hold_accident.to_base58(version=NETWORKS["regtest"]["xprv"])
+    desc = add_checksum("wpkh(" + tpriv + "/84h/1h/0h/0/*)")
+    gap_limit = app.config["GAP_LIMIT"]
+    with app.test_request_context():
+        spectrum.createwallet("gappy_wallet", disable_private_keys=True)
+        wallet: Wallet = Wallet.query.filter_by(name="gappy_wallet").first()
+        spectrum.importdescriptor(wallet, desc, active=True)
+        descriptor: Descriptor = Descriptor.query.filter_by(wallet=wallet).first()
+        assert Script.query.filter_by(descriptor=descriptor).count() == gap_limit
+        assert descriptor.max_derived_index() == gap_limit - 1
+        assert wallet.get_keypool(internal=False) == gap_limit
+        assert wallet.get_keypool(internal=True) == 0
+
+        # activity close to the edge extends the window
+        script = Script.query.filter_by(descriptor=descriptor, index=5).first()
+        spectrum._extend_gap(script).result(timeout=5)
+        db.session.expire_all()
+        assert descriptor.next_index == 6
+        assert descriptor.max_derived_index() == 6 + gap_limit - 1
+        assert wallet.get_keypool(internal=False) == gap_limit
+        # the new scripts got subscribed (in a thread)
+        last = Script.query.filter_by(descriptor=descriptor, index=6 + gap_limit - 1)
+        subscription = (("blockchain.scripthash.subscribe", [last.first().scripthash]),)
+        for _ in range(50):
+            if subscription in spectrum.sock.call.call_args_list:
+                break
+            time.sleep(0.1)
+        spectrum.sock.call.assert_any_call(*subscription[0])
+
+        # activity on an old address doesn't change anything
+        script = Script.query.filter_by(descriptor=descriptor, index=2).first()
+        assert spectrum._extend_gap(script) is None
+        assert descriptor.next_index == 6
+        assert descriptor.max_derived_index() == 6 + gap_limit - 1
+
+
+def test_importdescriptor_range(app: Flask, rootkey_hold_accident):
+    """An explicit range gets derived (and watched) despite the GAP_LIMIT"""
+    spectrum: Spectrum = app.spectrum
+    spectrum.sock = MagicMock()
+    spectrum.sock.call.return_value = None
+    tpriv = rootkey_hold_accident.to_base58(version=NETWORKS["regtest"]["xprv"])
+    desc = add_checksum("wpkh(" + tpriv + "/84h/1h/0h/0/*)")
+    with app.test_request_context():
+        spectrum.createwallet("ranged_wallet", disable_private_keys=True)
+        wallet: Wallet = Wallet.query.filter_by(name="ranged_wallet").first()
+        spectrum.importdescriptor(wallet, desc, active=True, range=100)
+        descriptor: Descriptor = Descriptor.query.filter_by(wallet=wallet).first()
+        assert descriptor.max_derived_index() == 99
+        script = Script.query.filter_by(descriptor=descriptor, index=99).first()
+        # subscribed in a thread
+        subscription = (("blockchain.scripthash.subscribe", [script.scripthash]),)
+        for _ in range(50):
+            if subscription in spectrum.sock.call.call_args_list:
+                break
+            time.sleep(0.1)
+        spectrum.sock.call.assert_any_call(*subscription[0])
+        # [begin, end] includes the end, like in Core
+        spectrum.createwallet("ranged_wallet2", disable_private_keys=True)
+        wallet = Wallet.query.filter_by(name="ranged_wallet2").first()
+        spectrum.importdescriptor(wallet, desc, active=True, range=[0, 150])
+        descriptor = Descriptor.query.filter_by(wallet=wallet).first()
+        assert descriptor.max_derived_index() == 150
+
+
+def test_listunspent_listtransactions(app: Flask, rootkey_hold_accident):
+    spectrum: Spectrum = app.spectrum
+    spectrum.sock = MagicMock()
+    spectrum.sock.call.return_value = None
+    tpriv = rootkey_hold_accident.to_base58(version=NETWORKS["regtest"]["xprv"])
+    desc = add_checksum("wpkh(" + tpriv + "/84h/1h/0h/0/*)")
+    with app.test_request_context():
+        spectrum.createwallet("listing_wallet", disable_private_keys=True)
+        wallet: Wallet = Wallet.query.filter_by(name="listing_wallet").first()
+        spectrum.importdescriptor(wallet, desc, active=True)
+        script = Script.query.filter_by(wallet=wallet, index=3).first()
+        db.session.add(
+            UTXO(
+                txid="ab" * 32,
+                vout=1,
+                height=100,
+                amount=1000,
+                script=script,
+                wallet=wallet,
+            )
+        )
+        db.session.add(
+            Tx(
+                txid="ab" * 32,
+                height=100,
+                blocktime=1234,
+                amount=1000,
+                vout=1,
+                category=TxCategory.RECEIVE,
+                script=script,
+                wallet=wallet,
+            )
+        )
+        db.session.commit()
+        spectrum.blocks = 101
+
+        (utxo,) = spectrum.listunspent(wallet)
+        assert utxo["txid"] == "ab" * 32
+        assert utxo["confirmations"] == 2
+        assert utxo["address"] == script.address(spectrum.network)
+        assert utxo["scriptPubKey"] == script.script
+        assert utxo["desc"] == script.descriptor.derive(3)
+
+        (tx,) = spectrum.listtransactions(wallet)
+        assert tx == Tx.query.filter_by(wallet=wallet).first().to_dict(
+            spectrum.blocks, spectrum.network
+        )
+        assert tx["address"] == utxo["address"]
+        assert tx["category"] == "receive"
+        assert spectrum.listtransactions(wallet, label="") == [tx]
+        spectrum.setlabel(wallet, tx["address"], "coffee")
+        assert spectrum.listtransactions(wallet, label="coffee") == [tx]
+        assert spectrum.listtransactions(wallet, label="") == []
+        assert spectrum.listtransactions(wallet, skip=1) == []
+
+        # polls are cached until the wallet changes
+        rpc = dict(method="listlabels", params=[], id=1)
+        labels = spectrum.jsonrpc(rpc, wallet_name="listing_wallet")["result"]
+        assert "coffee" in labels
+        hits = spectrum.responses.hits
+        assert spectrum.jsonrpc(rpc, wallet_name="listing_wallet")["result"] == labels
+        assert spectrum.responses.hits == hits + 1
+        spectrum.setlabel(wallet, tx["address"], "tea")
+        labels = spectrum.jsonrpc(rpc, wallet_name="listing_wallet")["result"]
+        assert "tea" in labels and "coffee" not in labels
@@ -0,0 +1,136 @@
+import json
+
+from flask import Flask
+
+from cryptoadvance.spectrum.db import Script, Tx, TxCategory, db
+from cryptoadvance.spectrum.metrics import RPC_LATENCY, metrics
+from cryptoadvance.spectrum.rpc_cache import ResponseCache
+from cryptoadvance.spectrum.spectrum_error import RPCError
+from cryptoadvance.spectrum.streaming import StreamedList, json_chunks
+from cryptoadvance.spectrum.tracing import tracer
+
+
+def test_json_chunks():
+    response = {"result": [{"a": 1}, {"b": [2, 3]}], "error": None, "id": "x"}
+    assert "".join(json_chunks(response)) == json.dumps(response)
+    streamed = dict(response, result=StreamedList(iter(response["result"])))
+    chunks = list(json_chunks(streamed, chunk_size=1))
+    assert len(chunks) == 3
+    assert "".join(chunks) == json.dumps(response)
+    empty = {"result": StreamedList(iter([])), "error": None, "id": 1}
+    assert "".join(json_chunks(empty)) == json.dumps(dict(empty, result=[]))
+
+
+def test_streamed_list():
+    def failing():
+        raise RPCError("Invalid label name", -11)
+        yield
+
+    # errors before the first item are raised right away
+    try:
+        StreamedList(failing())
+        assert False
+    except RPCError as e:
+        assert e.code == -11
+
+    cache = ResponseCache(maxsize=10)
+    calls = []
+
+    def items(n):
+        calls.append(n)
+        return iter(range(n))
+
+    res = cache.stream(1, "listunspent", [], 100, lambda: items(2), keep=2)
+    assert isinstance(res, StreamedList)
+    assert list(res) == [0, 1]
+    # small results get cached once they're through
+    assert cache.stream(1, "listunspent", [], 100, lambda: items(2), keep=2) == [0, 1]
+    assert calls == [2]
+    # big ones don't
+    res = cache.stream(1, "listunspent", [1], 100, lambda: items(3), keep=2)
+    assert list(res) == [0, 1, 2]
+    res = cache.stream(1, "listunspent", [1], 100, lambda: items(3), keep=2)
+    assert isinstance(res, StreamedList)
+    assert calls == [2, 3, 3]
+
+
+def test_streamed_rpc(app: Flask):
+    client = app.test_client()
+    with app.app_context():
+        app.spectrum.createwallet("streamed_wallet", disable_private_keys=True)
+        wallet = app.spectrum.get_wallet("streamed_wallet")
+        script = Script(script="0014" + "33" * 20, wallet=wallet)
+        db.session.add(script)
+        db.session.flush()
+        for i in range(30):
+            db.session.add(
+                Tx(
+                    txid=f"{i:064x}",
+                    height=100 + i // 3 if i < 25 else None,
+                    vout=0,
+                    amount=1000,
+                    category=TxCategory.RECEIVE,
+                    script_id=script.id,
+                    wallet_id=wallet.id,
+                )
+            )
+        db.session.commit()
+        expected = app.spectrum.listtransactions(wallet, count=20, skip=5)
+
+    def call(method, params):
+        return client.post(
+            "/wallet/streamed_wallet",
+            json={"method": method, "params": params, "id": 7},
+        )
+
+    res = call("listtransactions", ["*", 20, 5])
+    assert res.mimetype == "application/json"
+    assert res.json["error"] is None
+    assert [tx["txid"] for tx in res.json["result"]] == [tx["txid"] for tx in expected]
+    assert call("listunspent", []).json == {"result": [], "error": None, "id": 7}
+    # invalid params still get an error-response
+    res = call("listtransactions", {"unknown": 1})
+    assert json.loads(res.data)["error"]["code"] == -500
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def shutdown(self):
+        pass
+
+
+def test_streamed_call_observed(app: Flask):
+    """Metrics, span and slow-call record of a streamed call end with the stream"""
+    spectrum = app.spectrum
+    exporter = ListExporter()
+    metrics.enable()
+    tracer.enable(exporter)
+    spectrum.slow_calls.set_threshold(0.001)
+    try:
+        with app.app_context():
+            spectrum.createwallet("observed_wallet", disable_private_keys=True)
+            latency_count = RPC_LATENCY.count("listtransactions")
+            response = spectrum.jsonrpc(
+                {"method": "listtransactions", "params": ["*", 1000]},
+                wallet_name="observed_wallet",
+                stream=True,
+            )
+            assert isinstance(response["result"], StreamedList)
+            assert not [s for s in exporter.spans if s.name.startswith("jsonrpc")]
+            assert RPC_LATENCY.count("listtransactions") == latency_count
+            json.loads("".join(json_chunks(response)))
+    finally:
+        tracer.disable()
+        metrics.disable()
+    assert RPC_LATENCY.count("listtransactions") == latency_count + 1
+    (span,) = [s for s in exporter.spans if s.name == "jsonrpc listtransactions"]
+    assert span.end is not None and span.error is None
+    record = spectrum.slow_calls.calls[-1]
+    assert record["method"] == "listtransactions"
+    assert record["streamed"]
+    assert "serialization" not in record["stages_ms"]
@@ -0,0 +1,97 @@
+import json
+
+from conftest import spectrum_app_with_config
+from sqlalchemy import create_engine, text
+
+from cryptoadvance.spectrum.tracing import FileSpanExporter, Span, tracer
+from cryptoadvance.spectrum.util import FlaskThread
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def shutdown(self):
+        pass
+
+
+def test_spans():
+    exporter = ListExporter()
+    assert tracer.span("disabled").__enter__() is None
+    tracer.enable(exporter)
+    try:
+        engine = create_engine("sqlite://")
+        with engine.connect() as connection:
+            # queries outside of a trace are not recorded
+            connection.execute(text("SELECT 1"))
+            with tracer.span("root", **{"rpc.method": "getbalances"}) as root:
+                connection.execute(text("SELECT 2"))
+                thread = FlaskThread(target=_child_span)
+                thread.start()
+                thread.join()
+            try:
+                with tracer.span("failing"):
+                    raise ValueError("boom")
+            except ValueError:
+                pass
+    finally:
+        tracer.disable()
+    spans = {span.name: span for span in exporter.spans}
+    assert set(spans) == {"root", "db.query", "child", "failing"}
+    assert spans["db.query"].attributes["db.statement"] == "SELECT 2"
+    assert spans["db.query"].parent_id == root.span_id
+    # the thread continued the trace
+    assert spans["child"].parent_id == root.span_id
+    assert spans["child"].trace_id == root.trace_id
+    assert spans["failing"].trace_id != root.trace_id
+    assert spans["failing"].error == "ValueError: boom"
+    assert spans["root"].end >= spans["root"].start
+
+
+def _child_span():
+    with tracer.span("child"):
+        pass
+
+
+def test_file_exporter(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    exporter = FileSpanExporter(path, interval=60)
+    span = Span("root", attributes={"n": 1, "ok": True, "s": "x"})
+    tracer.finish(span)  # not exported, tracing is disabled
+    span.end = span.start + 1000
+    exporter.export(span)
+    exporter.shutdown()
+    with open(path) as f:
+        (line,) = f.readlines()
+    (otlp_span,) = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert otlp_span["traceId"] == span.trace_id
+    assert "parentSpanId" not in otlp_span
+    assert otlp_span["endTimeUnixNano"] == str(span.start + 1000)
+    assert otlp_span["attributes"] == [
+        {"key": "n", "value": {"intValue": "1"}},
+        {"key": "ok", "value": {"boolValue": True}},
+        {"key": "s", "value": {"stringValue": "x"}},
+    ]
+
+
+def test_tracing_rpc(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    app = spectrum_app_with_config(config={"TRACING_FILE": path})
+    try:
+        with app.app_context():
+            app.spectrum.jsonrpc({"method": "listwallets"})
+    finally:
+        tracer.disable()
+        app.spectrum.stop()
+    with open(path) as f:
+        spans = [
+            span
+            for line in f
+            for span in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        ]
+    (rpc,) = [span for span in spans if span["name"] == "jsonrpc listwallets"]
+    queries = [span for span in spans if span.get("parentSpanId") == rpc["spanId"]]
+    assert queries and all(span["name"] == "db.query" for span in queries)
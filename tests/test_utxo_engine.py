@@ -0,0 +1,54 @@
+from embit.script import Script
+from embit.transaction import Transaction, TransactionInput, TransactionOutput
+
+from cryptoadvance.spectrum.utxo_engine import derive_script_state, state_matches
+
+MY_SCRIPT = Script(bytes.fromhex("0014" + "11" * 20))
+OTHER_SCRIPT = Script(bytes.fromhex("0014" + "22" * 20))
+
+
+def test_derive_script_state():
+    # funding tx from somewhere else, confirmed
+    funding = Transaction(
+        vin=[TransactionInput(bytes.fromhex("aa" * 32), 0)],
+        vout=[TransactionOutput(1000, MY_SCRIPT), TransactionOutput(7, OTHER_SCRIPT)],
+    )
+    funding_txid = funding.txid().hex()
+    txs = {funding_txid: funding}
+    history = [{"tx_hash": funding_txid, "height": 100}]
+    utxos, balance = derive_script_state(MY_SCRIPT, history, txs)
+    assert utxos == [
+        {"tx_hash": funding_txid, "tx_pos": 0, "height": 100, "value": 1000}
+    ]
+    assert balance == {"confirmed": 1000, "unconfirmed": 0}
+
+    # spending it in the mempool with some change back to us
+    spending = Transaction(
+        vin=[TransactionInput(bytes.fromhex(funding_txid), 0)],
+        vout=[TransactionOutput(400, OTHER_SCRIPT), TransactionOutput(500, MY_SCRIPT)],
+    )
+    spending_txid = spending.txid().hex()
+    txs[spending_txid] = spending
+    history.append({"tx_hash": spending_txid, "height": -1})
+    utxos, balance = derive_script_state(MY_SCRIPT, history, txs)
+    assert utxos == [{"tx_hash": spending_txid, "tx_pos": 1, "height": 0, "value": 500}]
+    # like electrum: unconfirmed is the mempool-delta
+    assert balance == {"confirmed": 1000, "unconfirmed": -500}
+
+    # and now it's confirmed
+    history[1]["height"] = 101
+    utxos, balance = derive_script_state(MY_SCRIPT, history, txs)
+    assert utxos[0]["height"] == 101
+    assert balance == {"confirmed": 500, "unconfirmed": 0}
+
+
+def test_state_matches():
+    utxos = [{"tx_hash": "ab" * 32, "tx_pos": 1, "height": 0, "value": 500}]
+    balance = {"confirmed": 0, "unconfirmed": 500}
+    assert state_matches(utxos, balance, list(utxos), dict(balance))
+    # electrum doesn't care about the order
+    assert state_matches([], balance, [], {"unconfirmed": 500, "confirmed": 0})
+    assert not state_matches(utxos, balance, [], balance)
+    assert not state_matches(
+        utxos, balance, utxos, {"confirmed": 500, "unconfirmed": 0}
+    )
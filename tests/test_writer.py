@@ -0,0 +1,49 @@
+import pytest
+from flask import Flask
+
+from cryptoadvance.spectrum.batching import CommitBatcher
+from cryptoadvance.spectrum.db import Wallet, db
+from cryptoadvance.spectrum.writer import WriteQueue
+
+
+def _add_wallet(name):
+    db.session.add(Wallet(name=name))
+    db.session.flush()
+    return name
+
+
+def _fail(name):
+    _add_wallet(name)
+    raise ValueError("nope")
+
+
+def _nested(writer, name):
+    # units submitted by a unit are part of its batch
+    writer.submit(_add_wallet, name + "_inner").result()
+    return _add_wallet(name)
+
+
+def test_write_queue(app: Flask):
+    writer = WriteQueue(app, CommitBatcher(every=10, interval_ms=10000))
+    writer.start()
+    with app.app_context():
+        futures = [writer.submit(_add_wallet, f"queued_{i}") for i in range(20)]
+        failing = writer.submit(_fail, "failing")
+        futures.append(writer.submit(_add_wallet, "after_failing"))
+        futures.append(writer.submit(_nested, writer, "nested"))
+        assert [f.result(timeout=10) for f in futures][-2:] == [
+            "after_failing",
+            "nested",
+        ]
+        with pytest.raises(ValueError):
+            failing.result(timeout=10)
+        assert writer.stop(timeout=10)
+
+        names = {w.name for w in Wallet.query.all()}
+        assert {f"queued_{i}" for i in range(20)} <= names
+        assert {"after_failing", "nested", "nested_inner"} <= names
+        assert "failing" not in names
+
+        # without a thread, units are applied in the calling thread
+        assert writer.call(_add_wallet, "inline") == "inline"
+        assert Wallet.query.filter_by(name="inline").count() == 1